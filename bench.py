@@ -0,0 +1,168 @@
+#%% Benchmark Module
+#
+# Runs every endpoint against a local `MockServer` (see `pyCMC/mock.py`) in each client
+# mode and reports requests/sec, p50/p99 latency, bytes decoded/sec and peak memory.
+# Needs no API key or network access.
+#
+#     python bench.py --requests 200 --concurrency 8 --latency 0.02
+import argparse
+import asyncio
+import importlib.util
+import multiprocessing
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from pyCMC import CMC
+from pyCMC.decoders import get_decoder
+from pyCMC.mock import MockServer, Universe
+
+IDS = ','.join(str(i) for i in range(1, 101))
+
+ENDPOINTS = {
+	'map' : lambda c, **kw: c.map(limit=5000, **kw),
+	'info' : lambda c, **kw: c.metadata(coinId=IDS, **kw),
+	'listings' : lambda c, **kw: c.listings(limit=5000, **kw),
+	'quotes' : lambda c, **kw: c.quotes(coinId=IDS, **kw),
+	'historical_quotes' : lambda c, **kw: c.historical_quotes(coinId='1', count=1000, interval='5m', **kw),
+	'market_pairs' : lambda c, **kw: c.market_pairs(coinId='1', limit=5000, **kw),
+	'ohlcv_latest' : lambda c, **kw: c.ohlcv_latest(coinId=IDS, **kw),
+	'ohlcv_historical' : lambda c, **kw: c.ohlcv_historical(coinId='1', count=1000, interval='daily', **kw),
+	'global_metrics' : lambda c, **kw: c.global_metrics(**kw),
+	'convert_price' : lambda c, **kw: c.convert_price(1, coinId='1', convert='USD', **kw),
+}
+
+STREAMABLE = ('map', 'info', 'listings', 'quotes', 'market_pairs')
+
+class CountingDecoder(object):
+
+	def __init__(self, name):
+		self.decode = get_decoder(name)
+		self.bytes = 0
+
+	def __call__(self, body):
+		self.bytes += len(body)
+		return self.decode(body)
+
+def serve(queue, latency, pairs):
+	server = MockServer(Universe(coins=10_000, inactive=2_000, pairs=pairs), latency=latency).start()
+	queue.put(server.root_url)
+	while True:
+		time.sleep(3600)
+
+def client(root_url, decoder, **kwargs):
+	cmc = CMC('bench', decoder=decoder, **kwargs)
+	cmc.root_url = root_url
+	return cmc
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+def run_sync(cmc, call, n, concurrency, stream):
+
+	def one(_):
+		started = time.perf_counter()
+		if stream:
+			result = call(cmc, stream=True)
+			for _ in result:
+				pass
+			ok = result.status and result.status.get('error_code') == 0
+		else:
+			ok = call(cmc)['status']['error_code'] == 0
+		return time.perf_counter() - started, ok
+
+	with ThreadPoolExecutor(concurrency) as pool:
+		return list(pool.map(one, range(n)))
+
+def run_async(root_url, decoder, call, n, concurrency):
+
+	from pyCMC import AsyncCMC
+
+	async def main():
+		async with AsyncCMC('bench', concurrency=concurrency, decoder=decoder) as cmc:
+			cmc.root_url = root_url
+
+			async def one():
+				started = time.perf_counter()
+				ok = (await call(cmc))['status']['error_code'] == 0
+				return time.perf_counter() - started, ok
+
+			return await asyncio.gather(*[one() for _ in range(n)])
+
+	return asyncio.run(main())
+
+def measure(mode, name, root_url, args):
+
+	decoder = CountingDecoder('json' if mode == 'stdlib-json' else 'auto')
+	call = ENDPOINTS[name]
+
+	def go(n):
+		if mode == 'async':
+			return run_async(root_url, decoder, call, n, args.concurrency)
+		cmc = client(root_url, decoder, pool_size=args.concurrency, cache=(mode == 'cache'))
+		try:
+			return run_sync(cmc, call, n, args.concurrency, mode == 'stream')
+		finally:
+			cmc.close()
+
+	# Peak memory from a short separate pass, since tracing slows everything down.
+	tracemalloc.start()
+	go(min(args.concurrency, args.requests))
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	decoder.bytes = 0
+	started = time.perf_counter()
+	results = go(args.requests)
+	elapsed = time.perf_counter() - started
+
+	latencies = [r[0] for r in results]
+	return {
+		'mode' : mode,
+		'endpoint' : name,
+		'req/s' : len(results) / elapsed,
+		'p50 ms' : percentile(latencies, 50) * 1000,
+		'p99 ms' : percentile(latencies, 99) * 1000,
+		'MB/s' : decoder.bytes / elapsed / 1e6,
+		'peak MB' : peak / 1e6,
+		'errors' : sum(1 for r in results if not r[1]),
+	}
+
+def main():
+
+	parser = argparse.ArgumentParser(description='Benchmark pyCMC against a local mock API.')
+	parser.add_argument('--requests', type=int, default=50, help='requests per endpoint and mode')
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds added by the server')
+	parser.add_argument('--pairs', type=int, default=5000, help='market pairs per coin')
+	parser.add_argument('--modes', default='plain,stdlib-json,cache,stream,async')
+	parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+	args = parser.parse_args()
+
+	queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target=serve, args=(queue, args.latency, args.pairs), daemon=True)
+	server.start()
+	root_url = queue.get()
+
+	columns = ['mode', 'endpoint', 'req/s', 'p50 ms', 'p99 ms', 'MB/s', 'peak MB', 'errors']
+	print(''.join('{:>18}'.format(c) for c in columns))
+
+	try:
+		for mode in args.modes.split(','):
+			if mode == 'async' and importlib.util.find_spec('aiohttp') is None:
+				print('{:>18}  skipped, aiohttp is not installed'.format(mode))
+				continue
+			for name in args.endpoints.split(','):
+				if mode == 'stream' and name not in STREAMABLE:
+					continue
+				row = measure(mode, name, root_url, args)
+				print(''.join(
+					'{:>18.2f}'.format(row[c]) if isinstance(row[c], float) else '{:>18}'.format(row[c])
+					for c in columns
+				))
+	finally:
+		server.terminate()
+
+if __name__ == '__main__':
+	main()
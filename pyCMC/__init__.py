@@ -6,27 +6,286 @@ author_email: joepetrowski@protonmail.com
 license: Apache v2.0
 """
 
-from requests import Request, Session
 from requests.exceptions import ConnectionError, Timeout, TooManyRedirects
 import json
+import time
+from .backfill import Backfill, parse_time
+from .batch import Coalescer
+from .cache import ResponseCache
+from . import columnar as columns
+from . import records
+from .convert import RateMatrix
+from .decoders import get_decoder
+from .flight import Singleflight
+from .keys import KeyPool
+from .metacache import MetadataCache
+from .metrics import Metrics
+from .paging import PageIterator
+from .ratelimit import CreditScheduler
+from .refresh import Refresher
+from .resolver import Resolver
+from .shared import SharedCache, SharedScheduler
+from .store import SeriesStore
+from .stream import StreamedResponse
+from .tail import AdaptiveTimeout, CircuitBreaker, Hedger
+from .transport import Transport
+from .watch import QuoteWatcher, groups
 
 class CMC(object):
 
 	# See: https://coinmarketcap.com/api/documentation/v1/
-	def __init__(self, cmc_key):
+	#
+	# Inputs
+	# cmc_key       string, your API key. Several keys can be given as a list, a dict of
+	#               key -> plan name, or a `KeyPool`, and requests are spread over them.
+	# key_policy    string, how a key is picked from a list or dict of keys: 'round-robin',
+	#               'least-used' or 'weighted' by plan. See `pyCMC/keys.py`.
+	# pool_size     int, number of keep-alive connections kept open to the API.
+	# timeout       float or (connect, read) tuple, seconds before a request is abandoned.
+	# retries       int, retries on 429/5xx responses and connection errors.
+	# backoff       float, base delay in seconds for jittered exponential backoff between retries.
+	# cache         bool, string or `ResponseCache`, optionally cache successful responses in
+	#               memory. `True` uses a `ResponseCache` with default per-endpoint TTLs. A
+	#               string is taken as the path of a `SharedCache`, shared with every process
+	#               on the host using the same file.
+	# scheduler     string or `CreditScheduler`, optionally budget calls and credits locally.
+	#               A string is taken as the plan name (e.g. 'basic', 'standard'). With
+	#               several keys, a string gives each key its own budget instead, for the
+	#               plan it was given with or else this one (see `KeyPool.budget()`), and
+	#               `scheduler` is left `None`.
+	# coalesce      bool or `Coalescer`, optionally merge `quotes()`, `metadata()` and
+	#               `ohlcv_latest()` calls by coin ID made from different threads at about
+	#               the same time into one request. `True` uses a 10 ms window.
+	# resolver      string or `Resolver`, optionally turn `slug`/`symbol` inputs into coin IDs
+	#               locally before calling the API. A string is taken as the path of the
+	#               resolver's index file, refreshed at once if older than a day. Responses
+	#               are then keyed by ID, as if `coinId` had been passed.
+	# store         string or `SeriesStore`, optional local store for `history()`. A string
+	#               is taken as the store's directory.
+	# metadata_cache  string or `MetadataCache`, optional on-disk cache of `metadata()`
+	#               records by coin ID, kept across runs. A string is taken as its directory.
+	# decoder       string or callable, JSON decoder for response bodies: 'auto' (orjson, then
+	#               ujson, then the standard library, whichever is installed first), 'orjson',
+	#               'ujson', 'json', or any function taking bytes.
+	# metrics       bool or `Metrics`, per-endpoint counters, latency histograms and request
+	#               hooks, available as `cmc.metrics`. On by default.
+	# singleflight  bool or `Singleflight`, make identical requests made from several threads
+	#               at once share one upstream call. On by default.
+	# timeouts      bool or `AdaptiveTimeout`, optionally set each endpoint's read timeout from
+	#               its observed latency percentiles (needs `metrics`).
+	# hedge         bool or `Hedger`, optionally send a second copy of a request that is slower
+	#               than its endpoint's p95 and use whichever answers first (needs `metrics`).
+	# breaker       bool or `CircuitBreaker`, optionally fail fast with error 110 while most
+	#               recent requests fail.
+	#
+	# One client may be shared by several threads. The connection pool lives as long as the
+	# instance. Call `close()` when done, or use the client as a context manager:
+	#
+	#     with CMC(cmc_key) as cmc:
+	#         cmc.quotes(coinId='1')
+	def __init__(self, cmc_key, pool_size=10, timeout=(3.05, 30), retries=3, backoff=0.5, cache=None, scheduler=None, coalesce=None, resolver=None, store=None, decoder='auto', metrics=True, key_policy='round-robin', metadata_cache=None, singleflight=True, timeouts=None, hedge=None, breaker=None):
 		self.root_url = 'https://pro-api.coinmarketcap.com/v1/'
 		self.headers = {
 			'Accepts': 'application/json',
-			'X-CMC_PRO_API_KEY': cmc_key,
 		}
 
-	def __call__(self, url, parameters={}):
-		session = Session()
-		session.headers.update(self.headers)
+		# With several keys the key header is set on each request instead of the session.
+		self.keys = None
+		if isinstance(cmc_key, KeyPool):
+			self.keys = cmc_key
+		elif isinstance(cmc_key, (list, tuple, dict)):
+			self.keys = KeyPool(cmc_key, key_policy)
+		else:
+			self.headers['X-CMC_PRO_API_KEY'] = cmc_key
+
+		self.transport = Transport(self.headers, pool_size, timeout, retries, backoff)
+		self.decode = get_decoder(decoder)
+
+		if cache is True:
+			cache = ResponseCache()
+		elif isinstance(cache, str):
+			cache = SharedCache(cache, decode=self.decode)
+		elif cache is False:
+			cache = None
+		self.cache = cache
+
+		# Every key has its own plan limits, so several keys are budgeted one by one.
+		if isinstance(scheduler, str) and self.keys is not None:
+			self.keys.budget(scheduler)
+			scheduler = None
+		elif isinstance(scheduler, str):
+			scheduler = CreditScheduler(scheduler)
+		self.scheduler = scheduler
+
+		if coalesce is True:
+			coalesce = Coalescer()
+		elif coalesce is False:
+			coalesce = None
+		self.coalescer = coalesce
+
+		if isinstance(store, str):
+			store = SeriesStore(store)
+		self.store = store
+
+		if isinstance(metadata_cache, str):
+			metadata_cache = MetadataCache(metadata_cache, decode=self.decode)
+		self.metadata_cache = metadata_cache
+
+		if metrics is True:
+			metrics = Metrics()
+		elif metrics is False:
+			metrics = None
+		self.metrics = metrics
+
+		if singleflight is True:
+			singleflight = Singleflight()
+		elif singleflight is False:
+			singleflight = None
+		self.singleflight = singleflight
+
+		if timeouts is True:
+			timeouts = AdaptiveTimeout()
+		elif timeouts is False:
+			timeouts = None
+		self.timeouts = timeouts
+
+		if hedge is True:
+			hedge = Hedger(workers=2 * pool_size)
+		elif hedge is False:
+			hedge = None
+		self.hedger = hedge
+
+		if breaker is True:
+			breaker = CircuitBreaker()
+		elif breaker is False:
+			breaker = None
+		self.breaker = breaker
+
+		# Set by `snapshot_rates()`, used by `convert_price(..., offline=True)`.
+		self.rates = None
+
+		# Last, since a stale index is refreshed on construction, through this client.
+		if isinstance(resolver, str):
+			resolver = Resolver(self, resolver)
+		self.resolver = resolver
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.transport.close()
+		if self.hedger is not None:
+			self.hedger.close()
+
+	# Endpoint path relative to `root_url`, e.g. 'cryptocurrency/quotes/latest'.
+	def _endpoint(self, url):
+		if url.startswith(self.root_url):
+			return url[len(self.root_url):]
+		return url
+
+	# Parses a response body from bytes. Bodies that are not JSON (e.g. an HTML error page
+	# from a proxy) become an error dict.
+	def _decode(self, body, http_status):
+
+		try:
+			data = self.decode(body)
+		except ValueError:
+			data = None
+
+		if not isinstance(data, dict):
+			return self._error(107, 'Could not decode response (HTTP {}).'.format(http_status))
+		return data
+
+	# Book-keeping once a response has been decoded: charge its credits and cache it.
+	def _received(self, endpoint, parameters, data, size):
+
+		if self.scheduler is not None:
+			self.scheduler.record(data.get('status'))
+
+		if self.cache is not None and data.get('status', {}).get('error_code') == 0:
+			self.cache.set(endpoint, parameters, data, size)
+
+	# `transform`, if given, is applied to successful responses before they are returned.
+	# The cache always holds the untransformed response.
+	def __call__(self, url, parameters=None, transform=None):
+
+		if parameters is None:
+			parameters = {}
+		endpoint = self._endpoint(url)
+
+		data = None
+		if self.cache is not None:
+			data = self.cache.get(endpoint, parameters)
+
+		if self.metrics is not None:
+			self.metrics.call(endpoint, cached=data is not None)
+
+		if data is None:
+			try:
+				if self.singleflight is not None:
+					data = self.singleflight.do(endpoint, self._miss, url, parameters)
+				else:
+					data = self._miss(url, parameters)
+			finally:
+				if self.cache is not None:
+					self.cache.release(endpoint, parameters)
+
+		return self._transform(data, transform)
+
+	# A coalesced call is cached under the merged ID list when it is received, so each
+	# caller's slice of it is also cached under that caller's own parameters. A slice has
+	# no body of its own, so for a cache capped by `max_bytes` its size is that of its JSON.
+	def _miss(self, url, parameters):
+
+		endpoint = self._endpoint(url)
+		if self.coalescer is None or not self.coalescer.accepts(endpoint, parameters):
+			return self._request(url, parameters)
+
+		data = self.coalescer.submit(self._request, url, parameters)
+		if self.cache is not None and data.get('status', {}).get('error_code') == 0:
+			size = 0
+			if self.cache.max_bytes is not None:
+				size = len(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+			self.cache.set(endpoint, parameters, data, size)
+		return data
+
+	def _transform(self, data, transform):
+		if transform is not None and data.get('status', {}).get('error_code') == 0:
+			return transform(data)
+		return data
+
+	# Sends one request upstream, bypassing the cache and coalescing.
+	def _request(self, url, parameters):
+
+		endpoint = self._endpoint(url)
+
+		if self.breaker is not None:
+			ticket, limited = self.breaker.allow()
+			if limited:
+				return self._limited(endpoint, limited)
+
+		if self.scheduler is not None:
+			limited = self.scheduler.acquire()
+			if limited:
+				return self._limited(endpoint, limited)
 
+		if self.metrics is not None:
+			self.metrics.request(endpoint, parameters)
+
+		started = time.perf_counter()
 		try:
-			response = session.get(url, params=parameters)
-			data = json.loads(response.text)
+			response, key = self._hedged(endpoint, url, parameters)
+			if response is None:
+				return self._limited(endpoint, self._no_key())
+			received = time.perf_counter()
+			data = self._decode(response.content, response.status_code)
+			decoded = time.perf_counter()
+			if key is not None:
+				self.keys.record(key, data.get('status'), response.status_code)
+			self._received(endpoint, parameters, data, len(response.content))
 		except (ConnectionError, Timeout, TooManyRedirects) as e:
 			data = {
 				'status' : {
@@ -34,16 +293,182 @@ class CMC(object):
 					'error_message' : e,
 				}
 			}
+			if self.breaker is not None:
+				self.breaker.record(ticket, False)
+			if self.metrics is not None:
+				self.metrics.response(endpoint, parameters, data, time.perf_counter() - started)
+			return data
+
+		if self.breaker is not None:
+			self.breaker.record(ticket, response.status_code < 500)
+
+		if self.metrics is not None:
+			self.metrics.response(
+				endpoint, parameters, data, received - started, decoded - received,
+				len(response.content), response.status_code, response.retries,
+			)
 
 		return data
 
+	# `_send()` with the endpoint's adaptive timeout, hedged if the client has a `Hedger`.
+	def _hedged(self, endpoint, url, parameters):
+
+		timeout = None
+		if self.timeouts is not None:
+			timeout = self.timeouts.timeout(endpoint, self.metrics)
+
+		if self.hedger is None:
+			return self._send(url, parameters, timeout=timeout)
+
+		return self.hedger.run(
+			lambda: self._send(url, parameters, timeout=timeout),
+			self.hedger.delay(endpoint, self.metrics),
+			self._may_hedge,
+			self._discard,
+		)
+
+	# A hedge is a call like any other, so it needs a token from the scheduler.
+	def _may_hedge(self):
+		return self.scheduler is None or self.scheduler.acquire(False) is None
+
+	# Book-keeping for the response of a hedged pair that lost: CMC charged for it too.
+	def _discard(self, sent):
+
+		response, key = sent
+		if response is None:
+			return
+
+		status = self._decode(response.content, response.status_code).get('status')
+		if key is not None:
+			self.keys.record(key, status, response.status_code)
+		if self.scheduler is not None:
+			self.scheduler.record(status)
+
+	# GET `url` through the transport. Returns `(response, key)`, where `key` is the key
+	# used if the client has a `KeyPool` and still needs its usage recorded. A request
+	# answered with 429 sets its key aside and is sent again with the next key, until one
+	# answers or every key is set aside. `response` is `None` if no key was available.
+	def _send(self, url, parameters, stream=False, timeout=None):
+
+		if self.keys is None:
+			return self.transport.get(url, parameters, stream, timeout=timeout), None
+
+		response = None
+		while True:
+			key = self.keys.acquire()
+			if key is None:
+				return response, None
+
+			try:
+				response = self.transport.get(url, parameters, stream, self.keys.headers(key), self.keys.retry_status, timeout)
+			except (ConnectionError, Timeout, TooManyRedirects):
+				self.keys.record(key, None)
+				raise
+
+			if response.status_code != 429:
+				return response, key
+			self.keys.record(key, self._decode(response.content, 429).get('status'), 429)
+
+	def _no_key(self):
+		return (108, 'Every API key is set aside, the next one is back in {:.0f}s.'.format(self.keys.delay()))
+
+	# Error dict for a call refused by the scheduler, recorded against `endpoint`.
+	def _limited(self, endpoint, limited):
+		if self.metrics is not None:
+			self.metrics.error(endpoint, limited[0])
+		return self._error(*limited)
+
+	# Sends one request and returns a `StreamedResponse` that parses the body as it arrives
+	# and yields its records one at a time, so memory is bounded by one record rather than
+	# the whole response. `status` is available on it once iteration is done. Streamed
+	# responses are not cached or coalesced.
+	def _stream(self, url, parameters, path=('data',)):
+
+		endpoint = self._endpoint(url)
+
+		if self.breaker is not None:
+			ticket, limited = self.breaker.allow()
+			if limited:
+				return self._limited(endpoint, limited)
+
+		if self.scheduler is not None:
+			limited = self.scheduler.acquire()
+			if limited:
+				return self._limited(endpoint, limited)
+
+		if self.metrics is not None:
+			self.metrics.call(endpoint)
+			self.metrics.request(endpoint, parameters)
+
+		started = time.perf_counter()
+		try:
+			response, key = self._send(url, parameters, stream=True)
+			if response is None:
+				return self._limited(endpoint, self._no_key())
+		except (ConnectionError, Timeout, TooManyRedirects) as e:
+			data = {
+				'status' : {
+					'error_code' : 100,
+					'error_message' : e,
+				}
+			}
+			if self.breaker is not None:
+				self.breaker.record(ticket, False)
+			if self.metrics is not None:
+				self.metrics.response(endpoint, parameters, data, time.perf_counter() - started)
+			return data
+
+		if self.breaker is not None:
+			self.breaker.record(ticket, response.status_code < 500)
+
+		size = [0]
+
+		# Parsing is interleaved with reading the body, so the whole time is counted as network.
+		def done(status):
+			if key is not None:
+				self.keys.record(key, status, response.status_code)
+			if self.scheduler is not None:
+				self.scheduler.record(status)
+			if self.metrics is not None:
+				self.metrics.response(
+					endpoint, parameters, {'status' : status or {}}, time.perf_counter() - started,
+					None, size[0], response.status_code, response.retries,
+				)
+
+		def chunks():
+			try:
+				for chunk in response.iter_content(65536):
+					size[0] += len(chunk)
+					yield chunk
+			except (ConnectionError, Timeout) as e:
+				streamed.status = {'error_code' : 100, 'error_message' : e}
+			finally:
+				response.close()
+
+		streamed = StreamedResponse(chunks(), self.decode, path, done)
+
+		return streamed
+
 	# Error codes
 	#
 	# 100: Connection error
 	# 101: Not enough parameters specified
 	# 102: Type error
 	# 103: Value out of accepted range
-	def _error(self, code=101, message='Error happened before API call.'):
+	# 104: Local per-minute call limit reached (see `CreditScheduler`)
+	# 105: Local daily or monthly credit budget used up
+	# 106: Optional dependency missing
+	# 107: Response body is not JSON
+	# 108: Every key in the client's `KeyPool` is set aside after hitting a limit
+	# 109: No snapshot younger than the `Refresher`'s `max_stale`
+	# 110: Upstream degraded, the client's `CircuitBreaker` is open
+	#
+	# Errors found by validation before a request is built are recorded in `metrics` under
+	# the endpoint of `url`, the request the method would have made, when it is given.
+	def _error(self, code=101, message='Error happened before API call.', url=None):
+
+		if url is not None and self.metrics is not None:
+			self.metrics.error(self._endpoint(url), code)
 
 		err = {
 			'status' : {
@@ -55,7 +480,10 @@ class CMC(object):
 		return err
 
 	# Prioritizes `convert_id` over `convert`.
-	def _convertparams(self, convert=None, convert_id=None, parameters={}):
+	def _convertparams(self, convert=None, convert_id=None, parameters=None):
+
+		if parameters is None:
+			parameters = {}
 
 		if convert_id:
 			parameters['convert_id'] = convert_id.replace(' ', '')
@@ -64,7 +492,10 @@ class CMC(object):
 
 		return parameters
 
-	def _sort_params(self, sort=None, sort_dir=None, cryptocurrencytype=None, parameters={}):
+	def _sort_params(self, sort=None, sort_dir=None, cryptocurrencytype=None, parameters=None):
+
+		if parameters is None:
+			parameters = {}
 
 		valid_sort = ['name', 'symbol', 'date_added', 'market_cap', 'market_cap_strict', \
 			'price', 'circulating_supply', 'total_supply', 'max_supply','num_market_pairs', \
@@ -88,7 +519,10 @@ class CMC(object):
 
 		return parameters
 
-	def _intervals(self, interval, parameters={}, full=True):
+	def _intervals(self, interval, parameters=None, full=True):
+
+		if parameters is None:
+			parameters = {}
 
 		valid_intervals = [ \
 			'yearly', 'monthly', 'weekly', 'daily', 'hourly', \
@@ -108,10 +542,19 @@ class CMC(object):
 		return parameters
 
 	# Prioritizes `coinId` over `slug` over `symbol`.
-	def _id_symbol(self, coinId=None, slug=None, symbol=None, parameters={}, required=True):
+	#
+	# With a `resolver`, slugs and symbols are sent as IDs if all of them are known locally.
+	# `url` is the request the parameters are for, to record a missing coin against.
+	def _id_symbol(self, coinId=None, slug=None, symbol=None, parameters=None, required=True, url=None):
+
+		if parameters is None:
+			parameters = {}
 
 		if required and not coinId and not slug and not symbol:
-			return self._error(101, 'No parameters provided for coin ID or symbol.')
+			return self._error(101, 'No parameters provided for coin ID or symbol.', url)
+
+		if not coinId and self.resolver is not None:
+			coinId = self.resolver.resolve(slug, symbol)
 
 		if coinId:
 			parameters['id'] = coinId.replace(' ', '')
@@ -135,7 +578,10 @@ class CMC(object):
 	# limit     int, how many currencies to get data for.
 	# symbol    string, can be a string of currency symbols (e.g. 'BTC,ETC,LTC').
 	#           If `symbol` is provided, other parameters are ignored.
-	def map(self, status='active', start=1, limit=10, symbol=None):
+	# sort      string, can be 'id' or 'cmc_rank'. Defaults to the API's order (by ID).
+	# stream    bool, return a `StreamedResponse` that yields coins as the response is
+	#           received instead of the whole decoded response. See `_stream()`.
+	def map(self, status='active', start=1, limit=10, symbol=None, sort=None, stream=False):
 
 		url = self.root_url + 'cryptocurrency/map'
 
@@ -143,9 +589,9 @@ class CMC(object):
 			parameters = { 'symbol' : symbol.replace(' ', '') }
 		else:
 			if not isinstance(start, int):
-				return self._error(102, 'Parameter `start` must be an integer.')
+				return self._error(102, 'Parameter `start` must be an integer.', url)
 			if not isinstance(limit, int):
-				return self._error(102, 'Parameter `limit` must be an integer.')
+				return self._error(102, 'Parameter `limit` must be an integer.', url)
 
 			if status != 'inactive' and status != 'active':
 				status = 'active'
@@ -164,10 +610,32 @@ class CMC(object):
 				'limit' : str(limit),
 			}
 
+			if sort == 'id' or sort == 'cmc_rank':
+				parameters['sort'] = sort
+
+		if stream:
+			return self._stream(url, parameters)
+
 		data = self.__call__(url, parameters)
 
 		return data
 
+	# Iterator over paged responses, see `PageIterator`.
+	_pager = PageIterator
+
+	# Iterates over every coin from `map()`, one record at a time, requesting `page_size`
+	# records per call. Set `prefetch` to request that many pages ahead on background
+	# threads while the current page is consumed. See `PageIterator`.
+	#
+	#     for coin in cmc.iter_map(status='inactive', prefetch=2):
+	#         ...
+	def iter_map(self, status='active', start=1, page_size=5000, prefetch=0, sort=None):
+
+		def fetch(start, limit):
+			return self.map(status, start, limit, None, sort)
+
+		return self._pager(fetch, lambda data: data, start, page_size, prefetch)
+
 	# Returns all static metadata available for one or more cryptocurrencies. This information
 	# includes details like logo, description, official website URL, social links, and links
 	# to a cryptocurrency's technical documentation.
@@ -179,18 +647,53 @@ class CMC(object):
 	# coinId    string, coin ID. See `map()`.
 	# slug      string, coin names (e.g. 'bitcoin,ethereum').
 	# symbol    string, coin symbmols (e.g. 'BTC,ETH').
-	def metadata(self, coinId=None, slug=None, symbol=None):
+	# stream    bool, yield `(id, record)` pairs as they are received. See `_stream()`.
+	# typed     bool, return each coin as a `CoinInfo`. See `pyCMC/records.py`.
+	#
+	# With a `metadata_cache`, requests by ID are answered from disk for every cached ID,
+	# and only the others are requested, in as few calls as possible.
+	def metadata(self, coinId=None, slug=None, symbol=None, stream=False, typed=False):
 
 		url = self.root_url + 'cryptocurrency/info'
 
-		parameters = self._id_symbol(coinId, slug, symbol, {}, True)
+		parameters = self._id_symbol(coinId, slug, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
-		data = self.__call__(url, parameters)
+		if stream:
+			return self._stream(url, parameters)
+
+		transform = records.metadata if typed else None
+
+		if self.metadata_cache is not None and 'id' in parameters:
+			return self._transform(self._cached_metadata(url, parameters['id'].split(',')), transform)
+
+		data = self.__call__(url, parameters, transform)
 
 		return data
 
+	# `metadata()` through `metadata_cache`. `status` counts the IDs served from disk in
+	# `cached`. If a request fails, its error response is returned as is.
+	def _cached_metadata(self, url, ids):
+
+		found, missing = self.metadata_cache.get(ids)
+		status = {
+			'error_code' : 0,
+			'error_message' : None,
+			'credit_count' : 0,
+			'cached' : len(found),
+		}
+
+		for group in groups(missing):
+			response = self.__call__(url, {'id' : group})
+			if response.get('status', {}).get('error_code') != 0:
+				return response
+			self.metadata_cache.put(response['data'])
+			found.update(response['data'])
+			status['credit_count'] += response['status'].get('credit_count') or 0
+
+		return {'status' : status, 'data' : {i : found[i] for i in ids if i in found}}
+
 	# Returns listings (total supply, max supply, price, percent change, the info you would see
 	# on coinmarketcap.com) for currencies.
 	#
@@ -206,6 +709,11 @@ class CMC(object):
 	#                       If your sort direction is not valid, it will sort descending.
 	# cryptocurrencytype    string, types to return, can be 'all', 'coins', or 'tokens'.
 	#                       If your type is not valid, it will return all.
+	# columnar              bool, return `data` as NumPy arrays (one per field, plus one dict of
+	#                       arrays per quote currency). See `pyCMC/columnar.py`. Requires numpy.
+	# stream                bool, yield listings as they are received. See `_stream()`.
+	# typed                 bool, return `data` as a list of `Listing` records, which take a
+	#                       fraction of the memory of dicts. See `pyCMC/records.py`.
 	def listings(
 		self,
 		start=1,
@@ -214,15 +722,21 @@ class CMC(object):
 		convert_id=None,
 		sort=None,
 		sort_dir=None,
-		cryptocurrencytype=None
+		cryptocurrencytype=None,
+		columnar=False,
+		stream=False,
+		typed=False
 	):
 
 		url = self.root_url + 'cryptocurrency/listings/latest'
 
+		if columnar and not columns.available():
+			return self._error(106, 'Columnar output requires numpy.', url)
+
 		if not isinstance(start, int):
-			return self._error(102, 'Parameter `start` must be an integer.')
+			return self._error(102, 'Parameter `start` must be an integer.', url)
 		if not isinstance(limit, int):
-			return self._error(102, 'Parameter `limit` must be an integer.')
+			return self._error(102, 'Parameter `limit` must be an integer.', url)
 
 		if start < 1:
 			start = 1
@@ -241,10 +755,32 @@ class CMC(object):
 
 		parameters = self._sort_params(sort, sort_dir, cryptocurrencytype, parameters)
 
-		data = self.__call__(url, parameters)
+		if stream:
+			return self._stream(url, parameters)
+
+		data = self.__call__(url, parameters, columns.listings if columnar else records.listings if typed else None)
 
 		return data
 
+	# Iterates over `listings()` one record at a time. Takes the same inputs as `listings()`,
+	# with `page_size` and `prefetch` as in `iter_map()`.
+	def iter_listings(
+		self,
+		start=1,
+		page_size=5000,
+		prefetch=0,
+		convert=None,
+		convert_id=None,
+		sort=None,
+		sort_dir=None,
+		cryptocurrencytype=None
+	):
+
+		def fetch(start, limit):
+			return self.listings(start, limit, convert, convert_id, sort, sort_dir, cryptocurrencytype)
+
+		return self._pager(fetch, lambda data: data, start, page_size, prefetch)
+
 	# Same as `listings()` but for a historical date.
 	#
 	# `date` is a string and must be Unix or ISO 8601 format (e.g. '2018-02-24'). Only the _date_,
@@ -260,17 +796,21 @@ class CMC(object):
 		convert_id=None,
 		sort=None,
 		sort_dir=None,
-		cryptocurrencytype=None
+		cryptocurrencytype=None,
+		columnar=False
 	):
 
 		url = self.root_url + 'cryptocurrency/listings/latest'
 
+		if columnar and not columns.available():
+			return self._error(106, 'Columnar output requires numpy.', url)
+
 		if not isinstance(date, str):
-			return self._error(102, 'Parameter `date` must be a string.')
+			return self._error(102, 'Parameter `date` must be a string.', url)
 		if not isinstance(start, int):
-			return self._error(102, 'Parameter `start` must be an integer.')
+			return self._error(102, 'Parameter `start` must be an integer.', url)
 		if not isinstance(limit, int):
-			return self._error(102, 'Parameter `limit` must be an integer.')
+			return self._error(102, 'Parameter `limit` must be an integer.', url)
 
 		if start < 1:
 			start = 1
@@ -290,7 +830,7 @@ class CMC(object):
 
 		parameters = self._sort_params(sort, sort_dir, cryptocurrencytype, parameters)
 
-		data = self.__call__(url, parameters)
+		data = self.__call__(url, parameters, columns.listings if columnar else None)
 
 		return data
 
@@ -304,17 +844,27 @@ class CMC(object):
 	# symbol        string, coin symbmol(s) (e.g. 'BTC,ETH').
 	# convert       string, symbol(s) of currency to use as quote.
 	# convert_id    string, ID(s) of currency to use as quote. See `map()`.
-	def quotes(self, coinId=None, slug=None, symbol=None, convert=None, convert_id=None):
+	# columnar      bool, return `data` as NumPy arrays. See `listings()`.
+	# stream        bool, yield `(id, quote)` pairs as they are received. See `_stream()`.
+	#               Ignores `columnar`.
+	# typed         bool, return each coin as a `Listing`. See `listings()`.
+	def quotes(self, coinId=None, slug=None, symbol=None, convert=None, convert_id=None, columnar=False, stream=False, typed=False):
 
 		url = self.root_url + 'cryptocurrency/quotes/latest'
 
-		parameters = self._id_symbol(coinId, slug, symbol, {}, True)
+		if columnar and not columns.available():
+			return self._error(106, 'Columnar output requires numpy.', url)
+
+		parameters = self._id_symbol(coinId, slug, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		if stream:
+			return self._stream(url, parameters)
+
+		data = self.__call__(url, parameters, columns.quotes if columnar else records.quotes if typed else None)
 
 		return data
 
@@ -334,6 +884,7 @@ class CMC(object):
 	#				https://coinmarketcap.com/api/documentation/v1/#operation/getV1CryptocurrencyQuotesHistorical
 	# convert		string, symbol(s) of currency to use as quote.
 	# convert_id    string, ID(s) of currency to use as quote. See `map()`.
+	# columnar		bool, return each coin's series as NumPy arrays indexed by `timestamp`.
 	#
 	# WARNING: Completely untested, I don't have a paid plan.
 	def historical_quotes(
@@ -345,27 +896,31 @@ class CMC(object):
 		count=10,
 		interval=None,
 		convert=None,
-		convert_id=None
+		convert_id=None,
+		columnar=False
 	):
 
 		url = self.root_url + 'cryptocurrency/quotes/historical'
 
-		parameters = self._id_symbol(coinId, None, symbol, {}, True)
+		if columnar and not columns.available():
+			return self._error(106, 'Columnar output requires numpy.', url)
+
+		parameters = self._id_symbol(coinId, None, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
 		if time_start:
 			if not isinstance(time_start, str):
-				return self._error(102, 'Parameter `time_start` must be a string.')
+				return self._error(102, 'Parameter `time_start` must be a string.', url)
 			parameters['time_start'] = time_start
 
 		if time_end:
 			if not isinstance(time_end, str):
-				return self._error(102, 'Parameter `time_end` must be a string.')
+				return self._error(102, 'Parameter `time_end` must be a string.', url)
 			parameters['time_end'] = time_end
 
 		if not isinstance(count, int):
-			return self._error(102, 'Parameter `count` must be an integer.')
+			return self._error(102, 'Parameter `count` must be an integer.', url)
 
 		if count < 1:
 			count = 1
@@ -376,12 +931,12 @@ class CMC(object):
 
 		if interval:
 			if not isinstance(interval, str):
-				return self._error(102, 'Parameter `interval` must be a string. See documentation for valid values.')
+				return self._error(102, 'Parameter `interval` must be a string. See documentation for valid values.', url)
 			parameters = self._intervals(interval, parameters, True)
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		data = self.__call__(url, parameters, columns.historical_quotes if columnar else None)
 
 		return data
 
@@ -398,18 +953,21 @@ class CMC(object):
 	# limit			int, optionally specify the number of results to return.
 	# convert		string, optionally convert the market pairs to a quote for up to 120 currencies. (e.g. 'BTC,USD')
 	# convert_id    string, optionally convert the market pairs to a quote for up to 120 currencies. (e.g. '1,2781')
+	# stream		bool, yield market pairs as they are received. The coin's other fields are in
+	#				`fields['data']` of the returned `StreamedResponse`. See `_stream()`.
+	# typed			bool, return `market_pairs` as a list of `MarketPair` records. See `listings()`.
 	#
 	# WARNING: Completely untested, I don't have a paid plan.
-	def market_pairs(self, coinId=None, slug=None, symbol=None, start=1, limit=100, convert=None, convert_id=None):
+	def market_pairs(self, coinId=None, slug=None, symbol=None, start=1, limit=100, convert=None, convert_id=None, stream=False, typed=False):
 
 		url = self.root_url + 'cryptocurrency/market-pairs/latest'
 
 		if not isinstance(start, int):
-			return self._error(102, 'Parameter `start` must be an integer.')
+			return self._error(102, 'Parameter `start` must be an integer.', url)
 		if not isinstance(limit, int):
-			return self._error(102, 'Parameter `limit` must be an integer.')
+			return self._error(102, 'Parameter `limit` must be an integer.', url)
 
-		parameters = self._id_symbol(coinId, slug, symbol, {}, True)
+		parameters = self._id_symbol(coinId, slug, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
@@ -427,10 +985,32 @@ class CMC(object):
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		if stream:
+			return self._stream(url, parameters, ('data', 'market_pairs'))
+
+		data = self.__call__(url, parameters, records.market_pairs if typed else None)
 
 		return data
 
+	# Iterates over the market pairs of one coin, one pair at a time. Takes the same inputs
+	# as `market_pairs()`, with `page_size` and `prefetch` as in `iter_map()`.
+	def iter_market_pairs(
+		self,
+		coinId=None,
+		slug=None,
+		symbol=None,
+		start=1,
+		page_size=5000,
+		prefetch=0,
+		convert=None,
+		convert_id=None
+	):
+
+		def fetch(start, limit):
+			return self.market_pairs(coinId, slug, symbol, start, limit, convert, convert_id)
+
+		return self._pager(fetch, lambda data: data['market_pairs'], start, page_size, prefetch)
+
 	# Return the latest OHLCV (Open, High, Low, Close, Volume) market values for one or more
 	# cryptocurrencies for the current UTC day. Since the current UTC day is still active these
 	# values are updated frequently.
@@ -440,19 +1020,20 @@ class CMC(object):
 	# symbol		string, one or more symbols for which to get data. (e.g. 'BTC,ETH,LTC')
 	# convert		string, optionally convert the data to a quote for up to 120 currencies. (e.g. 'BTC,USD')
 	# convert_id    string, optionally convert the data to a quote for up to 120 currencies. (e.g. '1,2781')
+	# typed			bool, return each coin as an `OHLCVBar`. See `listings()`.
 	#
 	# WARNING: Completely untested, I don't have a paid plan.
-	def ohlcv_latest(self, coinId=None, symbol=None, convert=None, convert_id=None):
+	def ohlcv_latest(self, coinId=None, symbol=None, convert=None, convert_id=None, typed=False):
 
 		url = self.root_url + 'cryptocurrency/ohlcv/latest'
 
-		parameters = self._id_symbol(coinId, None, symbol, {}, True)
+		parameters = self._id_symbol(coinId, None, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		data = self.__call__(url, parameters, records.ohlcv_latest if typed else None)
 
 		return data
 
@@ -478,6 +1059,8 @@ class CMC(object):
 	# convert		string, By default market quotes are returned in USD. Optionally calculate
 	#				market quotes in up to 3 fiat currencies or cryptocurrencies.
 	# convert_id	string, same as `convert` but using coinmarketcap IDs. Recommended over `convert`.
+	# columnar		bool, return each coin's series as NumPy arrays indexed by `time_open`.
+	# typed			bool, return each coin's `quotes` as a list of `OHLCVBar`. See `listings()`.
 	#
 	# WARNING: Completely untested, I don't have a paid plan.
 	def ohlcv_historical(
@@ -491,12 +1074,17 @@ class CMC(object):
 		count=10,
 		interval='daily',
 		convert=None,
-		convert_id=None
+		convert_id=None,
+		columnar=False,
+		typed=False
 	):
 
 		url = self.root_url + 'cryptocurrency/ohlcv/historical'
 
-		parameters = self._id_symbol(coinId, slug, symbol, {}, True)
+		if columnar and not columns.available():
+			return self._error(106, 'Columnar output requires numpy.', url)
+
+		parameters = self._id_symbol(coinId, slug, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
@@ -507,16 +1095,16 @@ class CMC(object):
 
 		if time_start:
 			if not isinstance(time_start, str):
-				return self._error(102, 'Parameter `time_start` must be a string.')
+				return self._error(102, 'Parameter `time_start` must be a string.', url)
 			parameters['time_start'] = time_start
 
 		if time_end:
 			if not isinstance(time_end, str):
-				return self._error(102, 'Parameter `time_end` must be a string.')
+				return self._error(102, 'Parameter `time_end` must be a string.', url)
 			parameters['time_end'] = time_end
 
 		if not isinstance(count, int):
-			return self._error(102, 'Parameter `count` must be an integer.')
+			return self._error(102, 'Parameter `count` must be an integer.', url)
 
 		if count < 1:
 			count = 1
@@ -527,15 +1115,93 @@ class CMC(object):
 
 		if interval:
 			if not isinstance(interval, str):
-				return self._error(102, 'Parameter `interval` must be a string.')
+				return self._error(102, 'Parameter `interval` must be a string.', url)
 			parameters = self._intervals(interval, parameters, False)
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		data = self.__call__(url, parameters, columns.ohlcv_historical if columnar else records.ohlcv_historical if typed else None)
 
 		return data
 
+	# Fetches every point of a long history, past the 10,000 point cap of a single call, by
+	# splitting `time_start`..`time_end` into windows fetched on `workers` threads. Yields
+	# `(coin_id, point)` pairs in timestamp order. See `Backfill`.
+	#
+	# Inputs
+	# coinId		string, one or more coin IDs (e.g. '1,1027').
+	# time_start	string, Unix or ISO 8601 timestamp.
+	# time_end		string, Unix or ISO 8601 timestamp.
+	# interval		string, time between points (e.g. '5m', 'hourly', 'daily').
+	# endpoint		string, 'quotes' for `historical_quotes()`, 'ohlcv' for `ohlcv_historical()`.
+	# workers		int, number of requests in flight at once.
+	# convert		string, symbol(s) of currency to use as quote.
+	# convert_id	string, ID(s) of currency to use as quote.
+	#
+	#     for coin, point in cmc.backfill('1,1027', '2019-01-01', '2020-01-01', '5m'):
+	#         ...
+	def backfill(
+		self,
+		coinId,
+		time_start,
+		time_end,
+		interval='5m',
+		endpoint='quotes',
+		workers=4,
+		convert=None,
+		convert_id=None
+	):
+
+		return Backfill(self, coinId, time_start, time_end, interval, endpoint, workers, convert, convert_id)
+
+	# Historical series for one coin, served from the local `store` where possible. Only the
+	# time ranges not fetched before are requested (through `backfill()`), so a warm re-run
+	# costs no API calls, except for the latest, still open interval when the range reaches
+	# it: that one is fetched again each time, so its bar is replaced as it settles. `data`
+	# is a zero-copy view of records with the fields in `pyCMC.store.COLUMNS`.
+	#
+	# Inputs
+	# coinId		string, one coin ID.
+	# time_start	string, Unix or ISO 8601 timestamp.
+	# time_end		string, Unix or ISO 8601 timestamp.
+	# interval		string, time between points (e.g. 'hourly', 'daily').
+	# endpoint		string, 'ohlcv' for `ohlcv_historical()`, 'quotes' for `historical_quotes()`.
+	# convert		string, one currency symbol.
+	def history(self, coinId, time_start, time_end, interval='daily', endpoint='ohlcv', convert='USD'):
+
+		url = self.root_url + 'cryptocurrency/{}/historical'.format('ohlcv' if endpoint == 'ohlcv' else 'quotes')
+
+		if self.store is None:
+			return self._error(101, 'No `store` configured for this client.', url)
+		if not isinstance(coinId, str) or ',' in coinId:
+			return self._error(102, 'Parameter `coinId` must be a single coin ID.', url)
+
+		try:
+			parse_time(time_start)
+			parse_time(time_end)
+		except ValueError:
+			return self._error(102, 'Parameters `time_start` and `time_end` must be Unix or ISO 8601 timestamps.', url)
+
+		return self.store.query(self, coinId, time_start, time_end, interval, endpoint, convert)
+
+	# Watches the latest quotes of a set of coins. Returns a `QuoteWatcher`, which polls
+	# `quotes()` in as few calls as possible and yields a delta for each coin whose price,
+	# volume or market cap changed. See `pyCMC/watch.py`.
+	#
+	#     for delta in cmc.watch(ids, convert='USD'):
+	#         print(delta['id'], delta['quote'])
+	#
+	# Inputs
+	# coinId		string or list, coin ID(s).
+	# convert		string, symbol(s) of currency to quote in.
+	# convert_id	string, ID(s) of currency to quote in.
+	# period		float, seconds between polls.
+	# fields		tuple, quote fields to compare.
+	# polls			int, optional, stop after this many polls.
+	def watch(self, coinId, convert=None, convert_id=None, period=60, fields=('price', 'volume_24h', 'market_cap'), polls=None):
+
+		return QuoteWatcher(self, coinId, convert, convert_id, period, fields, polls=polls)
+
 	# Placeholder: ALL EXCHANGE ENDPOINTS
 	#
 	# Requires paid plan.
@@ -547,14 +1213,15 @@ class CMC(object):
 	# Inputs
 	# convert       string, symbol(s) of currency to get metrics for.
 	# convert_id    string, ID(s) of currency to get metrics for. See `map()`.
-	def global_metrics(self, convert=None, convert_id=None):
+	# typed         bool, return `data` as a `GlobalMetrics` record. See `listings()`.
+	def global_metrics(self, convert=None, convert_id=None, typed=False):
 
 		url = self.root_url + 'global-metrics/quotes/latest'
 
 		parameters = {}
 		parameters = self._convertparams(convert, convert_id, parameters)
 
-		data = self.__call__(url, parameters)
+		data = self.__call__(url, parameters, records.global_metrics if typed else None)
 
 		return data
 
@@ -574,33 +1241,133 @@ class CMC(object):
 	# convert       string, symbols of coins to convert to (e.g. 'BTC,USD,EUR'). Free plan limited to one.
 	# convert_id    string, ID of coins to convert to (e.g. '1,42,57'). Free plan limited to one.
 	# time          string, optional, Unix or ISO 8601 timestamp (e.g. '2018-02-24'). Paid only.
-	def convert_price(self, amount, coinId=None, symbol=None, convert=None, convert_id=None, time=None):
+	# offline       bool, convert with the rates from the last `snapshot_rates()` instead of
+	#               calling the API. `status` then also has `snapshot_age`, in seconds.
+	def convert_price(self, amount, coinId=None, symbol=None, convert=None, convert_id=None, time=None, offline=False):
 
 		url = self.root_url + 'tools/price-conversion'
 
-		parameters = self._id_symbol(coinId, None, symbol, {}, True)
+		parameters = self._id_symbol(coinId, None, symbol, {}, True, url)
 		if 'status' in parameters and 'error_code' in parameters['status']:
 			return parameters
 
 		if not isinstance(amount, (int, float)):
-			return self._error(102, 'Parameter `amount` must be a float or an integer.')
+			return self._error(102, 'Parameter `amount` must be a float or an integer.', url)
 		if amount < 1e-8:
-			return self._error(103, 'Parameter `amount` must be greater than 1e-8.')
+			return self._error(103, 'Parameter `amount` must be greater than 1e-8.', url)
 		elif amount > 1e9:
-			return self._error(103, 'Parameter `amount` must be less than 1e9.')
+			return self._error(103, 'Parameter `amount` must be less than 1e9.', url)
 
 		parameters['amount'] = str(amount)
 
 		if not convert and not convert_id:
-			return self._error(101, 'Must specify a currency to convert to.')
+			return self._error(101, 'Must specify a currency to convert to.', url)
 
 		parameters = self._convertparams(convert, convert_id, parameters)
 
 		if time:
 			if not isinstance(time, str):
-				return self._error(102, 'Parameter `time` must be a string.')
+				return self._error(102, 'Parameter `time` must be a string.', url)
 			parameters['time'] = time
 
+		if offline:
+			if time:
+				return self._error(101, 'Historical conversions are not available offline.', url)
+			return self._convert_offline(amount, parameters, url)
+
 		data = self.__call__(url, parameters)
 
 		return data
+
+	# Takes a snapshot of prices for `convert_price(..., offline=True)` and stores it as a
+	# `RateMatrix` in `rates`. Uses one `quotes()` call if `coinId` is given, otherwise one
+	# `listings()` call for the top `limit` coins. `convert`/`convert_id` set the quote
+	# currencies; the first one is the pivot all rates go through, so every coin needs a
+	# price in it to be included.
+	#
+	# With `convert_id`, the quote currencies are keyed by ID. Those that are coins in the
+	# snapshot or in the client's `resolver` can also be looked up by symbol; `symbols`, a
+	# dict of ID -> symbol (e.g. {'2781' : 'USD'}), names the others, such as fiat.
+	#
+	# Returns the response status, with the `RateMatrix` as `data`.
+	def snapshot_rates(self, coinId=None, limit=5000, convert=None, convert_id=None, symbols=None):
+
+		if not columns.available():
+			return self._error(106, 'Offline conversion requires numpy.')
+
+		if coinId:
+			response = self.quotes(coinId, None, None, convert, convert_id)
+		else:
+			response = self.listings(1, limit, convert, convert_id)
+
+		return self._snapshot(response, convert_id, symbols)
+
+	# Builds `rates` from a `quotes()` or `listings()` response.
+	def _snapshot(self, response, convert_id=None, symbols=None):
+
+		if response.get('status', {}).get('error_code') != 0:
+			return response
+
+		data = response['data']
+		if isinstance(data, dict):
+			data = list(data.values())
+
+		symbols = dict(symbols or {})
+		if convert_id and self.resolver is not None:
+			for currency in convert_id.replace(' ', '').split(','):
+				coin = self.resolver.by_id.get(int(currency)) if currency.isdigit() else None
+				if coin is not None and currency not in symbols:
+					symbols[currency] = coin['symbol']
+		self.rates = RateMatrix(data, symbols)
+
+		return {'status' : response['status'], 'data' : self.rates}
+
+	# Error 103 for a currency not in `rates`, pointing at any quote currencies it only
+	# knows by ID.
+	def _no_rate(self, rates, name, url):
+
+		message = 'No offline rate for {}.'.format(name)
+		if rates.unnamed:
+			message += ' The snapshot only knows quote currencies {} by ID, pass their symbols to `snapshot_rates()`.'.format(
+				', '.join(rates.unnamed)
+			)
+		return self._error(103, message, url)
+
+	# `convert_price()` from `rates`, shaped like the `tools/price-conversion` response.
+	def _convert_offline(self, amount, parameters, url=None):
+
+		rates = self.rates
+		if rates is None:
+			return self._error(101, 'No rate snapshot, call `snapshot_rates()` first.', url)
+
+		base = rates.key(parameters.get('id') or parameters.get('symbol'))
+		if base is None:
+			return self._no_rate(rates, 'the coin to convert from', url)
+
+		quote = {}
+		oldest = 0.0
+		for target in (parameters.get('convert_id') or parameters.get('convert')).split(','):
+			if rates.key(target) is None:
+				return self._no_rate(rates, '`{}`'.format(target), url)
+			price, age = rates.convert(amount, base, target)
+			quote[target] = {'price' : float(price[0])}
+			oldest = max(oldest, float(age[0]))
+
+		symbol, name = rates.names.get(base, (None, None))
+		return {
+			'status' : {
+				'error_code' : 0,
+				'error_message' : None,
+				'credit_count' : 0,
+				'snapshot_age' : oldest,
+			},
+			'data' : {
+				'id' : int(base) if base.isdigit() else base,
+				'symbol' : symbol,
+				'name' : name,
+				'amount' : amount,
+				'quote' : quote,
+			},
+		}
+
+from .aio import AsyncCMC
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point.
+
+    python -m pyCMC dump --out universe/ [--format csv] [--market-pairs] [--ohlcv START END]
+"""
+
+import argparse
+import os
+import sys
+
+from . import CMC
+from .dump import Dump
+from .paging import MAX_LIMIT
+
+def _page_size(value):
+	size = int(value)
+	if not 1 <= size <= MAX_LIMIT:
+		raise argparse.ArgumentTypeError('must be between 1 and {}'.format(MAX_LIMIT))
+	return size
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(prog='python -m pyCMC')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	dump = commands.add_parser('dump', help='Dump the coin universe to Parquet or CSV files. Re-run to resume.')
+	dump.add_argument('--key', action='append', help='API key. Repeat to use several keys. Defaults to $CMC_PRO_API_KEY.')
+	dump.add_argument('--plan', help='Plan name, to budget calls and credits locally (e.g. basic, standard).')
+	dump.add_argument('--out', required=True, help='Output directory.')
+	dump.add_argument('--format', choices=('parquet', 'csv'), help='Defaults to parquet if pyarrow is installed.')
+	dump.add_argument('--workers', type=int, default=4)
+	dump.add_argument('--page-size', type=_page_size, default=MAX_LIMIT, help='Records per map() and listings() request, at most {}.'.format(MAX_LIMIT))
+	dump.add_argument('--chunk', type=int, default=100, help='Coin IDs per metadata request.')
+	dump.add_argument('--convert', default='USD')
+	dump.add_argument('--market-pairs', action='store_true', help='Also dump the market pairs of every active coin.')
+	dump.add_argument('--ohlcv', nargs=2, metavar=('START', 'END'), help='Also dump OHLCV history of every active coin.')
+	dump.add_argument('--interval', default='daily')
+	dump.add_argument('--root-url', help='API root, e.g. a `pyCMC.mock.MockServer`.')
+
+	args = parser.parse_args(argv)
+
+	keys = args.key or [os.environ.get('CMC_PRO_API_KEY')]
+	if not keys[0]:
+		parser.error('no API key, pass --key or set CMC_PRO_API_KEY')
+
+	with CMC(keys[0] if len(keys) == 1 else keys, pool_size=args.workers, scheduler=args.plan) as cmc:
+		if args.root_url:
+			cmc.root_url = args.root_url
+
+		try:
+			job = Dump(
+				cmc, args.out, args.format, args.workers, args.page_size, args.chunk, args.convert,
+				args.market_pairs, args.ohlcv, args.interval,
+			)
+		except (ImportError, ValueError) as e:
+			print(e, file=sys.stderr)
+			return 2
+
+		if not job.run():
+			print('{} tasks failed, run again to resume.'.format(len(job.failed)), file=sys.stderr)
+			return 1
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio version of `CMC`. Requires `aiohttp`.
+"""
+
+import asyncio
+import copy
+import time
+
+try:
+	import aiohttp
+except ImportError:
+	aiohttp = None
+
+from . import CMC
+from . import columnar as columns
+from .cache import request_key
+from .paging import AsyncPageIterator
+from .shared import SharedCache
+from .transport import Transport
+
+class AsyncTransport(Transport):
+
+	# Same retry policy as `Transport`, on an `aiohttp` connection pool. The session is
+	# created on first use so that it belongs to the running event loop.
+	def __init__(self, headers, pool_size=100, timeout=(3.05, 30), retries=3, backoff=0.5, max_backoff=30):
+		self.headers = headers
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.session = None
+
+	def _session(self):
+
+		if self.session is None:
+			if isinstance(self.timeout, tuple):
+				timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+			else:
+				timeout = aiohttp.ClientTimeout(total=self.timeout)
+			self.session = aiohttp.ClientSession(
+				headers=self.headers,
+				connector=aiohttp.TCPConnector(limit=self.pool_size),
+				timeout=timeout,
+			)
+
+		return self.session
+
+	# GET `url` with retries. Returns `(status, body, retries)` where `body` is the raw bytes
+	# and `retries` the number of retries made. `headers` and `retry_status` are as for
+	# `Transport.get()`.
+	async def get(self, url, parameters=None, headers=None, retry_status=None):
+
+		session = self._session()
+		if retry_status is None:
+			retry_status = self.retry_status
+
+		attempt = 0
+		while True:
+			retry_after = None
+			try:
+				async with session.get(url, params=parameters, headers=headers) as response:
+					body = await response.read()
+					if response.status not in retry_status or attempt >= self.retries:
+						return response.status, body, attempt
+					retry_after = response.headers.get('Retry-After')
+			except (aiohttp.ClientError, asyncio.TimeoutError):
+				if attempt >= self.retries:
+					raise
+
+			await asyncio.sleep(self._delay(attempt, retry_after))
+			attempt += 1
+
+	async def close(self):
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+class AsyncCMC(CMC):
+
+	# Same endpoint methods and arguments as `CMC`, but each one is a coroutine. Validation
+	# and parameter defaults are shared with `CMC`, so errors found before the API call are
+	# returned exactly as `CMC` returns them.
+	#
+	# Inputs
+	# concurrency   int, maximum number of requests in flight at once.
+	# pool_size     int, maximum number of open connections.
+	#
+	# Other inputs are as for `CMC`. With `singleflight`, identical requests awaited at the
+	# same time share one upstream call. Use as an async context manager or call `await close()`.
+	#
+	#     async with AsyncCMC(cmc_key) as cmc:
+	#         results = await asyncio.gather(*[cmc.quotes(coinId=i) for i in ids])
+	#
+	# `iter_map()`, `iter_listings()` and `iter_market_pairs()` return iterators for
+	# `async for`, and `snapshot_rates()` is a coroutine. `backfill()`, `history()` and
+	# `watch()` run on threads or poll in a loop of their own, and raise `TypeError` here,
+	# as does using an `AsyncCMC` with a `Refresher` or `Resolver`: use a `CMC` for those.
+	def __init__(self, cmc_key, concurrency=50, pool_size=100, timeout=(3.05, 30), retries=3, backoff=0.5, cache=None, scheduler=None, decoder='auto', metrics=True, key_policy='round-robin', singleflight=True):
+
+		if aiohttp is None:
+			raise ImportError('AsyncCMC requires aiohttp. Install it with `pip install aiohttp`.')
+
+		CMC.__init__(self, cmc_key, pool_size, timeout, retries, backoff, cache, scheduler, decoder=decoder, metrics=metrics, key_policy=key_policy, singleflight=singleflight)
+		CMC.close(self)
+		self.transport = AsyncTransport(self.headers, pool_size, timeout, retries, backoff)
+		self.concurrency = concurrency
+		self._semaphore = None
+		self._flights = {}
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.close()
+
+	async def close(self):
+		await self.transport.close()
+
+	async def __call__(self, url, parameters=None, transform=None):
+
+		if parameters is None:
+			parameters = {}
+		endpoint = self._endpoint(url)
+
+		data = None
+		if isinstance(self.cache, SharedCache):
+			# May wait on another process fetching the same request, so off the loop.
+			data = await asyncio.get_running_loop().run_in_executor(None, self.cache.get, endpoint, parameters)
+		elif self.cache is not None:
+			data = self.cache.get(endpoint, parameters)
+
+		if self.metrics is not None:
+			self.metrics.call(endpoint, cached=data is not None)
+
+		if data is None:
+			try:
+				if self.singleflight is not None:
+					data = await self._shared(endpoint, url, parameters)
+				else:
+					data = await self._miss(url, parameters)
+			finally:
+				if self.cache is not None:
+					self.cache.release(endpoint, parameters)
+
+		return self._transform(data, transform)
+
+	# Awaits the identical request already in flight, or starts it. The call runs as its
+	# own task, so a caller being cancelled does not cancel it for the others. Callers that
+	# joined it get a copy of its result.
+	async def _shared(self, endpoint, url, parameters):
+
+		key = request_key(endpoint, parameters)
+		flight = self._flights.get(key)
+		leader = flight is None
+		if leader:
+			flight = asyncio.ensure_future(self._miss(url, parameters))
+			self._flights[key] = flight
+
+			def done(_):
+				if self._flights.get(key) is flight:
+					del self._flights[key]
+			flight.add_done_callback(done)
+		else:
+			self.singleflight.shared += 1
+
+		data = await asyncio.shield(flight)
+		return data if leader else copy.deepcopy(data)
+
+	async def _miss(self, url, parameters):
+
+		endpoint = self._endpoint(url)
+
+		if self.scheduler is not None:
+			limited = self.scheduler.acquire(False)
+			while limited and limited[0] == 104 and self.scheduler.blocking:
+				await asyncio.sleep(self.scheduler.delay())
+				limited = self.scheduler.acquire(False)
+			if limited:
+				return self._limited(endpoint, limited)
+
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.concurrency)
+
+		if self.metrics is not None:
+			self.metrics.request(endpoint, parameters)
+
+		try:
+			async with self._semaphore:
+				started = time.perf_counter()
+				status, body, retries, key = await self._send(url, parameters)
+			if status is None:
+				return self._limited(endpoint, self._no_key())
+			received = time.perf_counter()
+			data = self._decode(body, status)
+			decoded = time.perf_counter()
+			if key is not None:
+				self.keys.record(key, data.get('status'), status)
+			self._received(endpoint, parameters, data, len(body))
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			data = {
+				'status' : {
+					'error_code' : 100,
+					'error_message' : e,
+				}
+			}
+			if self.metrics is not None:
+				self.metrics.response(endpoint, parameters, data, time.perf_counter() - started)
+			return data
+
+		if self.metrics is not None:
+			self.metrics.response(
+				endpoint, parameters, data, received - started, decoded - received,
+				len(body), status, retries,
+			)
+
+		return data
+
+	# As `CMC._send()`, returning `(status, body, retries, key)`. `status` is `None` if no
+	# key was available. Waits for a budgeted key without blocking the event loop.
+	async def _send(self, url, parameters):
+
+		if self.keys is None:
+			return (*await self.transport.get(url, parameters), None)
+
+		result = (None, None, 0)
+		while True:
+			key = self.keys.acquire(False)
+			while key is None and self.keys.blocking and self.keys.throttled():
+				await asyncio.sleep(self.keys.delay())
+				key = self.keys.acquire(False)
+			if key is None:
+				return (*result, None)
+
+			try:
+				result = await self.transport.get(url, parameters, self.keys.headers(key), self.keys.retry_status)
+			except (aiohttp.ClientError, asyncio.TimeoutError):
+				self.keys.record(key, None)
+				raise
+
+			if result[0] != 429:
+				return (*result, key)
+			self.keys.record(key, self._decode(result[1], 429).get('status'), 429)
+
+	def _stream(self, url, parameters, path=('data',)):
+		return self._error(101, 'Streamed responses are not supported by AsyncCMC.', url)
+
+	_pager = AsyncPageIterator
+
+	def _unsupported(self, name):
+		raise TypeError('`{}()` is not available on AsyncCMC, use a CMC client.'.format(name))
+
+	# Used by `Refresher` and `Resolver`, which make their calls from plain threads.
+	def _request(self, url, parameters):
+		self._unsupported('_request')
+
+	def backfill(self, *args, **kwargs):
+		self._unsupported('backfill')
+
+	def history(self, *args, **kwargs):
+		self._unsupported('history')
+
+	def watch(self, *args, **kwargs):
+		self._unsupported('watch')
+
+	# The `CMC` methods build their parameters and then return `self.__call__(...)`, which
+	# here is a coroutine. Errors found before the API call come back as plain dicts.
+	async def _run(self, result):
+		if asyncio.iscoroutine(result):
+			return await result
+		return result
+
+	async def map(self, *args, **kwargs):
+		return await self._run(CMC.map(self, *args, **kwargs))
+
+	async def metadata(self, *args, **kwargs):
+		return await self._run(CMC.metadata(self, *args, **kwargs))
+
+	async def listings(self, *args, **kwargs):
+		return await self._run(CMC.listings(self, *args, **kwargs))
+
+	async def historical_listings(self, *args, **kwargs):
+		return await self._run(CMC.historical_listings(self, *args, **kwargs))
+
+	async def quotes(self, *args, **kwargs):
+		return await self._run(CMC.quotes(self, *args, **kwargs))
+
+	async def historical_quotes(self, *args, **kwargs):
+		return await self._run(CMC.historical_quotes(self, *args, **kwargs))
+
+	async def market_pairs(self, *args, **kwargs):
+		return await self._run(CMC.market_pairs(self, *args, **kwargs))
+
+	async def ohlcv_latest(self, *args, **kwargs):
+		return await self._run(CMC.ohlcv_latest(self, *args, **kwargs))
+
+	async def ohlcv_historical(self, *args, **kwargs):
+		return await self._run(CMC.ohlcv_historical(self, *args, **kwargs))
+
+	async def global_metrics(self, *args, **kwargs):
+		return await self._run(CMC.global_metrics(self, *args, **kwargs))
+
+	async def convert_price(self, *args, **kwargs):
+		return await self._run(CMC.convert_price(self, *args, **kwargs))
+
+	async def snapshot_rates(self, coinId=None, limit=5000, convert=None, convert_id=None, symbols=None):
+
+		if not columns.available():
+			return self._error(106, 'Offline conversion requires numpy.')
+
+		if coinId:
+			response = await self.quotes(coinId, None, None, convert, convert_id)
+		else:
+			response = await self.listings(1, limit, convert, convert_id)
+
+		return self._snapshot(response, convert_id, symbols)
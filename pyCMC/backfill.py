@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Splits long historical ranges into API sized windows and fetches them in parallel.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+
+# Most points the historical endpoints return per request (see `count`).
+MAX_POINTS = 10_000
+
+# Seconds per interval, for the interval names accepted by `CMC._intervals()`.
+INTERVAL_SECONDS = {
+	'5m' : 300, '10m' : 600, '15m' : 900, '30m' : 1800, '45m' : 2700,
+	'hourly' : 3600, '1h' : 3600, '2h' : 7200, '3h' : 10800, '6h' : 21600, '12h' : 43200,
+	'daily' : 86400, '24h' : 86400, '1d' : 86400, '2d' : 172800, '3d' : 259200,
+	'weekly' : 604800, '7d' : 604800, '14d' : 1209600, '15d' : 1296000,
+	'monthly' : 2592000, '30d' : 2592000, '60d' : 5184000, '90d' : 7776000,
+	'yearly' : 31536000, '365d' : 31536000,
+}
+
+# Unix timestamp (int, float or digit string) or ISO 8601 string to an aware UTC datetime.
+# Raises `ValueError` for anything else.
+def parse_time(value):
+
+	if isinstance(value, datetime.datetime):
+		moment = value
+	elif isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+		try:
+			return datetime.datetime.fromtimestamp(float(value), datetime.timezone.utc)
+		except (OverflowError, OSError):
+			raise ValueError('Timestamp out of range: {!r}'.format(value))
+	elif isinstance(value, str):
+		moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+	else:
+		raise ValueError('Not a timestamp: {!r}'.format(value))
+
+	if moment.tzinfo is None:
+		moment = moment.replace(tzinfo=datetime.timezone.utc)
+	return moment.astimezone(datetime.timezone.utc)
+
+def format_time(moment):
+	return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# Splits [start, end] into consecutive windows of at most `points` intervals each.
+def windows(start, end, seconds, points):
+
+	span = datetime.timedelta(seconds=seconds * points)
+	while start < end:
+		stop = min(start + span, end)
+		yield start, stop
+		start = stop
+
+class Backfill(object):
+
+	# Iterates over `(coin_id, point)` pairs for every point between `time_start` and
+	# `time_end`, in timestamp order. `point` is one element of the `quotes` list of the
+	# historical endpoint.
+	#
+	# The range is cut into windows small enough for one request each (at most
+	# `MAX_POINTS` points over all coins), which are fetched on `workers` threads. Windows
+	# are yielded in order as soon as they and all windows before them are complete, and
+	# points repeated at window edges are dropped.
+	#
+	# Inputs
+	# cmc           `CMC`, client to fetch with.
+	# coinId        string, comma separated coin IDs.
+	# time_start    string, Unix or ISO 8601 timestamp.
+	# time_end      string, Unix or ISO 8601 timestamp.
+	# interval      string, one of `INTERVAL_SECONDS`.
+	# endpoint      string, 'quotes' for `historical_quotes()` or 'ohlcv' for `ohlcv_historical()`.
+	# workers       int, windows fetched at once.
+	# convert       string, symbol(s) of currency to use as quote.
+	# convert_id    string, ID(s) of currency to use as quote.
+	#
+	# After iteration, `status` holds the `status` block of the last response. If a window
+	# fails, iteration stops and `status` holds its error.
+	def __init__(
+		self,
+		cmc,
+		coinId,
+		time_start,
+		time_end,
+		interval='5m',
+		endpoint='quotes',
+		workers=4,
+		convert=None,
+		convert_id=None
+	):
+		self.cmc = cmc
+		self.coinId = coinId.replace(' ', '')
+		self.time_start = time_start
+		self.time_end = time_end
+		self.interval = interval
+		self.endpoint = endpoint
+		self.workers = workers
+		self.convert = convert
+		self.convert_id = convert_id
+		self.status = None
+
+		# Timestamp of each point, by endpoint.
+		self.time_key = 'time_open' if endpoint == 'ohlcv' else 'timestamp'
+
+	def _fetch(self, start, end, count):
+
+		if self.endpoint == 'ohlcv':
+			period = 'daily' if INTERVAL_SECONDS[self.interval] >= 86400 else 'hourly'
+			return self.cmc.ohlcv_historical(
+				self.coinId, None, None, period, format_time(start), format_time(end),
+				count, self.interval, self.convert, self.convert_id
+			)
+
+		return self.cmc.historical_quotes(
+			self.coinId, None, format_time(start), format_time(end),
+			count, self.interval, self.convert, self.convert_id
+		)
+
+	# All points of one response as a time ordered list of `(coin_id, point)`.
+	def _points(self, data):
+
+		# One coin comes back as the coin itself, several as a dict keyed by ID.
+		if 'quotes' in data:
+			data = {str(data['id']) : data}
+
+		points = []
+		for coinId, coin in data.items():
+			for point in coin.get('quotes', []):
+				points.append((coinId, point))
+
+		points.sort(key=lambda p: p[1].get(self.time_key) or '')
+		return points
+
+	def _invalid(self, message):
+		url = self.cmc.root_url + 'cryptocurrency/{}/historical'.format('ohlcv' if self.endpoint == 'ohlcv' else 'quotes')
+		self.status = self.cmc._error(102, message, url)['status']
+
+	def __iter__(self):
+
+		if self.interval not in INTERVAL_SECONDS:
+			self._invalid('Parameter `interval` must be one of: {}.'.format(', '.join(INTERVAL_SECONDS)))
+			return
+		try:
+			start = parse_time(self.time_start)
+			end = parse_time(self.time_end)
+		except ValueError:
+			self._invalid('Parameters `time_start` and `time_end` must be Unix or ISO 8601 timestamps.')
+			return
+
+		seconds = INTERVAL_SECONDS[self.interval]
+		points = max(1, MAX_POINTS // len(self.coinId.split(',')))
+		pending = deque()
+		last = {}
+
+		with ThreadPoolExecutor(self.workers) as pool:
+			spans = windows(start, end, seconds, points)
+			try:
+				for span in spans:
+					pending.append(pool.submit(self._fetch, span[0], span[1], points))
+					if len(pending) >= self.workers * 2:
+						break
+
+				while pending:
+					data = pending.popleft().result()
+
+					span = next(spans, None)
+					if span is not None:
+						pending.append(pool.submit(self._fetch, span[0], span[1], points))
+
+					self.status = data.get('status')
+					if not self.status or self.status.get('error_code') != 0:
+						return
+
+					for coinId, point in self._points(data['data']):
+						moment = point.get(self.time_key)
+						if coinId in last and moment <= last[coinId]:
+							continue
+						last[coinId] = moment
+						yield coinId, point
+			finally:
+				for future in pending:
+					future.cancel()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-batching of single-coin requests into comma separated ID lists.
+"""
+
+import threading
+
+class _Batch(object):
+
+	def __init__(self):
+		self.ids = {}
+		self.length = 0
+		self.full = threading.Event()
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+class Coalescer(object):
+
+	# Endpoints that accept a comma separated `id` list and return `data` keyed by ID.
+	endpoints = (
+		'cryptocurrency/quotes/latest',
+		'cryptocurrency/info',
+		'cryptocurrency/ohlcv/latest',
+	)
+
+	# Parameters a request may carry, besides `id`, and still be merged. Requests are only
+	# merged with others that have the same values for these.
+	shared_params = ('convert', 'convert_id')
+
+	# Requests for the same endpoint and `convert` that arrive within `window` seconds of
+	# each other are sent as one call. The first caller waits for the window (or until the
+	# batch is full), makes the call, and every caller gets back only its own IDs.
+	#
+	# Inputs
+	# window        float, seconds to wait for more requests before sending a batch.
+	# max_ids       int, most IDs in one call.
+	# max_length    int, most characters in the joined `id` parameter, to keep URLs short.
+	#
+	# Since the API rejects a whole request if any ID in it is invalid, one bad ID fails
+	# every request in its batch. Likewise, if the call raises, every caller in the batch
+	# gets the exception.
+	def __init__(self, window=0.01, max_ids=100, max_length=1800):
+		self.window = window
+		self.max_ids = max_ids
+		self.max_length = max_length
+		self._lock = threading.Lock()
+		self._open = {}
+
+	# True if this request can be merged with others.
+	def accepts(self, endpoint, parameters):
+		return (
+			endpoint in self.endpoints
+			and 'id' in parameters
+			and all(name == 'id' or name in self.shared_params for name in parameters)
+		)
+
+	def _fits(self, batch, ids):
+		new = [i for i in ids if i not in batch.ids]
+		length = batch.length + sum(len(i) + 1 for i in new)
+		return len(batch.ids) + len(new) <= self.max_ids and length <= self.max_length
+
+	# Sends `parameters` as part of a batch. `call(url, parameters)` makes the actual
+	# request. Returns the response with `data` narrowed to this caller's IDs.
+	def submit(self, call, url, parameters):
+
+		ids = parameters['id'].split(',')
+		key = (url, tuple(sorted((k, v) for k, v in parameters.items() if k != 'id')))
+
+		with self._lock:
+			batch = self._open.get(key)
+			if batch is not None and batch.ids and not self._fits(batch, ids):
+				batch.full.set()
+				del self._open[key]
+				batch = None
+
+			leader = batch is None
+			if leader:
+				batch = _Batch()
+				self._open[key] = batch
+
+			for i in ids:
+				if i not in batch.ids:
+					batch.ids[i] = True
+					batch.length += len(i) + 1
+
+			if len(batch.ids) >= self.max_ids:
+				batch.full.set()
+				del self._open[key]
+
+		if leader:
+			batch.full.wait(self.window)
+			with self._lock:
+				if self._open.get(key) is batch:
+					del self._open[key]
+
+			merged = dict(parameters)
+			merged['id'] = ','.join(batch.ids)
+			try:
+				batch.result = call(url, merged)
+			except BaseException as e:
+				batch.error = e
+				raise
+			finally:
+				batch.done.set()
+		else:
+			batch.done.wait()
+			if batch.error is not None:
+				raise batch.error
+
+		return self._slice(batch.result, ids)
+
+	def _slice(self, result, ids):
+
+		data = result.get('data')
+		if result.get('status', {}).get('error_code') != 0 or not isinstance(data, dict):
+			return result
+
+		return {
+			'status' : result['status'],
+			'data' : {i : data[i] for i in ids if i in data},
+		}
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory response cache with per-endpoint expiry and LRU eviction.
+"""
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+# Parameters whose values are comma separated lists where order does not change the
+# response (see `CMC._id_symbol()` and `CMC._convertparams()`).
+LIST_PARAMS = ('id', 'slug', 'symbol', 'convert', 'convert_id')
+
+# Builds a hashable key from the endpoint and its parameters. Comma lists are split,
+# stripped and sorted so that 'BTC,ETH' and 'ETH, BTC' share one key.
+def request_key(endpoint, parameters):
+
+	items = []
+	for name, value in (parameters or {}).items():
+		value = str(value)
+		if name in LIST_PARAMS:
+			value = ','.join(sorted(v.strip() for v in value.split(',')))
+		items.append((name, value))
+
+	return (endpoint, tuple(sorted(items)))
+
+class ResponseCache(object):
+
+	# Default seconds a response stays fresh, by endpoint. Roughly matches how often CMC
+	# refreshes each endpoint upstream.
+	default_ttls = {
+		'cryptocurrency/map' : 86400,
+		'cryptocurrency/info' : 86400,
+		'cryptocurrency/listings/latest' : 60,
+		'cryptocurrency/listings/historical' : 86400,
+		'cryptocurrency/quotes/latest' : 60,
+		'cryptocurrency/quotes/historical' : 3600,
+		'cryptocurrency/market-pairs/latest' : 60,
+		'cryptocurrency/ohlcv/latest' : 60,
+		'cryptocurrency/ohlcv/historical' : 3600,
+		'global-metrics/quotes/latest' : 60,
+		'tools/price-conversion' : 60,
+	}
+
+	# Inputs
+	# ttls          dict, endpoint -> seconds. Overrides `default_ttls` for those endpoints.
+	#               A TTL of 0 disables caching for that endpoint.
+	# default_ttl   int, seconds for endpoints not in the TTL table.
+	# max_entries   int, maximum number of cached responses.
+	# max_bytes     int, optional cap on the total size of cached response bodies.
+	#
+	# When either cap is exceeded the least recently used entries are evicted. One cache
+	# may be shared by several threads. It keeps its own copy of each response and hands
+	# out copies, so callers may change what they get back.
+	def __init__(self, ttls=None, default_ttl=60, max_entries=1024, max_bytes=None):
+		self.ttls = dict(self.default_ttls)
+		if ttls:
+			self.ttls.update(ttls)
+		self.default_ttl = default_ttl
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.size = 0
+
+		# key -> (expires_at, size, data), oldest first.
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def ttl(self, endpoint):
+		return self.ttls.get(endpoint, self.default_ttl)
+
+	def key(self, endpoint, parameters):
+		return request_key(endpoint, parameters)
+
+	# Returns the cached data or `None` if there is no fresh entry.
+	def get(self, endpoint, parameters):
+
+		key = self.key(endpoint, parameters)
+		with self._lock:
+			entry = self._entries.get(key)
+
+			if entry is None:
+				self.misses += 1
+				return None
+
+			if entry[0] <= time.monotonic():
+				self._remove(key)
+				self.misses += 1
+				return None
+
+			self._entries.move_to_end(key)
+			self.hits += 1
+			data = entry[2]
+
+		return copy.deepcopy(data)
+
+	# Stores `data` for the endpoint and parameters. `size` is the size of the response
+	# body in bytes and is only used for the `max_bytes` cap.
+	def set(self, endpoint, parameters, data, size=0):
+
+		ttl = self.ttl(endpoint)
+		if ttl <= 0:
+			return
+
+		key = self.key(endpoint, parameters)
+		data = copy.deepcopy(data)
+		with self._lock:
+			if key in self._entries:
+				self._remove(key)
+
+			self._entries[key] = (time.monotonic() + ttl, size, data)
+			self.size += size
+
+			while self._entries and (
+				len(self._entries) > self.max_entries
+				or (self.max_bytes is not None and self.size > self.max_bytes)
+			):
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	# Called once for every `get()` miss, when the caller is done fetching, whether or not
+	# it stored a response. Only `SharedCache` has anything to do here.
+	def release(self, endpoint, parameters):
+		pass
+
+	def _remove(self, key):
+		entry = self._entries.pop(key)
+		self.size -= entry[1]
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.size = 0
+
+	def stats(self):
+		return {
+			'hits' : self.hits,
+			'misses' : self.misses,
+			'evictions' : self.evictions,
+			'entries' : len(self._entries),
+			'bytes' : self.size,
+		}
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Column oriented (NumPy) views of listing, quote and OHLCV responses. Requires `numpy`.
+"""
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Per-coin numeric fields.
+COIN_FIELDS = ('cmc_rank', 'num_market_pairs', 'circulating_supply', 'total_supply', 'max_supply')
+
+# Numeric fields inside each `quote[currency]` block.
+QUOTE_FIELDS = (
+	'price', 'volume_24h', 'market_cap',
+	'percent_change_1h', 'percent_change_24h', 'percent_change_7d',
+)
+
+HISTORICAL_FIELDS = ('price', 'volume_24h', 'market_cap')
+
+OHLCV_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'market_cap')
+
+def available():
+	return np is not None
+
+def _number(value):
+	return float('nan') if value is None else value
+
+# ISO 8601 strings as returned by the API (e.g. '2019-06-19T12:00:00.000Z') to datetime64.
+def _timestamps(values):
+	return np.array([v[:-1] if v and v.endswith('Z') else v for v in values], dtype='datetime64[ms]')
+
+# Every currency quoted in `records`, in the order first seen. A record may be quoted in
+# only some of them, or not at all.
+def _currencies(records):
+
+	seen = {}
+	for record in records:
+		for c in record.get('quote') or {}:
+			seen[c] = None
+	return list(seen)
+
+# One pass over a list of listing/quote records. Returns a dict of parallel arrays:
+# `id`, `symbol`, `name`, `slug`, the `COIN_FIELDS` and, under `quote`, one dict of
+# `QUOTE_FIELDS` arrays per currency. Values a record has no quote for are NaN.
+def coins(records):
+
+	n = len(records)
+	currencies = _currencies(records)
+
+	ids = np.empty(n, dtype=np.int64)
+	symbols = np.empty(n, dtype=object)
+	names = np.empty(n, dtype=object)
+	slugs = np.empty(n, dtype=object)
+	fields = {name : np.empty(n) for name in COIN_FIELDS}
+	quote = {c : {name : np.empty(n) for name in QUOTE_FIELDS} for c in currencies}
+
+	for i, record in enumerate(records):
+		ids[i] = record['id']
+		symbols[i] = record.get('symbol')
+		names[i] = record.get('name')
+		slugs[i] = record.get('slug')
+		for name, column in fields.items():
+			column[i] = _number(record.get(name))
+		quotes = record.get('quote') or {}
+		for c, columns in quote.items():
+			values = quotes.get(c) or {}
+			for name, column in columns.items():
+				column[i] = _number(values.get(name))
+
+	result = {'id' : ids, 'symbol' : symbols, 'name' : names, 'slug' : slugs, 'quote' : quote}
+	result.update(fields)
+	return result
+
+# `quotes` list of one coin's historical series to arrays. `time_key` is the timestamp
+# to index by: 'timestamp' for historical quotes, 'time_open' for OHLCV.
+def _series(coin, fields, time_key):
+
+	points = coin.get('quotes', [])
+	n = len(points)
+	currencies = _currencies(points)
+
+	times = []
+	quote = {c : {name : np.empty(n) for name in fields} for c in currencies}
+	for i, point in enumerate(points):
+		times.append(point.get(time_key))
+		quotes = point.get('quote') or {}
+		for c, columns in quote.items():
+			values = quotes.get(c) or {}
+			for name, column in columns.items():
+				column[i] = _number(values.get(name))
+
+	return {
+		'id' : coin.get('id'),
+		'symbol' : coin.get('symbol'),
+		'name' : coin.get('name'),
+		'timestamp' : _timestamps(times),
+		'quote' : quote,
+	}
+
+# Historical responses are a single coin when one ID was requested and a dict of coins
+# keyed by ID otherwise. Keeps the same shape.
+def _historical(data, fields, time_key):
+
+	if 'quotes' in data:
+		return _series(data, fields, time_key)
+	return {key : _series(coin, fields, time_key) for key, coin in data.items()}
+
+def _wrap(response, data):
+	return {'status' : response['status'], 'data' : data}
+
+# Response transforms, one per endpoint shape.
+
+def listings(response):
+	return _wrap(response, coins(response['data']))
+
+def quotes(response):
+	return _wrap(response, coins(list(response['data'].values())))
+
+def historical_quotes(response):
+	return _wrap(response, _historical(response['data'], HISTORICAL_FIELDS, 'timestamp'))
+
+def ohlcv_historical(response):
+	return _wrap(response, _historical(response['data'], OHLCV_FIELDS, 'time_open'))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Offline currency conversion from a snapshot of `quotes()` or `listings()`. Requires `numpy`.
+"""
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from .backfill import parse_time
+import time
+
+class RateMatrix(object):
+
+	# Every coin in the snapshot and every quote currency is a node with a value in the
+	# first quote currency in `records` (the pivot). The rate between any two nodes
+	# is the ratio of their values, so converting between any pair is one vectorized
+	# division. Coins without a price in the pivot are left out, as are quote currencies
+	# no coin is priced in alongside the pivot.
+	#
+	# Inputs
+	# records   list, coin records from `listings()` or the values of `quotes()` data.
+	# symbols   dict, optional quote currency key -> symbol, for a snapshot taken with
+	#           `convert_id`.
+	#
+	# Nodes are keyed by CMC ID as a string (e.g. '1'), and quote currencies by the key the
+	# API used for them in `quote` (an ID if the snapshot was taken with `convert_id`, a
+	# symbol like 'USD' otherwise). `key()` also accepts symbols. A quote currency given by
+	# ID is only known by its symbol if it is one of the coins in `records` or is in
+	# `symbols`; `unnamed` lists the others.
+	def __init__(self, records, symbols=None):
+
+		if np is None:
+			raise ImportError('RateMatrix requires numpy. Install it with `pip install numpy`.')
+
+		symbols = symbols or {}
+		currencies = {}
+		for record in records:
+			for currency in record.get('quote') or {}:
+				currencies[currency] = None
+		currencies = list(currencies)
+		pivot = currencies[0] if currencies else None
+
+		keys = []
+		values = []
+		stamps = []
+		self.symbols = {}
+		self.names = {}
+		self.unnamed = []
+
+		for record in records:
+			quote = (record.get('quote') or {}).get(pivot) or {}
+			if not quote.get('price'):
+				continue
+			key = str(record['id'])
+			keys.append(key)
+			values.append(quote['price'])
+			stamps.append(self._stamp(quote.get('last_updated') or record.get('last_updated')))
+			self.symbols.setdefault(record.get('symbol'), key)
+			self.names[key] = (record.get('symbol'), record.get('name'))
+
+		# Value of each quote currency in the pivot, from the first coin priced in both.
+		for currency in currencies:
+			if currency in keys:
+				continue
+			value, stamp = (1.0, time.time()) if currency == pivot else (None, None)
+			for record in records:
+				base = (record.get('quote') or {}).get(pivot) or {}
+				other = (record.get('quote') or {}).get(currency) or {}
+				if value is None and base.get('price') and other.get('price'):
+					value = base['price'] / other['price']
+					stamp = self._stamp(other.get('last_updated'))
+					break
+			if value is None:
+				continue
+			symbol = symbols.get(currency, currency)
+			keys.append(currency)
+			values.append(value)
+			stamps.append(stamp)
+			self.symbols.setdefault(symbol, currency)
+			self.symbols.setdefault(symbol.upper(), currency)
+			self.names.setdefault(currency, (symbol, symbol))
+			if symbol.isdigit():
+				self.unnamed.append(currency)
+
+		self.pivot = pivot
+		self.keys = keys
+		self.index = {key : i for i, key in enumerate(keys)}
+		self.values = np.array(values, dtype=np.float64)
+		self.updated = np.array(stamps, dtype=np.float64)
+
+	def _stamp(self, value):
+		return parse_time(value).timestamp() if value else time.time()
+
+	def __len__(self):
+		return len(self.keys)
+
+	# Node key for a CMC ID, quote currency key or symbol. `None` if unknown.
+	def key(self, name):
+		name = str(name)
+		if name in self.index:
+			return name
+		return self.symbols.get(name) or self.symbols.get(name.upper())
+
+	def _positions(self, names):
+		keys = [self.key(n) for n in names]
+		if None in keys:
+			raise KeyError(names[keys.index(None)])
+		return np.array([self.index[k] for k in keys], dtype=np.int64)
+
+	# Dense n x n matrix where `matrix()[i, j]` converts one unit of node i into node j.
+	# Needs n^2 floats, so prefer `convert()` for large snapshots.
+	def matrix(self):
+		return self.values[:, None] / self.values[None, :]
+
+	# Converts `amounts` of `sources` into `target`. `amounts` and `sources` are scalars
+	# or equal length sequences. Returns `(converted, age)` arrays, where `age` is the age
+	# in seconds of the older of the two prices behind each rate.
+	def convert(self, amounts, sources, target):
+
+		sources = [sources] if isinstance(sources, (str, int)) else list(sources)
+		source = self._positions(sources)
+		target = self._positions([target])[0]
+
+		converted = np.asarray(amounts, dtype=np.float64) * (self.values[source] / self.values[target])
+		age = time.time() - np.minimum(self.updated[source], self.updated[target])
+		return converted, age
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+JSON decoders that parse response bodies straight from bytes.
+"""
+
+import json
+
+def _orjson():
+	import orjson
+	return orjson.loads
+
+def _ujson():
+	import ujson
+	return ujson.loads
+
+def _json():
+	return json.loads
+
+# Fastest first. Each entry returns a `loads(bytes)` function or raises ImportError.
+backends = {
+	'orjson' : _orjson,
+	'ujson' : _ujson,
+	'json' : _json,
+}
+
+# Returns a `loads(bytes)` function.
+#
+# Inputs
+# name      string or callable. 'auto' picks the fastest installed backend, otherwise one
+#           of `backends`. A callable is returned as is. If the named backend is not
+#           installed or not known, falls back to 'auto'.
+def get_decoder(name='auto'):
+
+	if callable(name):
+		return name
+
+	if name in backends:
+		try:
+			return backends[name]()
+		except ImportError:
+			pass
+
+	for load in backends.values():
+		try:
+			return load()
+		except ImportError:
+			continue
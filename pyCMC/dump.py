@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk dump of the whole coin universe to Parquet or CSV files, resumable after a failure.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+import sys
+import threading
+
+from .paging import MAX_LIMIT
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+# Rows held in memory before they are written out.
+BATCH = 1000
+
+# Columns of each dataset as `(name, path, kind)`. `path` leads to the value in a record,
+# with `None` standing for the quote currency. `kind` is 'int', 'float', 'str' or 'json'
+# (nested values, stored as JSON text).
+DATASETS = {
+	'map' : [
+		('id', ('id',), 'int'),
+		('name', ('name',), 'str'),
+		('symbol', ('symbol',), 'str'),
+		('slug', ('slug',), 'str'),
+		('is_active', ('is_active',), 'int'),
+		('rank', ('rank',), 'int'),
+		('first_historical_data', ('first_historical_data',), 'str'),
+		('last_historical_data', ('last_historical_data',), 'str'),
+		('platform_id', ('platform', 'id'), 'int'),
+		('token_address', ('platform', 'token_address'), 'str'),
+	],
+	'metadata' : [
+		('id', ('id',), 'int'),
+		('name', ('name',), 'str'),
+		('symbol', ('symbol',), 'str'),
+		('slug', ('slug',), 'str'),
+		('category', ('category',), 'str'),
+		('description', ('description',), 'str'),
+		('logo', ('logo',), 'str'),
+		('date_added', ('date_added',), 'str'),
+		('tags', ('tags',), 'json'),
+		('platform_id', ('platform', 'id'), 'int'),
+		('token_address', ('platform', 'token_address'), 'str'),
+		('urls', ('urls',), 'json'),
+	],
+	'listings' : [
+		('id', ('id',), 'int'),
+		('name', ('name',), 'str'),
+		('symbol', ('symbol',), 'str'),
+		('slug', ('slug',), 'str'),
+		('cmc_rank', ('cmc_rank',), 'int'),
+		('num_market_pairs', ('num_market_pairs',), 'int'),
+		('circulating_supply', ('circulating_supply',), 'float'),
+		('total_supply', ('total_supply',), 'float'),
+		('max_supply', ('max_supply',), 'float'),
+		('date_added', ('date_added',), 'str'),
+		('last_updated', ('last_updated',), 'str'),
+		('tags', ('tags',), 'json'),
+		('platform_id', ('platform', 'id'), 'int'),
+		('price', ('quote', None, 'price'), 'float'),
+		('volume_24h', ('quote', None, 'volume_24h'), 'float'),
+		('percent_change_1h', ('quote', None, 'percent_change_1h'), 'float'),
+		('percent_change_24h', ('quote', None, 'percent_change_24h'), 'float'),
+		('percent_change_7d', ('quote', None, 'percent_change_7d'), 'float'),
+		('market_cap', ('quote', None, 'market_cap'), 'float'),
+	],
+	'market_pairs' : [
+		('coin_id', ('coin_id',), 'int'),
+		('exchange_id', ('exchange', 'id'), 'int'),
+		('exchange_name', ('exchange', 'name'), 'str'),
+		('exchange_slug', ('exchange', 'slug'), 'str'),
+		('market_pair', ('market_pair',), 'str'),
+		('base_id', ('market_pair_base', 'currency_id'), 'int'),
+		('base_symbol', ('market_pair_base', 'currency_symbol'), 'str'),
+		('quote_id', ('market_pair_quote', 'currency_id'), 'int'),
+		('quote_symbol', ('market_pair_quote', 'currency_symbol'), 'str'),
+		('price', ('quote', None, 'price'), 'float'),
+		('volume_24h', ('quote', None, 'volume_24h'), 'float'),
+		('last_updated', ('quote', None, 'last_updated'), 'str'),
+	],
+	'ohlcv' : [
+		('coin_id', ('coin_id',), 'int'),
+		('time_open', ('time_open',), 'str'),
+		('time_close', ('time_close',), 'str'),
+		('open', ('quote', None, 'open'), 'float'),
+		('high', ('quote', None, 'high'), 'float'),
+		('low', ('quote', None, 'low'), 'float'),
+		('close', ('quote', None, 'close'), 'float'),
+		('volume', ('quote', None, 'volume'), 'float'),
+		('market_cap', ('quote', None, 'market_cap'), 'float'),
+	],
+}
+
+_CASTS = {'int' : int, 'float' : float, 'str' : str, 'json' : json.dumps}
+
+def _value(record, path, kind, convert):
+
+	for key in path:
+		if not isinstance(record, dict):
+			return None
+		record = record.get(convert if key is None else key)
+
+	if record is None:
+		return None
+	try:
+		return _CASTS[kind](record)
+	except (TypeError, ValueError):
+		return None
+
+class DumpError(Exception):
+	pass
+
+class _CSVWriter(object):
+
+	def __init__(self, path, columns):
+		self.file = open(path, 'w', newline='', encoding='utf-8')
+		self.writer = csv.writer(self.file)
+		self.writer.writerow([name for name, _, _ in columns])
+
+	def write(self, rows):
+		self.writer.writerows(rows)
+
+	def close(self):
+		self.file.close()
+
+class _ParquetWriter(object):
+
+	def __init__(self, path, columns):
+		types = {
+			'int' : pyarrow.int64(),
+			'float' : pyarrow.float64(),
+			'str' : pyarrow.string(),
+			'json' : pyarrow.string(),
+		}
+		self.schema = pyarrow.schema([(name, types[kind]) for name, _, kind in columns])
+		self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+	def write(self, rows):
+		arrays = [pyarrow.array(column, field.type) for column, field in zip(zip(*rows), self.schema)]
+		self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+	def close(self):
+		self.writer.close()
+
+class Dump(object):
+
+	# Dumps `map()` (active and inactive coins), `metadata()` and `listings()`, and
+	# optionally the market pairs and OHLCV history of every coin, into one directory per
+	# dataset under `out`.
+	#
+	# The work is cut into tasks (a page of `map()` or `listings()`, a chunk of IDs for
+	# `metadata()`, one coin for market pairs and OHLCV), run on `workers` threads. Each
+	# task streams its records into its own part file, and is checkpointed in
+	# `manifest.json` once the file is complete. Running again with the same `out` skips
+	# every task in the manifest, so an interrupted dump resumes where it stopped. A dump
+	# can only be resumed with the options it was started with (all but `workers` and
+	# `log`), otherwise a `ValueError` is raised.
+	#
+	# Inputs
+	# cmc           `CMC`, client to fetch with.
+	# out           string, output directory.
+	# format        string, 'parquet' (requires `pyarrow`) or 'csv'. Defaults to 'parquet'
+	#               if `pyarrow` is installed.
+	# workers       int, tasks run at once.
+	# page_size     int, records per `map()`, `listings()` and `market_pairs()` request, from
+	#               1 to `MAX_LIMIT`. A short page is taken as the last one, so it can not
+	#               be more than the API returns.
+	# chunk         int, coin IDs per `metadata()` request.
+	# convert       string, one currency symbol for quotes.
+	# market_pairs  bool, also dump the market pairs of every active coin.
+	# ohlcv         tuple, optional `(time_start, time_end)` to also dump the OHLCV history
+	#               of every active coin.
+	# interval      string, interval for OHLCV history.
+	# log           file, where progress and failures are reported.
+	def __init__(
+		self,
+		cmc,
+		out,
+		format=None,
+		workers=4,
+		page_size=5000,
+		chunk=100,
+		convert='USD',
+		market_pairs=False,
+		ohlcv=None,
+		interval='daily',
+		log=sys.stderr
+	):
+		if format is None:
+			format = 'parquet' if pyarrow is not None else 'csv'
+		if format == 'parquet' and pyarrow is None:
+			raise ImportError('Parquet output requires pyarrow. Install it with `pip install pyarrow`, or use CSV.')
+		if format not in ('parquet', 'csv'):
+			raise ValueError('Unknown format `{}`, expected parquet or csv.'.format(format))
+		if not 1 <= page_size <= MAX_LIMIT:
+			raise ValueError('Parameter `page_size` must be between 1 and {}.'.format(MAX_LIMIT))
+
+		self.cmc = cmc
+		self.out = out
+		self.format = format
+		self.workers = workers
+		self.page_size = page_size
+		self.chunk = chunk
+		self.convert = convert
+		self.market_pairs = market_pairs
+		self.ohlcv = ohlcv
+		self.interval = interval
+		self.log = log
+
+		self.failed = []
+		self._lock = threading.Lock()
+
+		os.makedirs(out, exist_ok=True)
+		self.manifest_path = os.path.join(out, 'manifest.json')
+		# Part files are named after their place in the dump, so a resumed run has to cut
+		# the work up the same way, and ask for the same datasets over the same range.
+		options = {
+			'format' : format,
+			'convert' : convert,
+			'page_size' : page_size,
+			'chunk' : chunk,
+			'market_pairs' : bool(market_pairs),
+			'ohlcv' : list(ohlcv) if ohlcv else None,
+			'interval' : interval if ohlcv else None,
+		}
+		self.manifest = {'options' : options, 'done' : {}}
+		if os.path.exists(self.manifest_path):
+			with open(self.manifest_path, 'r') as f:
+				self.manifest = json.load(f)
+			if self.manifest.get('options') != options:
+				raise ValueError('{} holds a dump made with {}, not {}.'.format(out, self.manifest.get('options'), options))
+
+	def _report(self, message):
+		if self.log is not None:
+			with self._lock:
+				print(message, file=self.log, flush=True)
+
+	def _save(self):
+		tmp = self.manifest_path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.manifest, f)
+		os.replace(tmp, self.manifest_path)
+
+	# Runs `work()` unless `task` is already in the manifest. Returns the task's manifest
+	# entry, or `None` if it failed.
+	def _task(self, task, work):
+
+		with self._lock:
+			entry = self.manifest['done'].get(task)
+		if entry is not None:
+			return entry
+
+		try:
+			entry = work()
+		except Exception as e:
+			self._report('failed {}: {}'.format(task, e))
+			with self._lock:
+				self.failed.append(task)
+			return None
+
+		with self._lock:
+			self.manifest['done'][task] = entry
+			self._save()
+		self._report('done {} ({} rows)'.format(task, entry['rows']))
+		return entry
+
+	# Streams `records` into the part file `name` of `dataset`. The file only appears
+	# under its final name once it is complete.
+	def _write(self, dataset, name, records):
+
+		columns = DATASETS[dataset]
+		folder = os.path.join(self.out, dataset)
+		os.makedirs(folder, exist_ok=True)
+		path = os.path.join(folder, '{}.{}'.format(name, self.format))
+		tmp = path + '.tmp'
+
+		writer = (_ParquetWriter if self.format == 'parquet' else _CSVWriter)(tmp, columns)
+		rows = 0
+		batch = []
+		try:
+			for record in records:
+				batch.append(tuple(_value(record, p, kind, self.convert) for _, p, kind in columns))
+				if len(batch) >= BATCH:
+					writer.write(batch)
+					rows += len(batch)
+					batch = []
+			if batch:
+				writer.write(batch)
+				rows += len(batch)
+		except BaseException:
+			writer.close()
+			os.remove(tmp)
+			raise
+
+		writer.close()
+		os.replace(tmp, path)
+		return rows
+
+	# Records of a streamed response, raising `DumpError` if it ended in an error.
+	def _records(self, response, pairs=False):
+
+		if isinstance(response, dict):
+			raise DumpError(response.get('status', {}).get('error_message'))
+
+		for record in response:
+			yield record[1] if pairs else record
+
+		status = response.status or {}
+		if status.get('error_code') != 0:
+			raise DumpError(status.get('error_message') or 'error {}'.format(status.get('error_code')))
+
+	# Runs `fetch(start)` page tasks `workers` at a time until a page comes back short.
+	def _paged(self, pool, prefix, dataset, fetch, ids=False):
+
+		def page(start):
+
+			def work():
+				seen = []
+				def records():
+					for record in self._records(fetch(start)):
+						if ids:
+							seen.append(record['id'])
+						yield record
+				entry = {'rows' : self._write(dataset, '{}-{:07d}'.format(prefix, start), records())}
+				if ids:
+					entry['ids'] = seen
+				return entry
+
+			return self._task('{}/{}-{}'.format(dataset, prefix, start), work)
+
+		entries = []
+		start = 1
+		while True:
+			starts = [start + i * self.page_size for i in range(self.workers)]
+			wave = list(pool.map(page, starts))
+			entries.extend(wave)
+			if any(e is None or e['rows'] < self.page_size for e in wave):
+				return entries
+			start = starts[-1] + self.page_size
+
+	def _metadata(self, chunk):
+		def work():
+			response = self.cmc.metadata(coinId=','.join(str(i) for i in chunk), stream=True)
+			return {'rows' : self._write('metadata', 'id-{:07d}'.format(chunk[0]), self._records(response, True))}
+		return self._task('metadata/{}'.format(chunk[0]), work)
+
+	def _market_pairs(self, coinId):
+
+		def records():
+			start = 1
+			while True:
+				response = self.cmc.market_pairs(coinId=str(coinId), start=start, limit=self.page_size, convert=self.convert, stream=True)
+				n = 0
+				for record in self._records(response):
+					n += 1
+					record['coin_id'] = coinId
+					yield record
+				if n < self.page_size:
+					return
+				start += self.page_size
+
+		def work():
+			return {'rows' : self._write('market_pairs', 'id-{:07d}'.format(coinId), records())}
+
+		return self._task('market_pairs/{}'.format(coinId), work)
+
+	def _ohlcv(self, coinId):
+
+		def records():
+			points = self.cmc.backfill(str(coinId), self.ohlcv[0], self.ohlcv[1], self.interval, 'ohlcv', 1, self.convert)
+			for _, point in points:
+				point['coin_id'] = coinId
+				yield point
+			status = points.status or {}
+			if status.get('error_code') != 0:
+				raise DumpError(status.get('error_message') or 'error {}'.format(status.get('error_code')))
+
+		def work():
+			return {'rows' : self._write('ohlcv', 'id-{:07d}'.format(coinId), records())}
+
+		return self._task('ohlcv/{}'.format(coinId), work)
+
+	# Runs every task not done yet. Returns True if all of them succeeded.
+	def run(self):
+
+		with ThreadPoolExecutor(self.workers) as pool:
+
+			active = []
+			inactive = []
+			for status, ids in (('active', active), ('inactive', inactive)):
+				fetch = lambda start, status=status: self.cmc.map(status, start, self.page_size, stream=True)
+				for entry in self._paged(pool, status, 'map', fetch, ids=True):
+					if entry is not None:
+						ids.extend(entry['ids'])
+
+			# Metadata chunks are cut from the full ID list, so wait for a complete map.
+			if self.failed:
+				return False
+
+			every = sorted(set(active + inactive))
+			active = sorted(set(active))
+
+			futures = [pool.submit(self._metadata, every[i:i + self.chunk]) for i in range(0, len(every), self.chunk)]
+
+			fetch = lambda start: self.cmc.listings(start, self.page_size, self.convert, stream=True)
+			self._paged(pool, 'page', 'listings', fetch)
+
+			if self.market_pairs:
+				futures.extend(pool.submit(self._market_pairs, i) for i in active)
+			if self.ohlcv:
+				futures.extend(pool.submit(self._ohlcv, i) for i in active)
+
+			for future in futures:
+				future.result()
+
+		return not self.failed
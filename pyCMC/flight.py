@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Singleflight: identical requests made at the same time share one upstream call.
+"""
+
+import copy
+import threading
+
+from .cache import request_key
+
+class _Call(object):
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.shared = 0
+
+class Singleflight(object):
+
+	# While a request is in flight, identical requests (same endpoint and parameters, with
+	# comma lists compared as sets, see `cache.request_key()`) from other threads wait for
+	# it and get its result instead of sending their own. Nothing is kept once the call
+	# returns: that is the response cache's job.
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._calls = {}
+
+		# Requests answered by another thread's call.
+		self.shared = 0
+
+	def __len__(self):
+		return len(self._calls)
+
+	# Returns `call(url, parameters)`, or a copy of the result of the identical call
+	# already in flight, so no two callers get the same object. Exceptions raised by the
+	# call reach every caller sharing it.
+	def do(self, endpoint, call, url, parameters):
+
+		key = request_key(endpoint, parameters)
+
+		with self._lock:
+			flight = self._calls.get(key)
+			leader = flight is None
+			if leader:
+				flight = _Call()
+				self._calls[key] = flight
+			else:
+				flight.shared += 1
+				self.shared += 1
+
+		if leader:
+			try:
+				flight.result = call(url, parameters)
+			except BaseException as e:
+				flight.error = e
+				raise
+			finally:
+				with self._lock:
+					del self._calls[key]
+				flight.done.set()
+		else:
+			flight.done.wait()
+			if flight.error is not None:
+				raise flight.error
+			return copy.deepcopy(flight.result)
+
+		return flight.result
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+Indicators computed across many coins at once, over aligned (coins x timestamps) arrays of
+historical series. Requires `numpy`.
+"""
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from .columnar import HISTORICAL_FIELDS, OHLCV_FIELDS, _timestamps
+
+def available():
+	return np is not None
+
+# Arrays grow by at least this many columns, so appending bars is amortized O(new bars).
+_MIN_GROWTH = 64
+
+def _grow(array, columns):
+
+	if array.shape[1] >= columns:
+		return array
+
+	grown = np.empty((array.shape[0], max(columns, 2 * array.shape[1], _MIN_GROWTH)), dtype=array.dtype)
+	grown[:] = False if array.dtype == bool else np.nan
+	grown[:, :array.shape[1]] = array
+	return grown
+
+def _add_rows(array, rows):
+	extra = np.empty((rows, array.shape[1]), dtype=array.dtype)
+	extra[:] = False if array.dtype == bool else np.nan
+	return np.concatenate([array, extra])
+
+class Panel(object):
+
+	# One quote currency's fields from `ohlcv_historical()` or `historical_quotes()`
+	# responses (plain, not `columnar` or `typed`), as 2-D arrays with a row per coin and a
+	# column per timestamp. Columns are the union of every coin's timestamps; a column a
+	# coin has no bar for is a gap, where `present` is False and values are NaN or, with
+	# `fill='ffill'`, the coin's last value before the gap (volumes are never filled).
+	#
+	# Inputs
+	# response  dict, API response. More are added with `append()`.
+	# convert   string, quote currency to take. Defaults to the first one in the response.
+	# step      int, optional seconds to floor timestamps to, so that historical quotes taken
+	#           a few seconds apart share a column. The last point in each step is kept.
+	# fill      'ffill' or None.
+	#
+	# Attributes
+	# ids, symbols      1-D arrays, one per row.
+	# timestamps        1-D datetime64[ms] array, one per column.
+	# present           bool array, True where the coin had a bar.
+	# price, volume     names of the price and volume fields: 'close' and 'volume' for OHLCV,
+	#                   'price' and 'volume_24h' for historical quotes.
+	# fields            names of the value arrays, read as `panel['close']`.
+	#
+	#     panel = Panel(cmc.ohlcv_historical(coinId='1,1027', time_start='2019-01-01'))
+	#     panel['close'].shape    # (2, number of days)
+	def __init__(self, response, convert=None, step=None, fill='ffill'):
+
+		if np is None:
+			raise ImportError('Panel requires numpy. Install it with `pip install numpy`.')
+
+		self.convert = convert
+		self.step = step
+		self.fill = fill
+
+		self.fields = None
+		self.price = None
+		self.volume = None
+		self.ids = np.empty(0, dtype=np.int64)
+		self.symbols = np.empty(0, dtype=object)
+		self.size = 0
+
+		self._rows = {}
+		self._times = np.empty(0, dtype=np.int64)
+		self._values = {}
+		self._present = None
+
+		self.append(response)
+
+	def __getitem__(self, field):
+		return self._values[field][:, :self.size]
+
+	def __len__(self):
+		return len(self.ids)
+
+	@property
+	def n(self):
+		return len(self.ids)
+
+	@property
+	def capacity(self):
+		return self._present.shape[1]
+
+	@property
+	def timestamps(self):
+		return self._times[:self.size].astype('datetime64[ms]')
+
+	@property
+	def present(self):
+		return self._present[:, :self.size]
+
+	def row(self, coinId):
+		return self._rows[int(coinId)]
+
+	# Per coin: `(id, symbol, times, values)` with `times` in ms since the epoch and `values`
+	# a dict of field -> float array.
+	def _parse(self, data):
+
+		coins = [data] if 'quotes' in data else list(data.values())
+		parsed = []
+		for coin in coins:
+			points = coin.get('quotes') or []
+			if not points:
+				continue
+
+			if self.fields is None:
+				ohlcv = 'time_open' in points[0]
+				self.fields = OHLCV_FIELDS if ohlcv else HISTORICAL_FIELDS
+				self.price, self.volume = ('close', 'volume') if ohlcv else ('price', 'volume_24h')
+				self._time_key = 'time_open' if ohlcv else 'timestamp'
+				if self.convert is None:
+					self.convert = next(iter(points[0]['quote']))
+
+			times = []
+			rows = []
+			for point in points:
+				values = point['quote'].get(self.convert) or {}
+				times.append(point.get(self._time_key))
+				rows.append(tuple(values.get(name) for name in self.fields))
+
+			times = _timestamps(times).astype(np.int64)
+			if self.step:
+				times -= times % (self.step * 1000)
+			values = np.array(rows, dtype=float).reshape(len(rows), len(self.fields))
+			parsed.append((int(coin['id']), coin.get('symbol'), times, {
+				name : values[:, i] for i, name in enumerate(self.fields)
+			}))
+
+		return parsed
+
+	# Adds the bars of another response: later bars for known coins (the usual case, e.g.
+	# polling `ohlcv_historical()` with `time_start` at the last bar), revised bars, earlier
+	# bars or new coins. Bars already present are overwritten. Returns the first column
+	# whose values may have changed, which is 0 when columns moved or rows were added.
+	def append(self, response):
+
+		status = response.get('status') or {}
+		if status.get('error_code') != 0:
+			raise ValueError('Cannot add an error response: {}'.format(status.get('error_message')))
+
+		coins = self._parse(response['data'])
+		if not coins:
+			return self.size
+
+		if self._present is None:
+			self._present = np.zeros((0, 0), dtype=bool)
+			self._values = {name : np.empty((0, 0)) for name in self.fields}
+
+		# New rows.
+		new = [(i, s) for i, s, _, _ in coins if i not in self._rows]
+		if new:
+			for i, _ in new:
+				self._rows[i] = len(self._rows)
+			self.ids = np.concatenate([self.ids, np.array([i for i, _ in new], dtype=np.int64)])
+			self.symbols = np.concatenate([self.symbols, np.array([s for _, s in new], dtype=object)])
+			self._present = _add_rows(self._present, len(new))
+			self._values = {name : _add_rows(v, len(new)) for name, v in self._values.items()}
+
+		# New columns. Timestamps later than every known one are appended in place; any other
+		# new timestamp means rebuilding the arrays in the new column order.
+		old = self._times[:self.size]
+		times = np.unique(np.concatenate([t for _, _, t, _ in coins]))
+		inserted = np.setdiff1d(times, old, assume_unique=True)
+
+		if inserted.size and self.size and inserted[0] < old[-1]:
+			union = np.union1d(old, inserted)
+			where = np.searchsorted(union, old)
+			present = np.zeros((self.n, len(union)), dtype=bool)
+			present[:, where] = self._present[:, :self.size]
+			self._present = present
+			for name, v in self._values.items():
+				moved = np.full((self.n, len(union)), np.nan)
+				moved[:, where] = v[:, :self.size]
+				self._values[name] = moved
+			self._times = union
+			self.size = len(union)
+			start = 0
+		else:
+			size = self.size + inserted.size
+			self._times = np.concatenate([old, inserted])
+			self._present = _grow(self._present, size)
+			self._values = {name : _grow(v, size) for name, v in self._values.items()}
+			self.size = size
+			start = 0 if new else int(np.searchsorted(self._times[:self.size], times[0]))
+
+		columns = self._times[:self.size]
+		for coinId, _, t, values in coins:
+			row = self._rows[coinId]
+			where = np.searchsorted(columns, t)
+			self._present[row, where] = True
+			for name, column in values.items():
+				self._values[name][row, where] = column
+
+		if self.fill == 'ffill':
+			self._ffill(start)
+
+		return start
+
+	# Forward fills gaps from column `start` on, from the last present value before it.
+	def _ffill(self, start):
+
+		lo = max(start - 1, 0)
+		present = self._present[:, lo:self.size].copy()
+		present[:, 0] = True
+		source = np.where(present, np.arange(self.size - lo), 0)
+		np.maximum.accumulate(source, axis=1, out=source)
+
+		for name, v in self._values.items():
+			if 'volume' in name:
+				continue
+			segment = v[:, lo:self.size]
+			filled = np.take_along_axis(segment, source, axis=1)
+			# Gaps read from their source, bars keep their own (possibly missing) value.
+			v[:, lo:self.size] = np.where(self._present[:, lo:self.size], segment, filled)
+
+# Sums and non-NaN counts over every `window` consecutive columns of `segment`. Column j of
+# the result covers columns j to j + window - 1.
+def _window_sums(segment, window):
+
+	valid = ~np.isnan(segment)
+	n = segment.shape[0]
+	sums = np.zeros((n, segment.shape[1] + 1))
+	counts = np.zeros((n, segment.shape[1] + 1))
+	np.cumsum(np.where(valid, segment, 0.0), axis=1, out=sums[:, 1:])
+	np.cumsum(valid, axis=1, out=counts[:, 1:])
+	return sums[:, window:] - sums[:, :-window], counts[:, window:] - counts[:, :-window]
+
+class Indicator(object):
+
+	# Base of every indicator. `update(panel, out, start)` writes the indicator for
+	# columns `start` onward into `out`, a (coins, timestamps) array. Cumulative
+	# indicators carry state from one update to the next, and are recomputed from column 0
+	# (after `reset()`) when earlier columns change. Others only look back a fixed number
+	# of columns, so any `start` will do.
+	cumulative = False
+
+	def __init__(self, field=None, name=None):
+		self.field = field
+		self.name = name or self._name()
+		if field is not None and name is None:
+			self.name += '_' + field
+
+	def _name(self):
+		return type(self).__name__.lower()
+
+	def reset(self, n):
+		pass
+
+	def _values(self, panel):
+		return panel[self.field or panel.price]
+
+class Returns(Indicator):
+
+	# Simple (or log) return over `periods` columns.
+	def __init__(self, periods=1, log=False, field=None, name=None):
+		self.periods = periods
+		self.log = log
+		Indicator.__init__(self, field, name)
+
+	def _name(self):
+		return '{}returns_{}'.format('log_' if self.log else '', self.periods)
+
+	def update(self, panel, out, start):
+
+		x = self._values(panel)
+		size = x.shape[1]
+		p = self.periods
+		lo = max(start, p)
+
+		out[:, start:lo] = np.nan
+		with np.errstate(divide='ignore', invalid='ignore'):
+			ratio = x[:, lo:] / x[:, lo - p:size - p]
+			out[:, lo:size] = np.log(ratio) if self.log else ratio - 1
+
+class SMA(Indicator):
+
+	# Mean of the last `window` values. NaN unless all of them are known.
+	def __init__(self, window, field=None, name=None):
+		self.window = window
+		Indicator.__init__(self, field, name)
+
+	def _name(self):
+		return 'sma_{}'.format(self.window)
+
+	def update(self, panel, out, start):
+
+		x = self._values(panel)
+		w = self.window
+		lo = max(start, w - 1)
+
+		out[:, start:lo] = np.nan
+		sums, counts = _window_sums(x[:, lo - w + 1:], w)
+		out[:, lo:x.shape[1]] = np.where(counts == w, sums / w, np.nan)
+
+class EMA(Indicator):
+
+	# Exponential moving average with `alpha = 2 / (span + 1)`, seeded with each coin's
+	# first value. Gaps (NaN) carry the average forward unchanged.
+	cumulative = True
+
+	def __init__(self, span, field=None, name=None):
+		self.span = span
+		self.alpha = 2.0 / (span + 1)
+		Indicator.__init__(self, field, name)
+
+	def _name(self):
+		return 'ema_{}'.format(self.span)
+
+	def reset(self, n):
+		self._last = np.full(n, np.nan)
+
+	# Sequential in time by nature, so one vector step per column across every coin.
+	def update(self, panel, out, start):
+
+		x = self._values(panel)
+		last = self._last
+		alpha = self.alpha
+		for t in range(start, x.shape[1]):
+			value = x[:, t]
+			last = np.where(np.isnan(last), value, np.where(np.isnan(value), last, last + alpha * (value - last)))
+			out[:, t] = last
+		self._last = last
+
+class Volatility(Indicator):
+
+	# Standard deviation of log returns over the last `window` columns, times
+	# `sqrt(periods_per_year)` if given (e.g. 365 for daily bars).
+	def __init__(self, window, periods_per_year=None, field=None, name=None):
+		self.window = window
+		self.periods_per_year = periods_per_year
+		Indicator.__init__(self, field, name)
+
+	def _name(self):
+		return 'volatility_{}'.format(self.window)
+
+	def update(self, panel, out, start):
+
+		x = self._values(panel)
+		size = x.shape[1]
+		w = self.window
+		lo = max(start, w)
+		first = lo - w + 1
+
+		out[:, start:lo] = np.nan
+		with np.errstate(divide='ignore', invalid='ignore'):
+			r = np.log(x[:, first:size] / x[:, first - 1:size - 1])
+		r[~np.isfinite(r)] = np.nan
+
+		sums, counts = _window_sums(r, w)
+		squares, _ = _window_sums(r * r, w)
+		variance = np.maximum(squares - sums * sums / w, 0.0) / (w - 1)
+		std = np.where(counts == w, np.sqrt(variance), np.nan)
+		if self.periods_per_year:
+			std *= np.sqrt(self.periods_per_year)
+		out[:, lo:size] = std
+
+class VWAP(Indicator):
+
+	# Volume weighted average price, cumulative from each coin's first bar or over the last
+	# `window` columns. The API reports volume in the quote currency, so each bar weighs
+	# `volume / price` coins: VWAP = sum(volume) / sum(volume / price). `price` defaults to
+	# the typical price (high + low + close) / 3 for OHLCV, the panel's price otherwise.
+	def __init__(self, window=None, price=None, volume=None, name=None):
+		self.window = window
+		self.price = price
+		self.volume = volume
+		self.cumulative = window is None
+		Indicator.__init__(self, None, name)
+
+	def _name(self):
+		return 'vwap' if self.window is None else 'vwap_{}'.format(self.window)
+
+	def reset(self, n):
+		self._quote = np.zeros(n)
+		self._base = np.zeros(n)
+
+	def _columns(self, panel, lo, size):
+
+		if self.price is not None:
+			price = panel[self.price][:, lo:size]
+		elif panel.price == 'close':
+			price = (panel['high'][:, lo:size] + panel['low'][:, lo:size] + panel['close'][:, lo:size]) / 3
+		else:
+			price = panel[panel.price][:, lo:size]
+		volume = panel[self.volume or panel.volume][:, lo:size]
+
+		valid = (price > 0) & (volume >= 0)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(valid, volume, np.nan), np.where(valid, volume / price, np.nan)
+
+	def update(self, panel, out, start):
+
+		size = panel.size
+		if self.window is None:
+			quote, base = self._columns(panel, start, size)
+			quote = self._quote[:, None] + np.nancumsum(quote, axis=1)
+			base = self._base[:, None] + np.nancumsum(base, axis=1)
+			self._quote, self._base = quote[:, -1], base[:, -1]
+		else:
+			w = self.window
+			lo = max(start, w - 1)
+			out[:, start:lo] = np.nan
+			quote, base = self._columns(panel, lo - w + 1, size)
+			quote, _ = _window_sums(quote, w)
+			base, _ = _window_sums(base, w)
+			start = lo
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			out[:, start:size] = np.where(base > 0, quote / base, np.nan)
+
+class Drawdown(Indicator):
+
+	# Fall from the highest value so far, as a fraction: 0 at a new high, -0.5 at half of it.
+	cumulative = True
+
+	def reset(self, n):
+		self._peak = np.full(n, np.nan)
+
+	def _drawdown(self, panel, start):
+		x = self._values(panel)[:, start:]
+		peaks = np.fmax.accumulate(np.column_stack([self._peak, x]), axis=1)[:, 1:]
+		self._peak = peaks[:, -1]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return x / peaks - 1
+
+	def update(self, panel, out, start):
+		out[:, start:panel.size] = self._drawdown(panel, start)
+
+class MaxDrawdown(Drawdown):
+
+	# Deepest drawdown so far.
+	def _name(self):
+		return 'max_drawdown'
+
+	def reset(self, n):
+		Drawdown.reset(self, n)
+		self._worst = np.full(n, np.nan)
+
+	def update(self, panel, out, start):
+		drawdown = self._drawdown(panel, start)
+		worst = np.fmin.accumulate(np.column_stack([self._worst, drawdown]), axis=1)[:, 1:]
+		self._worst = worst[:, -1]
+		out[:, start:panel.size] = worst
+
+class Engine(object):
+
+	# Keeps a set of indicators computed over a `Panel`, for every coin at once. Appending
+	# bars with `append()` only computes the new columns (plus whatever earlier columns the
+	# new data changed), instead of the whole history.
+	#
+	# Inputs
+	# panel         `Panel`.
+	# indicators    list of `Indicator`s, e.g. `[Returns(), SMA(20), EMA(12), VWAP(),
+	#               Volatility(30, 365), Drawdown(), MaxDrawdown()]`. Each result is read
+	#               by name as a (coins, timestamps) array: `engine['sma_20']`.
+	def __init__(self, panel, indicators):
+		self.panel = panel
+		self.indicators = list(indicators)
+		self._out = {}
+		self._rows = None
+		self._done = 0
+		self._update(0)
+
+	def __getitem__(self, name):
+		return self._out[name][:, :self.panel.size]
+
+	def __contains__(self, name):
+		return name in self._out
+
+	def names(self):
+		return [i.name for i in self.indicators]
+
+	# Adds a response to the panel and updates every indicator. Returns the first column
+	# recomputed.
+	def append(self, response):
+		start = self.panel.append(response)
+		self._update(start)
+		return start
+
+	def _update(self, start):
+
+		panel = self.panel
+		rows = panel.n != self._rows
+		for indicator in self.indicators:
+			out = self._out.get(indicator.name)
+			first = start
+			if rows or out is None:
+				out = np.full((panel.n, panel.capacity), np.nan)
+				indicator.reset(panel.n)
+				first = 0
+			else:
+				out = _grow(out, panel.size)
+				if indicator.cumulative and start < self._done:
+					indicator.reset(panel.n)
+					first = 0
+
+			self._out[indicator.name] = out
+			if first < panel.size:
+				indicator.update(panel, out, first)
+
+		self._rows = panel.n
+		self._done = panel.size
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Spreads requests over several API keys, setting aside keys that hit their limits.
+"""
+
+import datetime
+import threading
+import time
+
+from .ratelimit import CreditScheduler, MINUTE_LIMIT, DAILY_LIMIT, MONTHLY_LIMIT
+
+class _Key(object):
+
+	# `plan` is `None` if the key was given without one.
+	def __init__(self, index, key, plan=None):
+		self.key = key
+		self.given = plan
+		self.plan = plan or 'basic'
+		self.weight = CreditScheduler.plans.get(self.plan, CreditScheduler.plans['basic'])[0]
+		self.scheduler = None
+		self.current = 0
+		self.requests = 0
+		self.in_flight = 0
+		self.credits = 0
+		self.ejections = 0
+		self.ejected_until = 0.0
+
+		# Shown instead of the key itself in `stats()`, so they can be logged.
+		self.label = '{}:...{}'.format(index, key[-4:] if len(key) > 8 else '')
+
+class KeyPool(object):
+
+	policies = ('round-robin', 'least-used', 'weighted')
+
+	# Statuses the transport retries on the same key. 429 is left out: the request is
+	# sent again with another key instead (see `CMC._send()`).
+	retry_status = (500, 502, 503, 504)
+
+	# Picks an API key for each request and tracks each key's usage.
+	#
+	# Inputs
+	# keys      list of keys, list of `(key, plan)` pairs, or dict of key -> plan. Plans are
+	#           as in `CreditScheduler.plans` and default to 'basic'.
+	# policy    string, how to pick a key:
+	#           'round-robin'   each key in turn.
+	#           'least-used'    the key with the fewest credits used and requests in flight.
+	#           'weighted'      in proportion to each plan's calls per minute (smooth
+	#                           weighted round-robin).
+	# cooldown  float, seconds a key is set aside after a 429 or per-minute limit error.
+	#
+	# A key that hits its daily or monthly limit is set aside until the UTC day or month
+	# rolls over. Each key can also be given its own `CreditScheduler` (see `budget()`).
+	def __init__(self, keys, policy='round-robin', cooldown=60):
+
+		if policy not in self.policies:
+			raise ValueError('Unknown key policy `{}`, expected one of {}.'.format(policy, self.policies))
+
+		if isinstance(keys, dict):
+			keys = keys.items()
+		self._keys = [_Key(i, *k) if isinstance(k, (tuple, list)) else _Key(i, k) for i, k in enumerate(keys)]
+		if not self._keys:
+			raise ValueError('KeyPool needs at least one key.')
+
+		self.policy = policy
+		self.cooldown = cooldown
+		self._by_key = {k.key : k for k in self._keys}
+		self._next = 0
+		self._lock = threading.Lock()
+
+		# Whether `acquire()` waits for a key whose scheduler is out of calls this minute.
+		self.blocking = False
+
+	def __len__(self):
+		return len(self._keys)
+
+	def headers(self, key):
+		return {'X-CMC_PRO_API_KEY' : key}
+
+	def _pick(self, live):
+
+		if self.policy == 'least-used':
+			return min(live, key=lambda k: (k.credits + k.in_flight, k.requests))
+
+		if self.policy == 'weighted':
+			total = sum(k.weight for k in live)
+			for k in live:
+				k.current += k.weight
+			best = max(live, key=lambda k: k.current)
+			best.current -= total
+			return best
+
+		while True:
+			k = self._keys[self._next % len(self._keys)]
+			self._next += 1
+			if k in live:
+				return k
+
+	# Budgets each key on its own, with a `CreditScheduler` for its plan (or for `plan`, for
+	# keys given without one), so the pool's rate is the sum of its keys' rates. A key
+	# whose scheduler refuses a call is skipped like a key set aside. If `blocking`, and
+	# only per-minute caps are in the way, `acquire()` waits for the first key to free up.
+	def budget(self, plan='basic', blocking=True):
+		with self._lock:
+			for k in self._keys:
+				k.scheduler = CreditScheduler(k.given or plan, blocking=False)
+			self.blocking = blocking
+
+	# A key to send the next request with, or `None` if every key is set aside or out of
+	# budget. `blocking` overrides the instance setting for this call.
+	def acquire(self, blocking=None):
+
+		if blocking is None:
+			blocking = self.blocking
+
+		while True:
+			now = time.time()
+			with self._lock:
+				live = [k for k in self._keys if k.ejected_until <= now]
+				while live:
+					k = self._pick(live)
+					if k.scheduler is None or k.scheduler.acquire(False) is None:
+						k.requests += 1
+						k.in_flight += 1
+						return k.key
+					live.remove(k)
+
+			if not blocking or not self.throttled():
+				return None
+			time.sleep(self.delay())
+
+	# True if the key's daily or monthly budget is used up.
+	def _spent(self, k):
+		remaining = k.scheduler.remaining()
+		return remaining['daily_credits'] <= 0 or remaining['monthly_credits'] <= 0
+
+	# True if a key is held back only by its per-minute cap, so waiting `delay()` helps.
+	def throttled(self):
+
+		now = time.time()
+		with self._lock:
+			return any(
+				k.ejected_until <= now and k.scheduler is not None and not self._spent(k)
+				for k in self._keys
+			)
+
+	# Seconds until the first set-aside key is back, or the first budgeted key has a call
+	# left this minute. Keys out of budget are left out.
+	def delay(self):
+
+		now = time.time()
+		with self._lock:
+			waits = []
+			for k in self._keys:
+				wait = k.ejected_until - now
+				if k.scheduler is not None:
+					if self._spent(k):
+						continue
+					wait = max(wait, k.scheduler.delay())
+				waits.append(wait)
+			return max(0.0, min(waits)) if waits else 0.0
+
+	# Records the response to a request made with `key`. `status` is the response's
+	# `status` block, or `None` if no response came back. Returns True if the key was set
+	# aside, in which case the request may be worth retrying with another key.
+	def record(self, key, status, http_status=None):
+
+		status = status if isinstance(status, dict) else {}
+		code = status.get('error_code')
+
+		with self._lock:
+			k = self._by_key.get(key)
+			if k is None:
+				return False
+
+			k.in_flight = max(0, k.in_flight - 1)
+			k.credits += status.get('credit_count') or 0
+			if k.scheduler is not None:
+				k.scheduler.record(status)
+
+			if code == DAILY_LIMIT:
+				until = self._tomorrow()
+			elif code == MONTHLY_LIMIT:
+				until = self._next_month()
+			elif code == MINUTE_LIMIT or http_status == 429:
+				until = time.time() + self.cooldown
+			else:
+				return False
+
+			k.ejected_until = max(k.ejected_until, until)
+			k.ejections += 1
+			return True
+
+	def _tomorrow(self):
+		now = datetime.datetime.now(datetime.timezone.utc)
+		midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+		return (midnight + datetime.timedelta(days=1)).timestamp()
+
+	def _next_month(self):
+		now = datetime.datetime.now(datetime.timezone.utc)
+		year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+		return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+	# Usage of each key, by its place in the pool and the last four characters of the key
+	# (e.g. '0:...a1b2'), so the stats can be logged. Budgeted keys also report what is
+	# `remaining` of their budget.
+	def stats(self):
+
+		now = time.time()
+		with self._lock:
+			stats = {}
+			for k in self._keys:
+				stats[k.label] = {
+					'plan' : k.plan,
+					'requests' : k.requests,
+					'in_flight' : k.in_flight,
+					'credits' : k.credits,
+					'ejections' : k.ejections,
+					'ejected_for' : max(0.0, k.ejected_until - now),
+				}
+				if k.scheduler is not None:
+					stats[k.label]['remaining'] = k.scheduler.remaining()
+			return stats
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of `metadata()` records, compressed and stored by content hash.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+from .decoders import get_decoder
+
+class MetadataCache(object):
+
+	# Records are zlib compressed and appended to `objects.pack`, once per distinct content:
+	# each is addressed by the SHA-256 of its canonical JSON, so a record fetched again
+	# unchanged costs no write and identical records share one copy. `index.json` maps each
+	# coin ID to the hash of its record and when it was fetched, and each hash to its place
+	# in the pack, so checking freshness never touches the pack.
+	#
+	# Inputs
+	# root      string, directory for the cache. Created if missing.
+	# max_age   float, seconds a record is served before it is fetched again.
+	# level     int, zlib compression level.
+	# decode    callable, JSON decoder taking bytes (see `pyCMC/decoders.py`).
+	#
+	# Several processes may share `root`. Appends to the pack never overlap, and index
+	# updates are merged with what is on disk before it is replaced, so at worst a record
+	# is fetched twice. The pack only grows; records that changed upstream leave their old
+	# version behind.
+	def __init__(self, root, max_age=7 * 86400, level=6, decode=None):
+		self.root = root
+		self.max_age = max_age
+		self.level = level
+		self.decode = decode or get_decoder()
+		self._lock = threading.Lock()
+
+		os.makedirs(root, exist_ok=True)
+		self.index_path = os.path.join(root, 'index.json')
+		self.pack_path = os.path.join(root, 'objects.pack')
+		self.ids, self.objects = self._load()
+		self._pack = None
+
+	def _load(self):
+		try:
+			with open(self.index_path, 'r') as f:
+				index = json.load(f)
+			return index['ids'], index['objects']
+		except (OSError, ValueError, KeyError):
+			return {}, {}
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __contains__(self, coinId):
+		return str(coinId) in self.ids
+
+	# True if the record for `coinId` is cached and younger than `max_age`.
+	def fresh(self, coinId, now=None):
+		entry = self.ids.get(str(coinId))
+		return entry is not None and (now or time.time()) - entry[1] < self.max_age
+
+	def _read(self, digest):
+		if self._pack is None:
+			self._pack = os.open(self.pack_path, os.O_RDONLY)
+		offset, length = self.objects[digest]
+		return self.decode(zlib.decompress(os.pread(self._pack, length, offset)))
+
+	# Splits `ids` into `(found, missing)`: a dict of the fresh cached records by ID, and
+	# a list of the IDs that are unknown, stale or unreadable.
+	def get(self, ids):
+
+		now = time.time()
+		found = {}
+		missing = []
+		for coinId in ids:
+			coinId = str(coinId)
+			if not self.fresh(coinId, now):
+				missing.append(coinId)
+				continue
+			try:
+				found[coinId] = self._read(self.ids[coinId][0])
+			except (OSError, ValueError, KeyError, zlib.error):
+				missing.append(coinId)
+		return found, missing
+
+	# Stores `records`, a dict of coin ID -> record as in the `data` of `metadata()`.
+	def put(self, records):
+
+		now = time.time()
+		ids = {}
+		blobs = {}
+		for coinId, record in records.items():
+			body = json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+			digest = hashlib.sha256(body).hexdigest()
+			ids[str(coinId)] = [digest, now]
+			if digest not in self.objects:
+				blobs[digest] = zlib.compress(body, self.level)
+
+		with self._lock:
+			on_disk, objects = self._load()
+
+			# O_APPEND makes each write land at the end of the file, even with other
+			# processes appending too.
+			if blobs:
+				with open(self.pack_path, 'ab') as f:
+					for digest, blob in blobs.items():
+						if digest in objects:
+							continue
+						f.write(blob)
+						f.flush()
+						objects[digest] = [f.tell() - len(blob), len(blob)]
+
+			objects.update({d : o for d, o in self.objects.items() if d not in objects})
+			for coinId, entry in self.ids.items():
+				if coinId not in on_disk or on_disk[coinId][1] < entry[1]:
+					on_disk[coinId] = entry
+			on_disk.update(ids)
+			self.ids, self.objects = on_disk, objects
+
+			tmp = '{}.{}.tmp'.format(self.index_path, os.getpid())
+			with open(tmp, 'w') as f:
+				json.dump({'ids' : on_disk, 'objects' : objects}, f)
+			os.replace(tmp, self.index_path)
+
+	def close(self):
+		if self._pack is not None:
+			os.close(self._pack)
+			self._pack = None
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Per-endpoint request metrics, with a Prometheus text exporter and request hooks.
+"""
+
+from collections import Counter
+import bisect
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets. The last bucket is unbounded.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(object):
+
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	# Estimated `p`-th percentile (0-100), interpolating within the bucket it falls in.
+	# `None` with no observations. Values in the unbounded bucket are reported as the
+	# last bound.
+	def percentile(self, p):
+
+		if not self.count:
+			return None
+
+		rank = p / 100.0 * self.count
+		seen = 0
+		for i, n in enumerate(self.counts):
+			if n and seen + n >= rank:
+				if i == len(self.buckets):
+					return self.buckets[-1]
+				lo = self.buckets[i - 1] if i else 0.0
+				return lo + (self.buckets[i] - lo) * (rank - seen) / n
+			seen += n
+		return self.buckets[-1]
+
+	def snapshot(self):
+		return {
+			'buckets' : list(self.buckets),
+			'counts' : list(self.counts),
+			'sum' : self.sum,
+			'count' : self.count,
+			'p50' : self.percentile(50),
+			'p95' : self.percentile(95),
+			'p99' : self.percentile(99),
+		}
+
+class Metrics(object):
+
+	# Counters and latency histograms for each endpoint a client calls. Safe to share
+	# between threads.
+	#
+	# Inputs
+	# buckets   tuple, upper bounds in seconds of the latency histogram buckets.
+	#
+	# Per endpoint, this keeps
+	# calls         calls made through the client, including cache hits.
+	# cache_hits    calls answered from the cache.
+	# requests      requests sent upstream (a coalesced batch counts once).
+	# network       histogram of seconds spent sending the request and reading the body,
+	#               retries included.
+	# decode        histogram of seconds spent parsing the body.
+	# bytes         response bytes received.
+	# credits       credits charged, from `credit_count` in the response status.
+	# elapsed_ms    server side time, from `elapsed` in the response status.
+	# retries       retries made by the transport.
+	# http_status   count of each HTTP status received.
+	# error_codes   count of each non-zero `error_code`, both CMC's and the local ones
+	#               (see `CMC._error()`).
+	# hook_errors   exceptions raised by hooks.
+	#
+	# Hooks are called around every upstream request, on the calling thread:
+	# before(endpoint, parameters)
+	# after(endpoint, parameters, data, sample)
+	# where `sample` is a dict with the `network`, `decode`, `bytes`, `credits`,
+	# `elapsed_ms`, `retries`, `http_status` and `error_code` of that request. A hook that
+	# raises is logged to the `pyCMC.metrics` logger and counted, and the request goes on.
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self.before = []
+		self.after = []
+		self._lock = threading.Lock()
+		self._endpoints = {}
+
+	def add_hook(self, before=None, after=None):
+		if before is not None:
+			self.before.append(before)
+		if after is not None:
+			self.after.append(after)
+
+	def remove_hook(self, hook):
+		for hooks in (self.before, self.after):
+			if hook in hooks:
+				hooks.remove(hook)
+
+	def _stats(self, endpoint):
+
+		stats = self._endpoints.get(endpoint)
+		if stats is None:
+			stats = {
+				'calls' : 0,
+				'cache_hits' : 0,
+				'requests' : 0,
+				'network' : Histogram(self.buckets),
+				'decode' : Histogram(self.buckets),
+				'bytes' : 0,
+				'credits' : 0,
+				'elapsed_ms' : 0,
+				'retries' : 0,
+				'http_status' : Counter(),
+				'error_codes' : Counter(),
+				'hook_errors' : 0,
+			}
+			self._endpoints[endpoint] = stats
+		return stats
+
+	def call(self, endpoint, cached=False):
+		with self._lock:
+			stats = self._stats(endpoint)
+			stats['calls'] += 1
+			if cached:
+				stats['cache_hits'] += 1
+
+	def _hooks(self, hooks, endpoint, *args):
+		for hook in list(hooks):
+			try:
+				hook(endpoint, *args)
+			except Exception:
+				log.exception('Metrics hook %r raised for %s.', hook, endpoint)
+				with self._lock:
+					self._stats(endpoint)['hook_errors'] += 1
+
+	def request(self, endpoint, parameters):
+		self._hooks(self.before, endpoint, parameters)
+
+	# Records one upstream response. `data` is the decoded response (or an error dict).
+	def response(self, endpoint, parameters, data, network=None, decode=None, size=0, http_status=None, retries=0):
+
+		status = data.get('status') or {}
+		sample = {
+			'network' : network,
+			'decode' : decode,
+			'bytes' : size,
+			'credits' : status.get('credit_count') or 0,
+			'elapsed_ms' : status.get('elapsed') or 0,
+			'retries' : retries,
+			'http_status' : http_status,
+			'error_code' : status.get('error_code'),
+		}
+
+		with self._lock:
+			stats = self._stats(endpoint)
+			stats['requests'] += 1
+			if network is not None:
+				stats['network'].observe(network)
+			if decode is not None:
+				stats['decode'].observe(decode)
+			stats['bytes'] += size
+			stats['credits'] += sample['credits']
+			stats['elapsed_ms'] += sample['elapsed_ms']
+			stats['retries'] += retries
+			if http_status is not None:
+				stats['http_status'][http_status] += 1
+			if sample['error_code']:
+				stats['error_codes'][sample['error_code']] += 1
+
+		self._hooks(self.after, endpoint, parameters, data, sample)
+
+	# Records an error found locally, before any request was sent.
+	def error(self, endpoint, code):
+		with self._lock:
+			self._stats(endpoint)['error_codes'][code] += 1
+
+	# Estimated `p`-th percentile of network latency for `endpoint`, or `None`.
+	def percentile(self, endpoint, p, phase='network'):
+		with self._lock:
+			stats = self._endpoints.get(endpoint)
+			return stats[phase].percentile(p) if stats is not None else None
+
+	# Number of latency observations for `endpoint`.
+	def count(self, endpoint, phase='network'):
+		with self._lock:
+			stats = self._endpoints.get(endpoint)
+			return stats[phase].count if stats is not None else 0
+
+	# Plain dict copy of everything recorded, by endpoint.
+	def snapshot(self):
+
+		with self._lock:
+			snapshot = {}
+			for endpoint, stats in self._endpoints.items():
+				snapshot[endpoint] = {
+					name : value.snapshot() if isinstance(value, Histogram) else
+						dict(value) if isinstance(value, Counter) else value
+					for name, value in stats.items()
+				}
+			return snapshot
+
+	def reset(self):
+		with self._lock:
+			self._endpoints = {}
+
+	# Everything recorded in the Prometheus text exposition format.
+	def prometheus(self, prefix='pycmc'):
+
+		snapshot = self.snapshot()
+		lines = []
+
+		def family(name, kind, help):
+			lines.append('# HELP {}_{} {}'.format(prefix, name, help))
+			lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+		def sample(name, labels, value):
+			text = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+			lines.append('{}_{}{{{}}} {}'.format(prefix, name, text, value))
+
+		counters = (
+			('calls', 'calls_total', 'Calls made through the client, including cache hits.'),
+			('cache_hits', 'cache_hits_total', 'Calls answered from the cache.'),
+			('requests', 'requests_total', 'Requests sent upstream.'),
+			('bytes', 'response_bytes_total', 'Response bytes received.'),
+			('credits', 'credits_total', 'API credits charged.'),
+			('elapsed_ms', 'server_elapsed_milliseconds_total', 'Server side time reported by the API.'),
+			('retries', 'retries_total', 'Requests retried by the transport.'),
+			('hook_errors', 'hook_errors_total', 'Exceptions raised by request hooks.'),
+		)
+		for key, name, help in counters:
+			family(name, 'counter', help)
+			for endpoint, stats in snapshot.items():
+				sample(name, [('endpoint', endpoint)], stats[key])
+
+		family('http_responses_total', 'counter', 'HTTP responses received, by status.')
+		for endpoint, stats in snapshot.items():
+			for code, n in sorted(stats['http_status'].items()):
+				sample('http_responses_total', [('endpoint', endpoint), ('status', code)], n)
+
+		family('errors_total', 'counter', 'Responses with a non-zero error code, including local errors.')
+		for endpoint, stats in snapshot.items():
+			for code, n in sorted(stats['error_codes'].items()):
+				sample('errors_total', [('endpoint', endpoint), ('code', code)], n)
+
+		family('request_seconds', 'histogram', 'Request latency, by phase.')
+		for endpoint, stats in snapshot.items():
+			for phase in ('network', 'decode'):
+				hist = stats[phase]
+				labels = [('endpoint', endpoint), ('phase', phase)]
+				total = 0
+				for bound, n in zip(hist['buckets'] + ['+Inf'], hist['counts']):
+					total += n
+					sample('request_seconds_bucket', labels + [('le', bound)], total)
+				sample('request_seconds_sum', labels, hist['sum'])
+				sample('request_seconds_count', labels, hist['count'])
+
+		return '\n'.join(lines) + '\n'
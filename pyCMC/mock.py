@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the CMC API, serving synthetic data for tests and benchmarks.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import datetime
+import json
+import random
+import threading
+import time
+
+from .backfill import INTERVAL_SECONDS, parse_time
+
+def _now():
+	return datetime.datetime.now(datetime.timezone.utc)
+
+def _iso(moment):
+	return moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+class Universe(object):
+
+	# Deterministic synthetic coins. Coin `i` (1 based) always has the same symbol, price
+	# and supply, so responses are stable across requests.
+	#
+	# Inputs
+	# coins         int, number of active coins.
+	# inactive      int, number of inactive coins, with IDs after the active ones.
+	# pairs         int, market pairs per coin.
+	def __init__(self, coins=10_000, inactive=2_000, pairs=500):
+		self.coins = coins
+		self.inactive = inactive
+		self.pairs = pairs
+		self._symbols = None
+
+	# First coin with each symbol.
+	def by_symbol(self, symbol):
+		if self._symbols is None:
+			symbols = {}
+			for i in range(self.coins + self.inactive, 0, -1):
+				symbols[self.symbol(i)] = i
+			self._symbols = symbols
+		return self._symbols.get(symbol)
+
+	def _random(self, coinId):
+		return random.Random(coinId)
+
+	def symbol(self, coinId):
+		# Every 50th coin reuses an earlier symbol, as real symbols collide.
+		if coinId > 50 and coinId % 50 == 0:
+			return self.symbol(coinId // 50)
+		letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+		name, n = '', coinId
+		while n:
+			n, r = divmod(n - 1, 26)
+			name = letters[r] + name
+		return 'C' + name
+
+	def price(self, coinId, moment=None):
+		rng = self._random(coinId)
+		base = 10 ** rng.uniform(-4, 4)
+		if moment is not None:
+			phase = moment.timestamp() / 86400.0
+			base *= 1 + 0.05 * ((phase * (1 + coinId % 7)) % 1 - 0.5)
+		return base
+
+	def coin(self, coinId):
+		symbol = self.symbol(coinId)
+		return {
+			'id' : coinId,
+			'name' : 'Coin {}'.format(coinId),
+			'symbol' : symbol,
+			'slug' : 'coin-{}'.format(coinId),
+		}
+
+	def map_record(self, coinId):
+		record = self.coin(coinId)
+		active = coinId <= self.coins
+		added = datetime.datetime(2013, 4, 28, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=coinId // 4)
+		record.update({
+			'rank' : coinId if active else None,
+			'is_active' : 1 if active else 0,
+			'first_historical_data' : _iso(added),
+			'last_historical_data' : _iso(_now()),
+			'platform' : None if coinId % 3 else {'id' : 1027, 'name' : 'Ethereum', 'symbol' : 'ETH', 'slug' : 'ethereum', 'token_address' : '0x' + '%040x' % coinId},
+		})
+		return record
+
+	def quote(self, coinId, currencies, moment=None):
+		rng = self._random(coinId)
+		price = self.price(coinId, moment)
+		supply = rng.uniform(1e6, 1e10)
+		quote = {}
+		for currency in currencies:
+			rate = self.price(int(currency), moment) if str(currency).isdigit() else (1.0 if currency == 'USD' else 1.1)
+			quote[currency] = {
+				'price' : price / rate,
+				'volume_24h' : price * supply * rng.uniform(0.001, 0.2) / rate,
+				'percent_change_1h' : rng.uniform(-2, 2),
+				'percent_change_24h' : rng.uniform(-10, 10),
+				'percent_change_7d' : rng.uniform(-30, 30),
+				'market_cap' : price * supply / rate,
+				'last_updated' : _iso(moment or _now()),
+			}
+		return quote
+
+	def listing(self, coinId, currencies):
+		rng = self._random(coinId)
+		record = self.coin(coinId)
+		supply = rng.uniform(1e6, 1e10)
+		record.update({
+			'num_market_pairs' : self.pairs,
+			'date_added' : self.map_record(coinId)['first_historical_data'],
+			'tags' : ['mineable'] if coinId % 2 else [],
+			'max_supply' : None if coinId % 4 else supply * 2,
+			'circulating_supply' : supply,
+			'total_supply' : supply * 1.1,
+			'platform' : self.map_record(coinId)['platform'],
+			'cmc_rank' : coinId,
+			'last_updated' : _iso(_now()),
+			'quote' : self.quote(coinId, currencies),
+		})
+		return record
+
+	def info(self, coinId):
+		record = self.coin(coinId)
+		record.update({
+			'category' : 'coin' if coinId % 3 else 'token',
+			'description' : ' '.join(['{} is a synthetic cryptocurrency.'.format(record['name'])] * 20),
+			'logo' : 'https://s2.coinmarketcap.com/static/img/coins/64x64/{}.png'.format(coinId),
+			'tags' : ['mineable'] if coinId % 2 else [],
+			'platform' : self.map_record(coinId)['platform'],
+			'date_added' : self.map_record(coinId)['first_historical_data'],
+			'urls' : {
+				'website' : ['https://coin{}.example.org/'.format(coinId)],
+				'twitter' : [],
+				'reddit' : ['https://reddit.com/r/coin{}'.format(coinId)],
+				'message_board' : [],
+				'announcement' : [],
+				'chat' : [],
+				'explorer' : ['https://explorer.example.org/coin{}'.format(coinId)],
+				'source_code' : ['https://github.com/example/coin{}'.format(coinId)],
+			},
+		})
+		return record
+
+	def market_pair(self, coinId, index, currencies):
+		rng = random.Random(coinId * 100_003 + index)
+		price = self.price(coinId)
+		return {
+			'exchange' : {'id' : index % 300 + 1, 'name' : 'Exchange {}'.format(index % 300 + 1), 'slug' : 'exchange-{}'.format(index % 300 + 1)},
+			'market_pair' : '{}/USD{}'.format(self.symbol(coinId), index),
+			'market_pair_base' : {'currency_id' : coinId, 'currency_symbol' : self.symbol(coinId), 'currency_type' : 'cryptocurrency'},
+			'market_pair_quote' : {'currency_id' : 2781, 'currency_symbol' : 'USD', 'currency_type' : 'fiat'},
+			'quote' : {
+				'exchange_reported' : {'price' : price, 'volume_24h_base' : rng.uniform(0, 1e6), 'volume_24h_quote' : rng.uniform(0, 1e6), 'last_updated' : _iso(_now())},
+				**{c : {'price' : price, 'volume_24h' : rng.uniform(0, 1e7), 'last_updated' : _iso(_now())} for c in currencies},
+			},
+		}
+
+	def ohlcv(self, coinId, start, seconds, currencies):
+		end = start + datetime.timedelta(seconds=seconds)
+		rng = random.Random(coinId * 7 + int(start.timestamp()))
+		open_ = self.price(coinId, start)
+		close = self.price(coinId, end)
+		quote = {}
+		for currency in currencies:
+			rate = 1.0 if currency == 'USD' else 1.1
+			quote[currency] = {
+				'open' : open_ / rate,
+				'high' : max(open_, close) * rng.uniform(1, 1.02) / rate,
+				'low' : min(open_, close) * rng.uniform(0.98, 1) / rate,
+				'close' : close / rate,
+				'volume' : open_ * rng.uniform(1e5, 1e7) / rate,
+				'market_cap' : close * 1e8 / rate,
+				'timestamp' : _iso(end),
+			}
+		return {'time_open' : _iso(start), 'time_close' : _iso(end), 'quote' : quote}
+
+class MockServer(object):
+
+	# Serves every endpoint `CMC` calls, on localhost, from a `Universe`. Point a client at
+	# it with `cmc.root_url = server.root_url`.
+	#
+	# Inputs
+	# universe      `Universe`, the synthetic data to serve.
+	# latency       float or (min, max) tuple, seconds added to every response.
+	# error_rate    float, fraction of requests answered with HTTP 500.
+	# limit_rate    float, fraction of requests answered with HTTP 429 and CMC's error 1008.
+	# port          int, 0 picks a free port.
+	#
+	#     with MockServer(latency=0.05) as server:
+	#         cmc = CMC('key')
+	#         cmc.root_url = server.root_url
+	def __init__(self, universe=None, latency=0, error_rate=0, limit_rate=0, port=0):
+		self.universe = universe or Universe()
+		self.latency = latency
+		self.error_rate = error_rate
+		self.limit_rate = limit_rate
+		self.requests = {}
+		self._lock = threading.Lock()
+
+		server = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			protocol_version = 'HTTP/1.1'
+
+			def do_GET(self):
+				server._handle(self)
+
+			def log_message(self, *args):
+				pass
+
+		self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+		self.httpd.daemon_threads = True
+		self.root_url = 'http://127.0.0.1:{}/v1/'.format(self.httpd.server_address[1])
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def _status(self, code=0, message=None, credits=1, started=None):
+		return {
+			'timestamp' : _iso(_now()),
+			'error_code' : code,
+			'error_message' : message,
+			'elapsed' : int((time.monotonic() - started) * 1000) if started else 0,
+			'credit_count' : credits,
+			'notice' : None,
+		}
+
+	def _send(self, handler, http_status, body):
+		payload = json.dumps(body).encode('utf-8')
+		handler.send_response(http_status)
+		handler.send_header('Content-Type', 'application/json; charset=utf-8')
+		handler.send_header('Content-Length', str(len(payload)))
+		handler.end_headers()
+		handler.wfile.write(payload)
+
+	def _handle(self, handler):
+
+		started = time.monotonic()
+		url = urlparse(handler.path)
+		endpoint = url.path[len('/v1/'):] if url.path.startswith('/v1/') else url.path
+		params = {k : v[-1] for k, v in parse_qs(url.query).items()}
+
+		with self._lock:
+			self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+		latency = self.latency
+		if isinstance(latency, tuple):
+			latency = random.uniform(*latency)
+		if latency:
+			time.sleep(latency)
+
+		roll = random.random()
+		if roll < self.limit_rate:
+			return self._send(handler, 429, {'status' : self._status(1008, "You've exceeded your API Key's HTTP request rate limit.", 0, started)})
+		if roll < self.limit_rate + self.error_rate:
+			return self._send(handler, 500, {'status' : self._status(500, 'Internal server error.', 0, started)})
+
+		route = self.routes.get(endpoint)
+		if route is None:
+			return self._send(handler, 404, {'status' : self._status(404, 'Unknown endpoint.', 0, started)})
+
+		try:
+			data, credits = route(self, params)
+		except (KeyError, ValueError) as e:
+			return self._send(handler, 400, {'status' : self._status(400, 'Invalid value: {}'.format(e), 0, started)})
+
+		self._send(handler, 200, {'status' : self._status(0, None, credits, started), 'data' : data})
+
+	# Helpers for parameters.
+
+	def _currencies(self, params):
+		return (params.get('convert_id') or params.get('convert') or 'USD').split(',')
+
+	def _page(self, params, total):
+		start = max(1, int(params.get('start', 1)))
+		limit = max(1, min(5000, int(params.get('limit', 100))))
+		return range(start, min(total, start + limit - 1) + 1)
+
+	def _credits(self, points):
+		return max(1, (points + 99) // 100)
+
+	# Turns `id`, `slug` or `symbol` into a list of `(key, coinId)`, keyed as the API keys
+	# responses for that input.
+	def _ids(self, params):
+		u = self.universe
+		total = u.coins + u.inactive
+		if 'id' in params:
+			ids = [int(i) for i in params['id'].split(',')]
+			for i in ids:
+				if not 1 <= i <= total:
+					raise ValueError('id {}'.format(i))
+			return [(str(i), i) for i in ids]
+		if 'slug' in params:
+			return [(str(int(s.rsplit('-', 1)[1])), int(s.rsplit('-', 1)[1])) for s in params['slug'].split(',')]
+		if 'symbol' in params:
+			found = []
+			for symbol in params['symbol'].split(','):
+				i = u.by_symbol(symbol)
+				if i is None:
+					raise ValueError('symbol {}'.format(symbol))
+				found.append((symbol, i))
+			return found
+		raise KeyError('id')
+
+	def _times(self, params, default_interval):
+		seconds = INTERVAL_SECONDS.get(params.get('interval', default_interval), 86400)
+		count = int(params.get('count', 10))
+		end = parse_time(params['time_end']) if 'time_end' in params else _now()
+		if 'time_start' in params:
+			start = parse_time(params['time_start'])
+		else:
+			start = end - datetime.timedelta(seconds=seconds * count)
+		moments = []
+		moment = start
+		while moment <= end and len(moments) < 10_000:
+			moments.append(moment)
+			moment += datetime.timedelta(seconds=seconds)
+		return moments, seconds
+
+	# Endpoints. Each returns `(data, credit_count)`.
+
+	def _map(self, params):
+		u = self.universe
+		if 'symbol' in params:
+			ids = [i for _, i in self._ids(params)]
+		elif params.get('listing_status') == 'inactive':
+			ids = [u.coins + i for i in self._page(params, u.inactive)]
+		else:
+			ids = list(self._page(params, u.coins))
+		return [u.map_record(i) for i in ids], self._credits(len(ids))
+
+	def _info(self, params):
+		ids = self._ids(params)
+		return {key : self.universe.info(i) for key, i in ids}, self._credits(len(ids))
+
+	def _listings(self, params):
+		currencies = self._currencies(params)
+		ids = self._page(params, self.universe.coins)
+		return [self.universe.listing(i, currencies) for i in ids], self._credits(len(ids)) * len(currencies)
+
+	def _quotes(self, params):
+		currencies = self._currencies(params)
+		ids = self._ids(params)
+		return {key : self.universe.listing(i, currencies) for key, i in ids}, self._credits(len(ids)) * len(currencies)
+
+	def _historical_quotes(self, params):
+		currencies = self._currencies(params)
+		moments, _ = self._times(params, '5m')
+		coins = {}
+		for key, i in self._ids(params):
+			coin = self.universe.coin(i)
+			coin['quotes'] = [
+				{'timestamp' : _iso(m), 'quote' : {c : {k : v for k, v in q.items() if k in ('price', 'volume_24h', 'market_cap')} for c, q in self.universe.quote(i, currencies, m).items()}}
+				for m in moments
+			]
+			for point in coin['quotes']:
+				for q in point['quote'].values():
+					q['timestamp'] = point['timestamp']
+			coins[key] = coin
+		data = coins if len(coins) > 1 else next(iter(coins.values()))
+		return data, self._credits(len(moments) * len(coins))
+
+	def _market_pairs(self, params):
+		u = self.universe
+		currencies = self._currencies(params)
+		key, coinId = self._ids(params)[0]
+		data = u.coin(coinId)
+		pairs = self._page(params, u.pairs)
+		data['num_market_pairs'] = u.pairs
+		data['market_pairs'] = [u.market_pair(coinId, i, currencies) for i in pairs]
+		return data, self._credits(len(pairs)) * len(currencies)
+
+	def _ohlcv_latest(self, params):
+		currencies = self._currencies(params)
+		ids = self._ids(params)
+		today = _now().replace(hour=0, minute=0, second=0, microsecond=0)
+		data = {}
+		for key, i in ids:
+			record = self.universe.coin(i)
+			record.update(self.universe.ohlcv(i, today, 86400, currencies))
+			record['last_updated'] = _iso(_now())
+			data[key] = record
+		return data, self._credits(len(ids)) * len(currencies)
+
+	def _ohlcv_historical(self, params):
+		currencies = self._currencies(params)
+		moments, seconds = self._times(params, 'daily')
+		coins = {}
+		for key, i in self._ids(params):
+			coin = self.universe.coin(i)
+			coin['quotes'] = [self.universe.ohlcv(i, m, seconds, currencies) for m in moments]
+			coins[key] = coin
+		data = coins if len(coins) > 1 else next(iter(coins.values()))
+		return data, self._credits(len(moments) * len(coins))
+
+	def _global_metrics(self, params):
+		u = self.universe
+		currencies = self._currencies(params)
+		return {
+			'active_cryptocurrencies' : u.coins,
+			'active_market_pairs' : u.coins * u.pairs,
+			'active_exchanges' : 300,
+			'eth_dominance' : 9.5,
+			'btc_dominance' : 66.1,
+			'quote' : {c : {'total_market_cap' : 2.5e11, 'total_volume_24h' : 4.5e10, 'last_updated' : _iso(_now())} for c in currencies},
+			'last_updated' : _iso(_now()),
+		}, len(currencies)
+
+	def _price_conversion(self, params):
+		currencies = self._currencies(params)
+		key, coinId = self._ids(params)[0]
+		amount = float(params['amount'])
+		record = self.universe.coin(coinId)
+		record['amount'] = amount
+		record['last_updated'] = _iso(_now())
+		record['quote'] = {c : {'price' : amount * q['price'], 'last_updated' : q['last_updated']} for c, q in self.universe.quote(coinId, currencies).items()}
+		return record, len(currencies)
+
+	routes = {
+		'cryptocurrency/map' : _map,
+		'cryptocurrency/info' : _info,
+		'cryptocurrency/listings/latest' : _listings,
+		'cryptocurrency/listings/historical' : _listings,
+		'cryptocurrency/quotes/latest' : _quotes,
+		'cryptocurrency/quotes/historical' : _historical_quotes,
+		'cryptocurrency/market-pairs/latest' : _market_pairs,
+		'cryptocurrency/ohlcv/latest' : _ohlcv_latest,
+		'cryptocurrency/ohlcv/historical' : _ohlcv_historical,
+		'global-metrics/quotes/latest' : _global_metrics,
+		'tools/price-conversion' : _price_conversion,
+	}
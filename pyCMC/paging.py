@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy iteration over paginated endpoints.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Most records the API returns for one request. Larger limits are clamped to it.
+MAX_LIMIT = 5000
+
+class PageIterator(object):
+
+	# Yields records one at a time, fetching a page of `page_size` records whenever the
+	# previous one is used up. Stops after the first short page.
+	#
+	# Inputs
+	# fetch         callable, `fetch(start, limit)` returns the API response for one page.
+	# records       callable, `records(data)` returns the list of records in `data`.
+	# start         int, first record to return (1 based, as in the API).
+	# page_size     int, records per request, between 1 and `MAX_LIMIT`. Larger values are
+	#               clamped, since a page is only known to be the last when it is short.
+	# prefetch      int, number of pages to request ahead of the one being consumed, on a
+	#               thread pool. 0 fetches one page at a time.
+	#
+	# After iteration, `status` holds the `status` block of the last response. If a page
+	# fails, iteration stops and `status` holds its error.
+	def __init__(self, fetch, records, start=1, page_size=5000, prefetch=0):
+		self.fetch = fetch
+		self.records = records
+		self.start = start
+		self.page_size = max(1, min(MAX_LIMIT, page_size))
+		self.prefetch = prefetch
+		self.status = None
+
+	def _page(self, data):
+
+		self.status = data.get('status')
+		if not self.status or self.status.get('error_code') != 0:
+			return None
+
+		return self.records(data['data'])
+
+	def __iter__(self):
+		if self.prefetch > 0:
+			return self._prefetched()
+		return self._sequential()
+
+	def _sequential(self):
+
+		start = self.start
+		while True:
+			page = self._page(self.fetch(start, self.page_size))
+			if page is None:
+				return
+
+			full = len(page) >= self.page_size
+			for record in page:
+				yield record
+
+			# Drop our reference before the next request so only one page is alive.
+			page = None
+			if not full:
+				return
+			start += self.page_size
+
+	def _prefetched(self):
+
+		with ThreadPoolExecutor(self.prefetch + 1) as pool:
+			pending = deque()
+			start = self.start
+
+			for _ in range(self.prefetch + 1):
+				pending.append(pool.submit(self.fetch, start, self.page_size))
+				start += self.page_size
+
+			try:
+				while pending:
+					page = self._page(pending.popleft().result())
+					if page is None:
+						return
+
+					full = len(page) >= self.page_size
+					if full:
+						pending.append(pool.submit(self.fetch, start, self.page_size))
+						start += self.page_size
+
+					for record in page:
+						yield record
+
+					page = None
+					if not full:
+						return
+			finally:
+				for future in pending:
+					future.cancel()
+
+class AsyncPageIterator(PageIterator):
+
+	# `PageIterator` for `AsyncCMC`, iterated with `async for`. `fetch(start, limit)` returns
+	# a coroutine, and `prefetch` pages are requested ahead as tasks on the running loop.
+	def __iter__(self):
+		raise TypeError('Iterate over AsyncCMC pages with `async for`.')
+
+	def __aiter__(self):
+		return self._pages()
+
+	async def _pages(self):
+
+		pending = deque()
+		start = self.start
+
+		def request():
+			nonlocal start
+			pending.append(asyncio.ensure_future(self.fetch(start, self.page_size)))
+			start += self.page_size
+
+		for _ in range(self.prefetch + 1):
+			request()
+
+		try:
+			while pending:
+				page = self._page(await pending.popleft())
+				if page is None:
+					return
+
+				full = len(page) >= self.page_size
+				if full and self.prefetch > 0:
+					request()
+
+				for record in page:
+					yield record
+
+				page = None
+				if not full:
+					return
+				if self.prefetch == 0:
+					request()
+		finally:
+			for future in pending:
+				future.cancel()
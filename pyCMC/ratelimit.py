@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Client side call/credit budgeting so we wait before CMC says no, rather than after.
+"""
+
+import datetime
+import threading
+import time
+
+# CMC error codes for plan limits, as returned in `status.error_code`.
+MINUTE_LIMIT = 1008
+DAILY_LIMIT = 1009
+MONTHLY_LIMIT = 1010
+
+class CreditScheduler(object):
+
+	# plan -> (calls per minute, credits per month)
+	# See: https://coinmarketcap.com/api/pricing/
+	plans = {
+		'basic' : (30, 10_000),
+		'hobbyist' : (30, 40_000),
+		'startup' : (30, 120_000),
+		'standard' : (60, 500_000),
+		'professional' : (90, 2_000_000),
+		'enterprise' : (120, 30_000_000),
+	}
+
+	# Time source of the token bucket.
+	_clock = staticmethod(time.monotonic)
+
+	# Token bucket for the per-minute call cap plus daily and monthly credit budgets.
+	# Budgets reset at UTC midnight and on the first of the UTC month. One scheduler may be
+	# shared by several threads (and clients).
+	#
+	# Inputs
+	# plan              string, one of `plans`. Sets the defaults for the limits below.
+	# blocking          bool, if True `acquire()` sleeps until a call is allowed. If False it
+	#                   returns an error straight away.
+	# calls_per_minute  int, overrides the plan's per-minute call cap.
+	# monthly_credits   int, overrides the plan's monthly credits.
+	# daily_credits     int, defaults to a thirtieth of the monthly credits, like CMC's own
+	#                   daily soft cap.
+	# used_today        int, credits already spent today, e.g. by an earlier process.
+	# used_this_month   int, credits already spent this month.
+	def __init__(
+		self,
+		plan='basic',
+		blocking=True,
+		calls_per_minute=None,
+		monthly_credits=None,
+		daily_credits=None,
+		used_today=0,
+		used_this_month=0
+	):
+
+		if plan not in self.plans:
+			plan = 'basic'
+
+		plan_calls, plan_credits = self.plans[plan]
+
+		self.plan = plan
+		self.blocking = blocking
+		self.calls_per_minute = calls_per_minute or plan_calls
+		self.monthly_credits = monthly_credits or plan_credits
+		self.daily_credits = daily_credits or self.monthly_credits // 30
+
+		self.tokens = float(self.calls_per_minute)
+		self.refilled = self._clock()
+
+		self.used_today = used_today
+		self.used_this_month = used_this_month
+		self.day, self.month = self._period()
+		self._lock = threading.RLock()
+
+	# Context in which the budget state is read and updated. Reentrant.
+	def _state(self):
+		return self._lock
+
+	def _period(self):
+		today = datetime.datetime.now(datetime.timezone.utc).date()
+		return today, (today.year, today.month)
+
+	def _rollover(self):
+		day, month = self._period()
+		if day != self.day:
+			self.day = day
+			self.used_today = 0
+		if month != self.month:
+			self.month = month
+			self.used_this_month = 0
+
+	def _refill(self):
+		now = self._clock()
+		rate = self.calls_per_minute / 60.0
+		self.tokens = min(float(self.calls_per_minute), self.tokens + (now - self.refilled) * rate)
+		self.refilled = now
+
+	# Seconds until the bucket holds a whole token again.
+	def delay(self):
+		with self._state():
+			self._refill()
+			return max(0.0, (1 - self.tokens) * 60.0 / self.calls_per_minute)
+
+	# Takes one call from the bucket. Returns `None` if the call may go ahead, otherwise an
+	# `(error_code, error_message)` tuple:
+	#
+	# 104: Per-minute call cap reached (non-blocking mode only).
+	# 105: Daily or monthly credit budget used up.
+	#
+	# `blocking` overrides the instance setting for this call.
+	def acquire(self, blocking=None):
+
+		if blocking is None:
+			blocking = self.blocking
+
+		while True:
+			with self._state():
+				self._rollover()
+
+				if self.used_today >= self.daily_credits:
+					return (105, 'Daily credit budget of {} used up.'.format(self.daily_credits))
+				if self.used_this_month >= self.monthly_credits:
+					return (105, 'Monthly credit budget of {} used up.'.format(self.monthly_credits))
+
+				self._refill()
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return None
+
+				wait = self.delay()
+
+			if not blocking:
+				return (104, 'Per-minute call limit reached, retry in {:.1f}s.'.format(wait))
+
+			time.sleep(wait)
+
+	# Updates budgets from the `status` block of an API response. Uses the credits CMC
+	# reports in `credit_count`, and syncs with the server if it reports a plan limit.
+	def record(self, status):
+
+		if not isinstance(status, dict):
+			return
+
+		with self._state():
+			self._rollover()
+
+			credits = status.get('credit_count') or 0
+			self.used_today += credits
+			self.used_this_month += credits
+
+			code = status.get('error_code')
+			if code == MINUTE_LIMIT:
+				self._refill()
+				self.tokens = min(self.tokens, 0.0)
+			elif code == DAILY_LIMIT:
+				self.used_today = max(self.used_today, self.daily_credits)
+			elif code == MONTHLY_LIMIT:
+				self.used_this_month = max(self.used_this_month, self.monthly_credits)
+
+	def remaining(self):
+		with self._state():
+			self._rollover()
+			self._refill()
+			return {
+				'calls_this_minute' : int(self.tokens),
+				'daily_credits' : max(0, self.daily_credits - self.used_today),
+				'monthly_credits' : max(0, self.monthly_credits - self.used_this_month),
+			}
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Compact typed records (`__slots__` objects) for listing, quote, market pair, OHLCV, metadata
+and global metric responses.
+"""
+
+import sys
+
+# Strings repeat a lot across records (timestamps, tags, symbols of quote currencies), so
+# they are interned and each distinct value is held once.
+def _intern(value):
+	return sys.intern(value) if type(value) is str else value
+
+# Fields of each record type, as a set, to tell the fields the API added since.
+_KNOWN = {}
+
+def _extra(values, known):
+	extra = {k : v for k, v in values.items() if k not in known}
+	return extra or None
+
+class Record(object):
+
+	# Base of every record type. Each field of the API record named in `__slots__` becomes an
+	# attribute (`None` if the API left it out), so records have no per-instance dict and
+	# fields are read without a dict lookup. Fields not in `__slots__` (e.g. ones the API
+	# added later) are kept as they are in `_extra`, and read as attributes too, only
+	# slower.
+	__slots__ = ('_extra',)
+
+	def __init__(self, record):
+		get = record.get
+		for name in self.__slots__:
+			if name[0] != '_':
+				setattr(self, name, _intern(get(name)))
+		self._extra = _extra(record, self._known())
+
+	@classmethod
+	def _fields(cls):
+		return [name for klass in reversed(cls.__mro__) for name in getattr(klass, '__slots__', ()) if name[0] != '_']
+
+	@classmethod
+	def _known(cls):
+		known = _KNOWN.get(cls)
+		if known is None:
+			known = _KNOWN[cls] = frozenset(cls._fields())
+		return known
+
+	def __getattr__(self, name):
+		if name[0] != '_':
+			extra = self._extra
+			if extra is not None and name in extra:
+				return extra[name]
+		raise AttributeError('{!r} object has no attribute {!r}'.format(type(self).__name__, name))
+
+	# Back to a plain dict, with nested records converted too.
+	def to_dict(self):
+		out = {}
+		for name in self._fields():
+			value = getattr(self, name)
+			if isinstance(value, Record):
+				value = value.to_dict()
+			elif isinstance(value, dict):
+				value = {k : v.to_dict() if isinstance(v, Record) else v for k, v in value.items()}
+			out[name] = value
+		if self._extra is not None:
+			out.update(self._extra)
+		return out
+
+	def __eq__(self, other):
+		return (
+			type(self) is type(other) and self._extra == other._extra
+			and all(getattr(self, n) == getattr(other, n) for n in self._fields())
+		)
+
+	def __repr__(self):
+		shown = [n for n in ('id', 'symbol', 'market_pair', 'time_open', 'price') if n in self._fields()]
+		return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(n, getattr(self, n)) for n in shown))
+
+class Quote(Record):
+
+	# One `quote[currency]` block of a listing, a quote or a market pair.
+	__slots__ = (
+		'price', 'volume_24h', 'volume_change_24h', 'volume_24h_base', 'volume_24h_quote',
+		'percent_change_1h', 'percent_change_24h', 'percent_change_7d', 'percent_change_30d',
+		'market_cap', 'market_cap_dominance', 'fully_diluted_market_cap', 'last_updated',
+	)
+
+class OHLCVQuote(Record):
+
+	__slots__ = ('open', 'high', 'low', 'close', 'volume', 'market_cap', 'timestamp')
+
+class GlobalQuote(Record):
+
+	__slots__ = (
+		'total_market_cap', 'total_volume_24h', 'total_volume_24h_reported',
+		'altcoin_volume_24h', 'altcoin_market_cap', 'defi_volume_24h', 'defi_market_cap',
+		'stablecoin_volume_24h', 'stablecoin_market_cap', 'last_updated',
+	)
+
+class _Quoted(Record):
+
+	# A record with a `quote` dict of currency -> `quote_type`. Until `quote` is first read,
+	# each currency's values are kept as one plain tuple (and a dict of any unknown fields),
+	# and the quote records are only built then.
+	__slots__ = ('_quote',)
+	quote_type = Quote
+
+	def __init__(self, record):
+		Record.__init__(self, record)
+		fields = self.quote_type.__slots__
+		known = self.quote_type._known()
+		self._quote = tuple(
+			(_intern(currency), tuple(_intern(values.get(name)) for name in fields), _extra(values, known))
+			for currency, values in (record.get('quote') or {}).items()
+		)
+
+	@property
+	def quote(self):
+		if isinstance(self._quote, tuple):
+			quote_type = self.quote_type
+			fields = quote_type.__slots__
+			quotes = {}
+			for currency, values, extra in self._quote:
+				q = quote_type.__new__(quote_type)
+				for name, value in zip(fields, values):
+					setattr(q, name, value)
+				q._extra = extra
+				quotes[currency] = q
+			self._quote = quotes
+		return self._quote
+
+	@classmethod
+	def _fields(cls):
+		return Record._fields.__func__(cls) + ['quote']
+
+class Listing(_Quoted):
+
+	# A coin from `listings()` or `quotes()`.
+	__slots__ = (
+		'id', 'name', 'symbol', 'slug', 'cmc_rank', 'num_market_pairs', 'circulating_supply',
+		'total_supply', 'max_supply', 'is_active', 'date_added', 'last_updated', 'tags', 'platform',
+	)
+
+class MarketPair(_Quoted):
+
+	# One market pair from `market_pairs()`. The exchange and the base and quote currencies
+	# are flattened into `exchange_*`, `base_*` and `quote_currency_*` fields. The other
+	# fields of the pair (`market_id`, `category`, `fee_type`, ...) are kept in `_extra`.
+	__slots__ = (
+		'exchange_id', 'exchange_name', 'exchange_slug', 'market_pair',
+		'base_id', 'base_symbol', 'quote_currency_id', 'quote_symbol',
+	)
+
+	_flattened = ('exchange', 'market_pair_base', 'market_pair_quote')
+
+	def __init__(self, record):
+		exchange = record.get('exchange') or {}
+		base = record.get('market_pair_base') or {}
+		quote = record.get('market_pair_quote') or {}
+		flat = {k : v for k, v in record.items() if k not in self._flattened}
+		flat.update({
+			'exchange_id' : exchange.get('id'),
+			'exchange_name' : exchange.get('name'),
+			'exchange_slug' : exchange.get('slug'),
+			'base_id' : base.get('currency_id'),
+			'base_symbol' : base.get('currency_symbol'),
+			'quote_currency_id' : quote.get('currency_id'),
+			'quote_symbol' : quote.get('currency_symbol'),
+		})
+		_Quoted.__init__(self, flat)
+
+class OHLCVBar(_Quoted):
+
+	# One period from `ohlcv_historical()` or `ohlcv_latest()`.
+	__slots__ = ('time_open', 'time_close', 'time_high', 'time_low', 'last_updated')
+	quote_type = OHLCVQuote
+
+class CoinInfo(Record):
+
+	# A coin from `metadata()`.
+	__slots__ = (
+		'id', 'name', 'symbol', 'slug', 'category', 'description', 'logo', 'subreddit',
+		'notice', 'tags', 'platform', 'date_added', 'urls',
+	)
+
+class GlobalMetrics(_Quoted):
+
+	# The `data` of `global_metrics()`.
+	__slots__ = (
+		'active_cryptocurrencies', 'total_cryptocurrencies', 'active_market_pairs',
+		'active_exchanges', 'total_exchanges', 'eth_dominance', 'btc_dominance', 'last_updated',
+	)
+	quote_type = GlobalQuote
+
+def _wrap(response, data):
+	return {'status' : response['status'], 'data' : data}
+
+# Response transforms, one per endpoint shape.
+
+def listings(response):
+	return _wrap(response, [Listing(r) for r in response['data']])
+
+def quotes(response):
+	return _wrap(response, {k : Listing(r) for k, r in response['data'].items()})
+
+def metadata(response):
+	return _wrap(response, {k : CoinInfo(r) for k, r in response['data'].items()})
+
+# The coin's own fields are kept as a dict, with `market_pairs` a list of `MarketPair`.
+def market_pairs(response):
+	data = dict(response['data'])
+	data['market_pairs'] = [MarketPair(r) for r in data.get('market_pairs', [])]
+	return _wrap(response, data)
+
+def ohlcv_latest(response):
+	return _wrap(response, {k : OHLCVBar(r) for k, r in response['data'].items()})
+
+# As in `columnar`, one coin is returned as is and several are keyed by ID. Each coin is a
+# dict with `quotes` a list of `OHLCVBar`.
+def ohlcv_historical(response):
+
+	def coin(record):
+		record = dict(record)
+		record['quotes'] = [OHLCVBar(r) for r in record.get('quotes', [])]
+		return record
+
+	data = response['data']
+	if 'quotes' in data:
+		return _wrap(response, coin(data))
+	return _wrap(response, {k : coin(r) for k, r in data.items()})
+
+def global_metrics(response):
+	return _wrap(response, GlobalMetrics(response['data']))
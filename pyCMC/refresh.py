@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps a hot set of quotes and global metrics fresh on a background thread.
+"""
+
+import threading
+import time
+
+from .watch import groups
+
+class Refresher(object):
+
+	# Stale-while-revalidate for latest quotes and global metrics. Register what to keep
+	# warm with `add_quotes()` and `add_global_metrics()`, then `start()`. A background
+	# thread re-fetches each entry `lead` seconds before it is `interval` seconds old,
+	# packing coin IDs into as few `quotes/latest` calls as possible. Reads (`quotes()`,
+	# `global_metrics()`) only look at the latest snapshot, so they never wait on the
+	# network, and report its age in seconds as `age` in `status`.
+	#
+	# Inputs
+	# cmc           `CMC`, client to fetch with. Fetches skip its response cache (and refill it).
+	# interval      float, seconds a snapshot is considered fresh.
+	# lead          float, seconds before expiry to re-fetch.
+	# max_stale     float, oldest snapshot a read will return. Past that (e.g. when the API
+	#               has been failing for a while) reads return error 109.
+	# backoff       float, seconds to wait before retrying a failed fetch, doubled on each
+	#               failure in a row ...
+	# max_backoff   float, ... up to this.
+	#
+	#     with Refresher(cmc) as hot:
+	#         hot.add_quotes('1,1027', 'USD')
+	#         ...
+	#         hot.quotes('1', 'USD')
+	def __init__(self, cmc, interval=60, lead=5, max_stale=300, backoff=1, max_backoff=60):
+		self.cmc = cmc
+		self.interval = interval
+		self.lead = lead
+		self.max_stale = max_stale
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+
+		# Status of the last failed fetch, and how many fetches failed in total.
+		self.status = None
+		self.errors = 0
+
+		self._hot = {}
+		self._hot_global = {}
+		self._tasks = []
+		self._quotes = {}
+		self._global = {}
+
+		# (convert, ID) -> Unix time of the last successful fetch that asked for it, whether
+		# or not the response had it, so an ID the API leaves out waits its turn too.
+		self._asked = {}
+		self._lock = threading.Lock()
+		self._wake = threading.Event()
+		self._stop = threading.Event()
+		self._thread = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def start(self):
+		if self._thread is None:
+			self._stop.clear()
+			self._thread = threading.Thread(target=self._run, name='pyCMC-refresher', daemon=True)
+			self._thread.start()
+		return self
+
+	def stop(self):
+		self._stop.set()
+		self._wake.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	# Adds coin IDs (string or list) in `convert` to the hot set.
+	def add_quotes(self, coinId, convert='USD'):
+		if isinstance(coinId, str):
+			coinId = coinId.split(',')
+		with self._lock:
+			self._hot.setdefault(convert, {}).update(dict.fromkeys(str(i).strip() for i in coinId))
+			self._plan()
+		self._wake.set()
+
+	def add_global_metrics(self, convert='USD'):
+		with self._lock:
+			self._hot_global[convert] = True
+			self._plan()
+		self._wake.set()
+
+	# One task per `quotes/latest` call needed for the hot set, plus one per global metrics
+	# currency. Retry state is kept for tasks that survive re-planning.
+	def _plan(self):
+
+		old = {(t['kind'], t['convert'], t['ids']) : t for t in self._tasks}
+		tasks = [('quotes', convert, group) for convert, ids in self._hot.items() for group in groups(list(ids))]
+		tasks += [('global', convert, None) for convert in self._hot_global]
+
+		self._tasks = [
+			old.get(key) or {'kind' : key[0], 'convert' : key[1], 'ids' : key[2], 'failures' : 0, 'retry_at' : 0.0}
+			for key in tasks
+		]
+
+	# Unix time at which `task` should be fetched next. Called with `_lock` held.
+	def _due(self, task):
+
+		if task['kind'] == 'quotes':
+			fetched = min(self._asked.get((task['convert'], i), 0.0) for i in task['ids'].split(','))
+		else:
+			fetched = self._global.get(task['convert'], (None, 0.0))[1]
+
+		return max(fetched + self.interval - self.lead, task['retry_at'])
+
+	# Fetches `task` and stores the snapshot. A failed fetch, including one that raised
+	# (e.g. a body cut off mid-read), is recorded in `status` and retried after a backoff,
+	# so the background thread never dies. `task` and the snapshots are only changed with
+	# `_lock` held, since `refresh()` may run the same task on another thread.
+	def _fetch(self, task):
+
+		cmc = self.cmc
+		if task['kind'] == 'quotes':
+			url = cmc.root_url + 'cryptocurrency/quotes/latest'
+			parameters = cmc._convertparams(task['convert'], None, {'id' : task['ids']})
+		else:
+			url = cmc.root_url + 'global-metrics/quotes/latest'
+			parameters = cmc._convertparams(task['convert'], None, {})
+
+		try:
+			response = cmc._request(url, parameters)
+			status = response.get('status') or {}
+			data = response.get('data')
+		except Exception as e:
+			status = {'error_code' : 100, 'error_message' : e}
+
+		now = time.time()
+		with self._lock:
+			if status.get('error_code') != 0:
+				task['failures'] += 1
+				task['retry_at'] = now + min(self.max_backoff, self.backoff * 2 ** (task['failures'] - 1))
+				self.status = status
+				self.errors += 1
+				return
+
+			task['failures'] = 0
+			task['retry_at'] = 0.0
+			if task['kind'] == 'quotes':
+				for key in task['ids'].split(','):
+					self._asked[(task['convert'], key)] = now
+				for key, record in data.items():
+					self._quotes[(task['convert'], key)] = (record, now)
+			else:
+				self._global[task['convert']] = (data, now)
+
+	# Fetches everything in the hot set once, now, on the calling thread. Useful to warm
+	# up before serving reads.
+	def refresh(self):
+		with self._lock:
+			tasks = list(self._tasks)
+		for task in tasks:
+			self._fetch(task)
+
+	def _run(self):
+
+		while not self._stop.is_set():
+			now = time.time()
+			with self._lock:
+				due = [(self._due(task), task) for task in self._tasks]
+			ready = [task for when, task in due if when <= now]
+
+			for task in ready:
+				if self._stop.is_set():
+					return
+				self._fetch(task)
+			if ready:
+				continue
+
+			wait = min(when for when, _ in due) - now if due else None
+			self._wake.wait(wait)
+			self._wake.clear()
+
+	def _stale(self, what):
+		return self.cmc._error(109, 'No snapshot of {} younger than {}s.'.format(what, self.max_stale))
+
+	# Latest snapshot of the quotes of `coinId` (string or list) in `convert`, shaped like
+	# `quotes()`. `age` in `status` is the age of the oldest quote returned. Never blocks.
+	def quotes(self, coinId, convert='USD'):
+
+		if isinstance(coinId, str):
+			coinId = coinId.split(',')
+
+		now = time.time()
+		data = {}
+		age = 0.0
+		for key in coinId:
+			key = str(key).strip()
+			entry = self._quotes.get((convert, key))
+			if entry is None or now - entry[1] > self.max_stale:
+				return self._stale('coin {} in {}'.format(key, convert))
+			data[key] = entry[0]
+			age = max(age, now - entry[1])
+
+		return {
+			'status' : {'error_code' : 0, 'error_message' : None, 'credit_count' : 0, 'age' : age},
+			'data' : data,
+		}
+
+	# Latest snapshot of `global_metrics()` in `convert`. Never blocks.
+	def global_metrics(self, convert='USD'):
+
+		entry = self._global.get(convert)
+		now = time.time()
+		if entry is None or now - entry[1] > self.max_stale:
+			return self._stale('global metrics in {}'.format(convert))
+
+		return {
+			'status' : {'error_code' : 0, 'error_message' : None, 'credit_count' : 0, 'age' : now - entry[1]},
+			'data' : entry[0],
+		}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Local symbol/slug -> CMC ID lookup built from `map()`.
+"""
+
+import json
+import os
+import time
+
+from .paging import PageIterator
+
+# Fields kept from each `map()` record, in file column order.
+COLUMNS = ('id', 'symbol', 'slug', 'name', 'rank', 'is_active', 'first_historical_data', 'last_updated')
+
+class Resolver(object):
+
+	# Indexes of every coin in `map()`, so symbols and slugs can be turned into IDs without
+	# an API call.
+	#
+	# Inputs
+	# cmc       `CMC`, client used to fetch `map()` pages. Pages are requested straight from
+	#           the API, never from the client's response cache.
+	# path      string, optional file to persist the indexes to. Loaded on construction if
+	#           it exists.
+	# max_age   float, seconds after the last build or refresh that a loaded index is
+	#           refreshed on construction (`status` then holds the outcome). `None` never
+	#           refreshes it.
+	#
+	# A symbol can belong to several coins (e.g. forks and scam tokens). `ids(symbol=...)`
+	# returns all of them, best first: active coins before inactive ones, then by rank.
+	# `resolve()` uses the best.
+	def __init__(self, cmc, path=None, max_age=86400):
+		self.cmc = cmc
+		self.path = path
+		self.max_age = max_age
+		self.by_id = {}
+		self.by_slug = {}
+		self.by_symbol = {}
+		self.watermark = ''
+		self.counts = {'active' : 0, 'inactive' : 0}
+		self.updated = 0.0
+		self.status = None
+
+		if path and os.path.exists(path):
+			self.load()
+			if self.stale():
+				self.status = self.refresh()
+
+	def __len__(self):
+		return len(self.by_id)
+
+	# Adds `record` to `by_id`, and returns `watermark` moved up to its timestamps.
+	def _add(self, by_id, record, watermark):
+		by_id[record['id']] = {name : record.get(name) for name in COLUMNS}
+		for name in ('first_historical_data', 'last_updated'):
+			if record.get(name) and record[name] > watermark:
+				watermark = record[name]
+		return watermark
+
+	def _rank(self, coin):
+		return (not coin['is_active'], coin['rank'] or float('inf'), coin['id'])
+
+	# True if the index is older than `max_age`.
+	def stale(self):
+		return self.max_age is not None and time.time() - self.updated > self.max_age
+
+	# `map()` sorted by ID, one record at a time, from `start`. Sent with `CMC._request()`,
+	# so an earlier, cached response cannot hide newly listed coins.
+	def _pages(self, status, start=1, prefetch=0):
+
+		cmc = self.cmc
+		url = cmc.root_url + 'cryptocurrency/map'
+
+		def fetch(start, limit):
+			parameters = {'listing_status' : status, 'start' : str(start), 'limit' : str(limit), 'sort' : 'id'}
+			return cmc._request(url, parameters)
+
+		return PageIterator(fetch, lambda data: data, start, 5000, prefetch)
+
+	def _index(self):
+
+		self.by_slug = {}
+		self.by_symbol = {}
+		for coin in self.by_id.values():
+			self.by_slug[coin['slug'].lower()] = coin['id']
+			self.by_symbol.setdefault(coin['symbol'].upper(), []).append(coin)
+
+		for symbol, coins in self.by_symbol.items():
+			coins.sort(key=self._rank)
+			self.by_symbol[symbol] = [coin['id'] for coin in coins]
+
+	# Rebuilds the indexes from a full sweep of active and inactive coins. The sweep is
+	# built on the side, so if it fails the current indexes are kept as they were.
+	def build(self, prefetch=0):
+
+		by_id = {}
+		watermark = ''
+		counts = {}
+		for status in ('active', 'inactive'):
+			pages = self._pages(status, 1, prefetch)
+			counts[status] = 0
+			for record in pages:
+				watermark = self._add(by_id, record, watermark)
+				counts[status] += 1
+			if pages.status is None or pages.status.get('error_code') != 0:
+				return pages.status
+
+		self.by_id = by_id
+		self.watermark = watermark
+		self.counts = counts
+		self.updated = time.time()
+		self._index()
+		self.save()
+		return pages.status
+
+	# Fetches only coins added since the last build or refresh. New coins get higher IDs,
+	# so this reads `map()` sorted by ID from where the previous sweep ended, keeping
+	# records newer than the watermark. Status changes of known coins are only picked up
+	# by `build()`.
+	def refresh(self, overlap=100):
+
+		if not self.by_id:
+			return self.build()
+
+		status = None
+		watermark = self.watermark
+		for listing in ('active', 'inactive'):
+			start = max(1, self.counts[listing] - overlap)
+			pages = self._pages(listing, start)
+			count = start - 1
+			for record in pages:
+				count += 1
+				newer = any((record.get(name) or '') > watermark for name in ('first_historical_data', 'last_updated'))
+				if record['id'] not in self.by_id or newer:
+					self.watermark = self._add(self.by_id, record, self.watermark)
+			status = pages.status
+			if status is None or status.get('error_code') != 0:
+				return status
+			self.counts[listing] = count
+
+		self.updated = time.time()
+		self._index()
+		self.save()
+		return status
+
+	def save(self):
+
+		if not self.path:
+			return
+
+		contents = {
+			'columns' : COLUMNS,
+			'watermark' : self.watermark,
+			'updated' : self.updated,
+			'counts' : self.counts,
+			'rows' : [[coin[name] for name in COLUMNS] for coin in self.by_id.values()],
+		}
+
+		tmp = self.path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(contents, f, separators=(',', ':'))
+		os.replace(tmp, self.path)
+
+	def load(self):
+
+		with open(self.path, 'r') as f:
+			contents = json.load(f)
+
+		columns = contents['columns']
+		self.by_id = {row[0] : dict(zip(columns, row)) for row in contents['rows']}
+		self.watermark = contents['watermark']
+		self.updated = contents.get('updated', 0.0)
+		self.counts = contents['counts']
+		self._index()
+
+	# All IDs for a symbol or slug, best first. Empty if unknown.
+	def ids(self, slug=None, symbol=None):
+
+		if slug:
+			coinId = self.by_slug.get(slug.lower())
+			return [coinId] if coinId is not None else []
+		if symbol:
+			return list(self.by_symbol.get(symbol.upper(), []))
+		return []
+
+	# Turns a comma separated list of slugs or symbols into a comma separated list of IDs,
+	# as accepted by the `coinId` inputs. Returns `None` if any of them is unknown.
+	def resolve(self, slug=None, symbol=None):
+
+		names = slug if slug else symbol
+		if not names:
+			return None
+
+		ids = []
+		for name in names.replace(' ', '').split(','):
+			found = self.ids(slug=name) if slug else self.ids(symbol=name)
+			if not found:
+				return None
+			ids.append(str(found[0]))
+
+		return ','.join(ids)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache and credit ledger shared by every process on a host, in one SQLite file.
+"""
+
+from contextlib import contextmanager
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from .cache import ResponseCache
+from .decoders import get_decoder
+from .ratelimit import CreditScheduler
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, size INTEGER, body BLOB);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires);
+CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, until REAL);
+CREATE TABLE IF NOT EXISTS ledger (
+	name TEXT PRIMARY KEY, tokens REAL, refilled REAL,
+	day TEXT, used_today INTEGER, month TEXT, used_this_month INTEGER
+);
+'''
+
+class _Database(object):
+
+	# One connection per thread and process, since SQLite connections may not cross
+	# either. WAL lets readers carry on while another process writes.
+	def __init__(self, path, timeout=10):
+		self.path = path
+		self.timeout = timeout
+		self._local = threading.local()
+
+	def connection(self):
+
+		db = getattr(self._local, 'db', None)
+		if db is None or self._local.pid != os.getpid():
+			db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			db.execute('PRAGMA journal_mode=WAL')
+			db.execute('PRAGMA synchronous=NORMAL')
+			db.executescript(SCHEMA)
+			self._local.db = db
+			self._local.pid = os.getpid()
+		return db
+
+	# `BEGIN IMMEDIATE` takes the write lock up front, so a read-modify-write inside is
+	# atomic across processes.
+	@contextmanager
+	def transaction(self):
+
+		db = self.connection()
+		db.execute('BEGIN IMMEDIATE')
+		try:
+			yield db
+		except BaseException:
+			db.execute('ROLLBACK')
+			raise
+		db.execute('COMMIT')
+
+class SharedCache(ResponseCache):
+
+	# A `ResponseCache` kept in a SQLite file, so every process using the same `path`
+	# reads what any of them fetched. Responses are stored as zlib compressed JSON with
+	# their expiry time. TTLs are as for `ResponseCache`.
+	#
+	# Inputs
+	# path          string, database file. Created if missing.
+	# ttls, default_ttl, max_entries    as for `ResponseCache`. Entries past `max_entries`
+	#               are evicted soonest-to-expire first.
+	# wait          float, on a miss, seconds to wait for another process already fetching the
+	#               same request (see `get()`). 0 disables waiting.
+	# level         int, zlib compression level.
+	# decode        callable, JSON decoder taking bytes (see `pyCMC/decoders.py`).
+	#
+	# `max_bytes` is not supported. `hits` and `misses` count this process only.
+	def __init__(self, path, ttls=None, default_ttl=60, max_entries=4096, wait=1.0, level=1, decode=None):
+		ResponseCache.__init__(self, ttls, default_ttl, max_entries)
+		self.path = path
+		self.wait = wait
+		self.level = level
+		self.decode = decode or get_decoder()
+		self._db = _Database(path)
+		self._db.connection()
+
+		# key -> [callers in this process that missed on it, whether this process holds
+		# the lease in the database].
+		self._held = {}
+
+	def __len__(self):
+		return self._db.connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+	def _key(self, endpoint, parameters):
+		return json.dumps(self.key(endpoint, parameters), separators=(',', ':'))
+
+	def _read(self, key):
+		row = self._db.connection().execute(
+			'SELECT body FROM responses WHERE key = ? AND expires > ?', (key, time.time())
+		).fetchone()
+		return None if row is None else self.decode(zlib.decompress(row[0]))
+
+	# Returns the cached data or `None` if there is no fresh entry. On a miss the caller
+	# takes a lease on the request, and is expected to fetch it and then call `release()`:
+	# callers in other processes that miss while the lease is held wait up to `wait`
+	# seconds for the response to be stored, instead of fetching it too. Callers in this
+	# process share the lease and return at once (`Singleflight` merges their requests).
+	def get(self, endpoint, parameters):
+
+		key = self._key(endpoint, parameters)
+		data = self._read(key)
+
+		if data is None and self.ttl(endpoint) > 0 and self.wait > 0:
+			now = time.time()
+			with self._lock:
+				held = self._held.get(key)
+				if held is not None:
+					held[0] += 1
+					leased = False
+				else:
+					with self._db.transaction() as db:
+						db.execute('DELETE FROM leases WHERE key = ? AND until <= ?', (key, now))
+						leased = db.execute(
+							'INSERT OR IGNORE INTO leases VALUES (?, ?)', (key, now + self.wait)
+						).rowcount == 0
+					if not leased:
+						self._held[key] = [1, True]
+
+			deadline = now + self.wait
+			while leased and data is None and time.time() < deadline:
+				time.sleep(0.01)
+				data = self._read(key)
+				if data is None:
+					leased = self._db.connection().execute(
+						'SELECT 1 FROM leases WHERE key = ?', (key,)
+					).fetchone() is not None
+
+		if data is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return data
+
+	def set(self, endpoint, parameters, data, size=0):
+
+		ttl = self.ttl(endpoint)
+		if ttl <= 0:
+			return
+
+		key = self._key(endpoint, parameters)
+		body = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), self.level)
+		now = time.time()
+
+		with self._db.transaction() as db:
+			db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', (key, now + ttl, len(body), body))
+			db.execute('DELETE FROM leases WHERE key = ?', (key,))
+			db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+			held = self._held.get(key)
+			if held is not None:
+				held[1] = False
+			excess = db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+			if excess > 0:
+				db.execute(
+					'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires LIMIT ?)', (excess,)
+				)
+				self.evictions += excess
+
+	# Gives up the lease taken by a `get()` miss once the last caller in this process that
+	# shares it is done, whether or not a response was stored.
+	def release(self, endpoint, parameters):
+
+		key = self._key(endpoint, parameters)
+		with self._lock:
+			held = self._held.get(key)
+			if held is None:
+				return
+			held[0] -= 1
+			if held[0] > 0:
+				return
+			del self._held[key]
+
+		if held[1]:
+			self._db.connection().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+	def clear(self):
+		with self._db.transaction() as db:
+			db.execute('DELETE FROM responses')
+			db.execute('DELETE FROM leases')
+
+	def stats(self):
+		entries, size = self._db.connection().execute(
+			'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE expires > ?', (time.time(),)
+		).fetchone()
+		return {
+			'hits' : self.hits,
+			'misses' : self.misses,
+			'evictions' : self.evictions,
+			'entries' : entries,
+			'bytes' : size,
+		}
+
+class SharedScheduler(CreditScheduler):
+
+	# A `CreditScheduler` whose token bucket and credit counters live in a SQLite file,
+	# so every process using the same `path` and `name` draws from one budget. Each
+	# update is one transaction, so two processes can never both take the last token.
+	#
+	# Inputs
+	# plan          string, as for `CreditScheduler`.
+	# path          string, database file. Created if missing. May be the `SharedCache` file.
+	# name          string, ledger to use within the file, defaults to the plan name. Use one
+	#               ledger per API key.
+	#
+	# Other inputs are as for `CreditScheduler`. Limits are not stored, so every process
+	# should use the same ones. `used_today` and `used_this_month` only seed a new ledger.
+	def __init__(self, plan='basic', path='pycmc.db', name=None, **kwargs):
+		CreditScheduler.__init__(self, plan, **kwargs)
+		self.path = path
+		self.name = name or self.plan
+		self._db = _Database(path)
+		self._depth = 0
+
+		with self._db.transaction() as db:
+			db.execute(
+				'INSERT OR IGNORE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?)',
+				(self.name, self.tokens, self.refilled, self.day.isoformat(), self.used_today,
+				'{}-{:02d}'.format(*self.month), self.used_this_month),
+			)
+
+	# Wall clock, since the bucket is shared between processes.
+	_clock = staticmethod(time.time)
+
+	# Loads the ledger into the instance, and writes it back when the outermost block ends.
+	@contextmanager
+	def _state(self):
+
+		with self._lock:
+			if self._depth:
+				self._depth += 1
+				try:
+					yield
+				finally:
+					self._depth -= 1
+				return
+
+			with self._db.transaction() as db:
+				row = db.execute(
+					'SELECT tokens, refilled, day, used_today, month, used_this_month FROM ledger WHERE name = ?',
+					(self.name,),
+				).fetchone()
+				self.tokens, self.refilled = row[0], min(row[1], self._clock())
+				self.day = datetime.date.fromisoformat(row[2])
+				self.used_today = row[3]
+				self.month = tuple(int(v) for v in row[4].split('-'))
+				self.used_this_month = row[5]
+
+				self._depth = 1
+				try:
+					yield
+				finally:
+					self._depth = 0
+
+				db.execute(
+					'UPDATE ledger SET tokens = ?, refilled = ?, day = ?, used_today = ?, month = ?, used_this_month = ? WHERE name = ?',
+					(self.tokens, self.refilled, self.day.isoformat(), self.used_today,
+					'{}-{:02d}'.format(*self.month), self.used_this_month, self.name),
+				)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Local append-only store of historical series in memory-mapped files.
+"""
+
+from array import array
+import bisect
+import json
+import mmap
+import os
+import threading
+import time
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from .backfill import Backfill, INTERVAL_SECONDS, parse_time
+
+# Fields of each record, all float64. `timestamp` is Unix seconds. For historical quotes,
+# which have no OHLC, open/high/low/close all hold the price and volume is `volume_24h`.
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume', 'market_cap')
+WIDTH = len(COLUMNS)
+
+class _Timestamps(object):
+
+	# Sequence view of the timestamp column, for `bisect`.
+	def __init__(self, values):
+		self.values = values
+
+	def __len__(self):
+		return len(self.values) // WIDTH
+
+	def __getitem__(self, i):
+		return self.values[i * WIDTH]
+
+class SeriesStore(object):
+
+	# One file of fixed width records per (endpoint, coin, currency, interval), sorted by
+	# timestamp, plus `index.json` recording which time ranges have been fetched. One store
+	# may be shared by several threads.
+	#
+	# Inputs
+	# root      string, directory for the files. Created if missing.
+	#
+	# Reads are zero-copy: `read()` returns a view into the memory map (a NumPy array of
+	# shape (n, 7) if numpy is installed, otherwise a flat float64 `memoryview`).
+	def __init__(self, root):
+		self.root = root
+		os.makedirs(root, exist_ok=True)
+		self._lock = threading.Lock()
+		self._maps = {}
+
+		self.index_path = os.path.join(root, 'index.json')
+		self.index = {}
+		if os.path.exists(self.index_path):
+			with open(self.index_path, 'r') as f:
+				self.index = json.load(f)
+
+	def key(self, coinId, convert, interval, endpoint='ohlcv'):
+		return '{}-{}-{}-{}'.format(endpoint, coinId, convert, interval)
+
+	def _path(self, key):
+		return os.path.join(self.root, key + '.bin')
+
+	def _save_index(self):
+		tmp = self.index_path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.index, f)
+		os.replace(tmp, self.index_path)
+
+	# Flat float64 view of the whole file, or `None` if it is empty.
+	def _values(self, key):
+
+		path = self._path(key)
+		if not os.path.exists(path):
+			return None
+
+		stat = os.stat(path)
+		if stat.st_size == 0:
+			return None
+
+		# Remapped whenever the file grows or is replaced. Old maps stay valid for any views
+		# still held by callers, since files are only appended to or replaced, never truncated.
+		version = (stat.st_ino, stat.st_size)
+		entry = self._maps.get(key)
+		if entry is None or entry[0] != version:
+			with open(path, 'rb') as f:
+				mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			entry = (version, memoryview(mapped).cast('d'))
+			self._maps[key] = entry
+
+		return entry[1]
+
+	# Ranges `[start, end]` (Unix seconds) already fetched for `key`, sorted. Ranges stored
+	# with a third value, a Unix time, only count as fetched until then (see `write()`).
+	def covered(self, key):
+		with self._lock:
+			return self._covered(key, time.time())
+
+	def _covered(self, key, now):
+		return sorted(tuple(r[:2]) for r in self.index.get(key, []) if len(r) < 3 or r[2] > now)
+
+	# Parts of `[start, end]` not yet fetched.
+	def gaps(self, key, start, end):
+
+		missing = []
+		for lo, hi in self.covered(key):
+			if hi < start or lo > end:
+				continue
+			if lo > start:
+				missing.append((start, lo))
+			start = max(start, hi)
+		if start < end:
+			missing.append((start, end))
+		return missing
+
+	# Merges `[start, end]` into the ranges fetched for `key`. Ranges that expire are kept
+	# apart, and dropped once expired.
+	def _cover(self, key, start, end, until=None):
+
+		now = time.time()
+		ranges = self.index.get(key, [])
+		expiring = [r for r in ranges if len(r) == 3 and r[2] > now]
+		if until is not None:
+			expiring.append([start, end, until])
+			start, end = None, None
+
+		ranges = sorted([tuple(r) for r in ranges if len(r) == 2] + ([(start, end)] if start is not None else []))
+		merged = [list(ranges[0])] if ranges else []
+		for lo, hi in ranges[1:]:
+			if lo <= merged[-1][1]:
+				merged[-1][1] = max(merged[-1][1], hi)
+			else:
+				merged.append([lo, hi])
+		self.index[key] = merged + expiring
+
+	# Adds records (sequences of `WIDTH` floats) and marks `[start, end]` as fetched, until
+	# the Unix time `until` if given. Records newer than everything stored are appended;
+	# anything else rewrites the file in timestamp order. A record with a timestamp already
+	# stored replaces it in place (views returned by `read()` see the new values), so a bar
+	# stored while its interval was still open is corrected when it is fetched again.
+	def write(self, key, records, start, end, until=None):
+
+		records = sorted(records, key=lambda r: r[0])
+
+		with self._lock:
+			values = self._values(key)
+			stored = _Timestamps(values) if values is not None else []
+
+			new = []
+			replaced = {}
+			for record in records:
+				i = bisect.bisect_left(stored, record[0])
+				if i < len(stored) and stored[i] == record[0]:
+					replaced[i] = record
+				elif new and new[-1][0] == record[0]:
+					new[-1] = record
+				else:
+					new.append(record)
+
+			if replaced:
+				with open(self._path(key), 'r+b') as f:
+					for i, record in replaced.items():
+						f.seek(i * WIDTH * 8)
+						f.write(array('d', record).tobytes())
+
+			if new:
+				path = self._path(key)
+				if not len(stored) or new[0][0] > stored[len(stored) - 1]:
+					target, mode, rows = path, 'ab', new
+				else:
+					old = [tuple(values[i * WIDTH:(i + 1) * WIDTH]) for i in range(len(stored))]
+					target, mode, rows = path + '.tmp', 'wb', sorted(old + new, key=lambda r: r[0])
+
+				flat = array('d')
+				for row in rows:
+					flat.extend(row)
+				with open(target, mode) as f:
+					f.write(flat.tobytes())
+				if target != path:
+					os.replace(target, path)
+
+			if end > start:
+				self._cover(key, start, end, until)
+			self._save_index()
+
+	# Records with `start <= timestamp <= end`, as a view into the memory map.
+	def read(self, key, start=None, end=None):
+
+		with self._lock:
+			values = self._values(key)
+
+		if values is None:
+			return np.empty((0, WIDTH)) if np is not None else memoryview(array('d'))
+
+		stamps = _Timestamps(values)
+		lo = 0 if start is None else bisect.bisect_left(stamps, start)
+		hi = len(stamps) if end is None else bisect.bisect_right(stamps, end)
+
+		if np is not None:
+			return np.frombuffer(values, dtype=np.float64).reshape(-1, WIDTH)[lo:hi]
+		return values[lo * WIDTH:hi * WIDTH]
+
+	# A point from `historical_quotes()` or `ohlcv_historical()` as a record.
+	def _record(self, point, convert, endpoint):
+
+		quotes = point.get('quote', {})
+		values = quotes.get(convert) or next(iter(quotes.values()), {})
+
+		if endpoint == 'ohlcv':
+			stamp = point.get('time_open') or values.get('timestamp')
+			fields = [values.get(name) for name in COLUMNS[1:]]
+		else:
+			stamp = point.get('timestamp') or values.get('timestamp')
+			price = values.get('price')
+			fields = [price, price, price, price, values.get('volume_24h'), values.get('market_cap')]
+
+		return [parse_time(stamp).timestamp()] + [float('nan') if v is None else float(v) for v in fields]
+
+	# Returns `{'status', 'data'}` with the series for one coin between `time_start` and
+	# `time_end`, fetching only the ranges not stored yet. A warm re-run makes no API calls
+	# unless the range reaches the latest interval, which is still open: once it has a bar,
+	# that interval is never marked as fetched, so it is fetched again (one request) and
+	# its bar replaced. Until it has one, it is marked as fetched until it closes, since
+	# there is nothing to fetch before then.
+	#
+	# Inputs
+	# cmc           `CMC`, client to fetch missing ranges with.
+	# coinId        string, one coin ID.
+	# time_start    string, Unix or ISO 8601 timestamp.
+	# time_end      string, Unix or ISO 8601 timestamp.
+	# interval      string, see `pyCMC/backfill.py`.
+	# endpoint      string, 'ohlcv' or 'quotes'.
+	# convert       string, one currency symbol.
+	# workers       int, windows fetched at once when filling gaps.
+	def query(self, cmc, coinId, time_start, time_end, interval='daily', endpoint='ohlcv', convert='USD', workers=4):
+
+		key = self.key(coinId, convert, interval, endpoint)
+		start = parse_time(time_start).timestamp()
+		end = parse_time(time_end).timestamp()
+
+		# The latest interval is still changing, so it is not marked as fetched for good.
+		# Intervals are aligned to the epoch (UTC midnight for daily bars), so the gap left
+		# starts where the open bar does.
+		seconds = INTERVAL_SECONDS.get(interval, 0)
+		now = time.time()
+		settled = min(end, now - now % seconds if seconds else now)
+
+		status = {'error_code' : 0, 'error_message' : None, 'credit_count' : 0}
+		for lo, hi in self.gaps(key, start, end):
+			points = Backfill(cmc, coinId, str(int(lo)), str(int(hi)), interval, endpoint, workers, convert)
+			records = [self._record(point, convert, endpoint) for _, point in points]
+
+			status = points.status
+			if not status or status.get('error_code') != 0:
+				return {'status' : status, 'data' : self.read(key, start, end)}
+
+			self.write(key, records, lo, min(hi, settled))
+			if seconds and hi > settled and not any(r[0] >= settled for r in records):
+				self.write(key, [], settled, hi, settled + seconds)
+
+		return {'status' : status, 'data' : self.read(key, start, end)}
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental parsing of large responses: records are yielded as soon as they arrive.
+"""
+
+import re
+
+# Characters that matter outside of strings.
+_STRUCTURE = re.compile(rb'[{}\[\],:"]')
+_SPACE = b' \t\r\n'
+
+class _Frame(object):
+
+	# An open object or array. `level` is its position on the path being followed, or
+	# `None` if it is off the path and only needs to be skipped over.
+	def __init__(self, kind, start, level):
+		self.kind = kind
+		self.start = start
+		self.level = level
+		self.colon = None
+
+class StreamedResponse(object):
+
+	# Iterates over the records of a response body while it is still being received.
+	#
+	# Inputs
+	# chunks    iterable of bytes, the response body.
+	# decode    callable, JSON decoder taking bytes (see `pyCMC/decoders.py`).
+	# path      tuple of keys leading to the records, e.g. ('data',) or
+	#           ('data', 'market_pairs').
+	# done      callable, optional, called with `status` once the body is read.
+	#
+	# If the records are in a list, each element is yielded. If they are in an object (as
+	# for `quotes()` and `metadata()`), each `(key, value)` pair is yielded. Everything
+	# else is kept in `fields` (e.g. `fields['status']`, or `fields['data']['symbol']` for
+	# market pairs), and `status` is set once it has been read. Only the record being
+	# parsed is held in memory. A body that is not valid JSON, or that ends before its
+	# top-level object is closed, ends iteration with error 107 in `status`.
+	def __init__(self, chunks, decode, path=('data',), done=None):
+		self.chunks = chunks
+		self.decode = decode
+		self.path = tuple(path)
+		self.done = done
+		self.fields = {}
+		self.status = None
+
+		# Whether the top-level object has been closed.
+		self.complete = False
+
+	def _container(self, level):
+		fields = self.fields
+		for key in self.path[:level]:
+			fields = fields.setdefault(key, {})
+		return fields
+
+	# Called with the bytes of one member or element of `frame`. Yields records.
+	def _flush(self, frame, raw):
+
+		if frame.start is None or not raw.strip(_SPACE):
+			return
+
+		streaming = frame.level == len(self.path) or frame.kind == '['
+
+		if frame.kind == '[':
+			value = self.decode(bytes(raw))
+			if streaming:
+				yield value
+			return
+
+		key, value = next(iter(self.decode(b'{' + bytes(raw) + b'}').items()))
+		if streaming:
+			yield key, value
+			return
+
+		self._container(frame.level)[key] = value
+		if frame.level == 0 and key == 'status':
+			self.status = value
+
+	def __iter__(self):
+
+		try:
+			yield from self._parse()
+		except ValueError:
+			self.status = {'error_code' : 107, 'error_message' : 'Could not decode response.'}
+		else:
+			# A connection error while reading already set its own status.
+			if not self.complete and (self.status is None or self.status.get('error_code') == 0):
+				self.status = {'error_code' : 107, 'error_message' : 'Response ended before it was complete.'}
+
+		if self.done is not None:
+			self.done(self.status)
+
+	def _parse(self):
+
+		buf = bytearray()
+		frames = []
+		pos = 0
+		string = None
+
+		for chunk in self.chunks:
+			buf += chunk
+
+			while True:
+				if string is not None:
+					end = buf.find(b'"', pos)
+					if end < 0:
+						pos = len(buf)
+						break
+					back = end - 1
+					while buf[back] == 0x5c:
+						back -= 1
+					pos = end + 1
+					if (end - 1 - back) % 2 == 0:
+						string = None
+					continue
+
+				match = _STRUCTURE.search(buf, pos)
+				if match is None:
+					pos = len(buf)
+					break
+
+				i = match.start()
+				c = buf[i]
+				pos = i + 1
+				top = frames[-1] if frames else None
+
+				if c == 0x22:
+					string = i
+					if top is not None and top.colon is not None:
+						top.colon = None
+					continue
+
+				if c == 0x7b or c == 0x5b:
+					kind = '{' if c == 0x7b else '['
+					level = None
+					if top is None:
+						level = 0
+					elif top.colon is not None:
+						# A container directly after the next key on the path: descend into it.
+						if not buf[top.colon + 1:i].strip(_SPACE):
+							level = top.level + 1
+							top.start = None
+						top.colon = None
+					frames.append(_Frame(kind, i + 1, level))
+					continue
+
+				if c == 0x7d or c == 0x5d:
+					frames.pop()
+					if top.level is not None:
+						yield from self._flush(top, buf[top.start:i] if top.start is not None else b'')
+					if not frames:
+						self.complete = True
+						break
+					continue
+
+				if top is None or top.level is None:
+					continue
+
+				if c == 0x2c:
+					top.colon = None
+					yield from self._flush(top, buf[top.start:i] if top.start is not None else b'')
+					top.start = i + 1
+				elif c == 0x3a and top.kind == '{' and top.start is not None and top.level < len(self.path):
+					key = self.decode(bytes(buf[top.start:i]))
+					if key == self.path[top.level]:
+						top.colon = i
+
+			# Drop everything before the earliest byte still needed.
+			keep = pos if string is None else string
+			for frame in frames:
+				if frame.level is not None and frame.start is not None:
+					keep = min(keep, frame.start)
+			if keep > 0:
+				del buf[:keep]
+				pos -= keep
+				if string is not None:
+					string -= keep
+				for frame in frames:
+					if frame.start is not None:
+						frame.start -= keep
+					if frame.colon is not None:
+						frame.colon -= keep
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Tail latency controls: adaptive per-endpoint timeouts, hedged requests and a circuit breaker.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+class AdaptiveTimeout(object):
+
+	# Read timeout for each endpoint from the latency the client has seen for it (see
+	# `Metrics`): `multiplier` times its `percentile`-th network time, kept between
+	# `floor` and `ceiling`. Until an endpoint has `min_samples` responses, the
+	# transport's own timeout is used.
+	#
+	# Inputs
+	# percentile    float, 0-100.
+	# multiplier    float, headroom over that percentile.
+	# floor         float, shortest read timeout in seconds.
+	# ceiling       float, longest read timeout in seconds.
+	# connect       float, connect timeout in seconds.
+	# min_samples   int, responses needed before the timeout adapts.
+	def __init__(self, percentile=99, multiplier=3.0, floor=1.0, ceiling=30.0, connect=3.05, min_samples=20):
+		self.percentile = percentile
+		self.multiplier = multiplier
+		self.floor = floor
+		self.ceiling = ceiling
+		self.connect = connect
+		self.min_samples = min_samples
+
+	# `(connect, read)` timeout for `endpoint`, or `None` to use the transport's.
+	def timeout(self, endpoint, metrics):
+
+		if metrics is None or metrics.count(endpoint) < self.min_samples:
+			return None
+
+		read = metrics.percentile(endpoint, self.percentile) * self.multiplier
+		return (self.connect, min(self.ceiling, max(self.floor, read)))
+
+class Hedger(object):
+
+	# Sends a second, identical request if the first has not answered by the endpoint's
+	# `percentile`-th latency, and returns whichever answers first. Every endpoint is a
+	# read-only GET, so sending one twice is safe; streamed responses are never hedged.
+	#
+	# Each hedge is charged like any other call (it needs a token from the client's
+	# `CreditScheduler`, if any, and its credits are recorded when it answers), and hedges
+	# are capped at `budget` per request sent, so they add at most that fraction to spend.
+	#
+	# Inputs
+	# percentile    float, 0-100, latency after which a hedge is sent.
+	# min_delay     float, never hedge sooner than this many seconds.
+	# budget        float, hedges earned per request, e.g. 0.05 for at most one in twenty.
+	# burst         float, most hedges that may be saved up.
+	# min_samples   int, responses needed for an endpoint before it is hedged.
+	# workers       int, threads running requests. Both requests of a hedged pair hold one.
+	#
+	# A request that lost is left to finish on its worker thread (requests cannot abort a
+	# read in progress) and its response discarded; a hedge still queued is cancelled.
+	def __init__(self, percentile=95, min_delay=0.05, budget=0.05, burst=5, min_samples=20, workers=20):
+		self.percentile = percentile
+		self.min_delay = min_delay
+		self.budget = budget
+		self.burst = burst
+		self.min_samples = min_samples
+
+		# Hedges sent, and how many of them answered first.
+		self.sent = 0
+		self.won = 0
+
+		self.tokens = 0.0
+		self._lock = threading.Lock()
+		self._pool = ThreadPoolExecutor(workers, thread_name_prefix='pyCMC-hedge')
+
+	# Seconds to wait before hedging a request to `endpoint`, or `None` to not hedge it.
+	def delay(self, endpoint, metrics):
+
+		if metrics is None or metrics.count(endpoint) < self.min_samples:
+			return None
+		return max(self.min_delay, metrics.percentile(endpoint, self.percentile))
+
+	def _spend(self, allow):
+		with self._lock:
+			if self.tokens < 1 or (allow is not None and not allow()):
+				return False
+			self.tokens -= 1
+			self.sent += 1
+			return True
+
+	# Returns `call()`, hedged after `delay` seconds if the budget and `allow()` permit.
+	# `discard(result)` is called with the result of the request that lost, once it has one.
+	# If the first request to answer raised, the other one's outcome is used.
+	def run(self, call, delay, allow=None, discard=None):
+
+		with self._lock:
+			self.tokens = min(self.burst, self.tokens + self.budget)
+
+		if delay is None:
+			return call()
+
+		first = self._pool.submit(call)
+		if wait([first], delay).done or not self._spend(allow):
+			return first.result()
+
+		second = self._pool.submit(call)
+		done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+		winner = first if first in done else second
+		loser = second if winner is first else first
+
+		if winner.exception() is not None:
+			winner, loser = loser, winner
+			winner.exception()
+		elif not loser.cancel() and discard is not None:
+			loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+		if winner is second:
+			with self._lock:
+				self.won += 1
+
+		return winner.result()
+
+	def stats(self):
+		return {'sent' : self.sent, 'won' : self.won, 'tokens' : self.tokens}
+
+	def close(self):
+		self._pool.shutdown(wait=False)
+
+class CircuitBreaker(object):
+
+	# Fails calls fast while the upstream is degraded. Once at least `min_calls` of the last
+	# `window` requests have finished and `threshold` of them failed (connection errors,
+	# timeouts and HTTP 5xx; rate limits do not count), the circuit opens and calls are
+	# refused with error 110 for `cooldown` seconds. Then one trial request is let through:
+	# if it succeeds the circuit closes, otherwise it stays open for another `cooldown`.
+	#
+	# Each request gets a ticket from `allow()` and hands it back to `record()`. Tickets
+	# belong to a generation, which moves on whenever the circuit opens, closes or lets a
+	# trial through, so requests that were still out when that happened are ignored: only
+	# the trial itself can close the circuit.
+	#
+	# Inputs
+	# window        int, number of recent outcomes kept.
+	# threshold     float, 0-1, failure ratio that opens the circuit.
+	# min_calls     int, fewest outcomes before the circuit may open.
+	# cooldown      float, seconds between trial requests while open.
+	def __init__(self, window=20, threshold=0.5, min_calls=10, cooldown=30):
+		self.window = window
+		self.threshold = threshold
+		self.min_calls = min_calls
+		self.cooldown = cooldown
+
+		# 'closed', 'open', or 'half-open' while a trial request is out.
+		self.state = 'closed'
+		self.trips = 0
+
+		self.opened = 0.0
+		self.generation = 0
+		self._outcomes = deque(maxlen=window)
+		self._lock = threading.Lock()
+
+	def _open(self):
+		self.state = 'open'
+		self.opened = time.monotonic()
+		self.generation += 1
+
+	# `(ticket, None)` if a request may be sent, otherwise `(None, (error_code,
+	# error_message))`.
+	def allow(self):
+
+		with self._lock:
+			if self.state == 'closed':
+				return self.generation, None
+
+			# A trial whose outcome was never recorded (e.g. refused by the scheduler
+			# after this) does not block the next one.
+			wait = self.opened + self.cooldown - time.monotonic()
+			if wait <= 0:
+				self.state = 'half-open'
+				self.opened = time.monotonic()
+				self.generation += 1
+				return self.generation, None
+
+			return None, (110, 'Upstream degraded, circuit open for another {:.0f}s.'.format(wait))
+
+	# Records the outcome of a request let through by `allow()` with `ticket`. Outcomes of
+	# requests from an earlier generation are dropped.
+	def record(self, ticket, ok):
+
+		with self._lock:
+			if ticket != self.generation or self.state == 'open':
+				return
+
+			if self.state == 'half-open':
+				if ok:
+					self.state = 'closed'
+					self.generation += 1
+					self._outcomes.clear()
+				else:
+					self._open()
+				return
+
+			self._outcomes.append(ok)
+			failures = self._outcomes.count(False)
+			if len(self._outcomes) >= self.min_calls and failures >= self.threshold * len(self._outcomes):
+				self._open()
+				self.trips += 1
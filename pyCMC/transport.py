@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP transport shared by every call a `CMC` instance makes.
+"""
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+import random
+import time
+
+class Transport(object):
+
+	# Responses with these status codes are worth another attempt: 429 means we were
+	# rate limited, the rest mean the upstream is having trouble.
+	retry_status = (429, 500, 502, 503, 504)
+
+	# Keeps one `Session` (and therefore one pool of keep-alive connections) for the life
+	# of the client instead of paying a TCP and TLS handshake on every call.
+	#
+	# Inputs
+	# headers       dict, headers sent with every request.
+	# pool_size     int, number of connections kept alive per host.
+	# timeout       float or (connect, read) tuple, seconds before giving up on a request.
+	# retries       int, how many times to retry a failed request. 0 disables retries.
+	# backoff       float, base delay in seconds. The n-th retry waits a random time between
+	#               0 and `backoff * 2**n` (full jitter), capped at `max_backoff`.
+	# max_backoff   float, upper bound in seconds for a single wait.
+	def __init__(self, headers, pool_size=10, timeout=(3.05, 30), retries=3, backoff=0.5, max_backoff=30):
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+
+		self.session = Session()
+		self.session.headers.update(headers)
+
+		# `max_retries=0`, the retry loop below owns retries so it can honour `Retry-After`.
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+
+	# Seconds to wait before retry number `attempt` (starting at 0). The `Retry-After` header
+	# of the failed response, if any, takes precedence over the computed backoff.
+	def _delay(self, attempt, retry_after=None):
+
+		if retry_after:
+			try:
+				return min(float(retry_after), self.max_backoff)
+			except ValueError:
+				pass
+
+		return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+	# GET `url` with retries. Returns the last response received, even if its status is
+	# an error, so callers can read CMC's own error body. Connection errors and timeouts
+	# are raised once the retries are used up. With `stream`, the body is left unread
+	# for the caller to consume with `iter_content()`. The number of retries made is set
+	# as `retries` on the response. `headers` are sent on top of the session's, and
+	# `retry_status` and `timeout` override the defaults for this call.
+	def get(self, url, parameters=None, stream=False, headers=None, retry_status=None, timeout=None):
+
+		if retry_status is None:
+			retry_status = self.retry_status
+		if timeout is None:
+			timeout = self.timeout
+
+		attempt = 0
+		while True:
+			response = None
+			try:
+				response = self.session.get(url, params=parameters, headers=headers, timeout=timeout, stream=stream)
+			except (ConnectionError, Timeout):
+				if attempt >= self.retries:
+					raise
+			else:
+				if response.status_code not in retry_status or attempt >= self.retries:
+					response.retries = attempt
+					return response
+
+			retry_after = None
+			if response is not None:
+				retry_after = response.headers.get('Retry-After')
+				response.close()
+			time.sleep(self._delay(attempt, retry_after))
+			attempt += 1
+
+	def close(self):
+		self.session.close()
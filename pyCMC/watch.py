@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Polls `quotes()` for a set of coins and yields only what changed.
+"""
+
+import threading
+import time
+
+from .backfill import parse_time
+
+# Quote fields compared between polls.
+FIELDS = ('price', 'volume_24h', 'market_cap')
+
+# Splits coin IDs into comma separated lists of at most `max_length` characters, so every
+# ID is requested in as few calls as the URL length allows.
+def groups(ids, max_length=1800):
+
+	out = []
+	length = 0
+	for i in ids:
+		if not out or length + len(i) + 1 > max_length:
+			out.append([])
+			length = 0
+		out[-1].append(i)
+		length += len(i) + 1
+	return [','.join(group) for group in out]
+
+class QuoteWatcher(object):
+
+	# Iterates over per-coin deltas, polling `quotes()` every `period` seconds. Each delta
+	# is a dict with the coin's `id`, `symbol` and `last_updated`, and in `quote` only the
+	# currencies and fields whose values changed since the previous poll, e.g.
+	#
+	#     {'id' : '1', 'symbol' : 'BTC', 'last_updated' : '...', 'quote' : {'USD' : {'price' : 64012.5}}}
+	#
+	# Polls are scheduled on a fixed grid starting `lag` seconds after the newest
+	# `last_updated` seen, so they land just after CMC refreshes its quotes and do not drift
+	# however long each poll takes.
+	#
+	# Inputs
+	# cmc           `CMC`, client to poll with.
+	# coinId        string or list, coin ID(s).
+	# convert       string, symbol(s) of currency to quote in.
+	# convert_id    string, ID(s) of currency to quote in.
+	# period        float, seconds between polls. CMC refreshes latest quotes every 60.
+	# fields        tuple, quote fields to compare.
+	# lag           float, seconds to wait after `last_updated` before polling.
+	# polls         int, optional, stop after this many polls.
+	# initial       bool, yield every coin's current values on the first poll.
+	# max_length    int, most characters in one call's `id` parameter.
+	#
+	# A failed call does not end iteration: its coins are skipped for that poll and
+	# `status` holds the error. `status` otherwise holds the status of the last call.
+	# Call `stop()` (e.g. from another thread) to end iteration.
+	def __init__(
+		self,
+		cmc,
+		coinId,
+		convert=None,
+		convert_id=None,
+		period=60,
+		fields=FIELDS,
+		lag=2,
+		polls=None,
+		initial=True,
+		max_length=1800
+	):
+		if isinstance(coinId, str):
+			coinId = coinId.split(',')
+		ids = list(dict.fromkeys(str(i).strip() for i in coinId))
+
+		self.cmc = cmc
+		self.groups = groups(ids, max_length)
+		self.convert = convert
+		self.convert_id = convert_id
+		self.period = period
+		self.fields = fields
+		self.lag = lag
+		self.polls = polls
+		self.initial = initial
+
+		self.status = None
+		self.updated = None
+		self._values = {}
+		self._stop = threading.Event()
+
+	def stop(self):
+		self._stop.set()
+
+	# Unix time of the next poll after `now`.
+	def _next(self, now):
+
+		if self.updated is None:
+			return now + self.period
+
+		due = self.updated + self.lag
+		if due <= now:
+			due += ((now - due) // self.period + 1) * self.period
+		return due
+
+	# Polls once and returns the list of deltas.
+	def poll(self):
+
+		deltas = []
+		for group in self.groups:
+			response = self.cmc.quotes(coinId=group, convert=self.convert, convert_id=self.convert_id)
+			self.status = response.get('status')
+			if not self.status or self.status.get('error_code') != 0:
+				continue
+
+			for key, coin in response['data'].items():
+				delta = self._diff(key, coin)
+				if delta is not None:
+					deltas.append(delta)
+
+		return deltas
+
+	def _diff(self, key, coin):
+
+		values = self._values.get(key)
+		first = values is None
+		if first:
+			values = self._values[key] = {}
+
+		changes = {}
+		for currency, quote in (coin.get('quote') or {}).items():
+			stamp = quote.get('last_updated')
+			if stamp:
+				stamp = parse_time(stamp).timestamp()
+				if self.updated is None or stamp > self.updated:
+					self.updated = stamp
+
+			for field in self.fields:
+				value = quote.get(field)
+				if values.get((currency, field)) == value:
+					continue
+				values[(currency, field)] = value
+				if not first or self.initial:
+					changes.setdefault(currency, {})[field] = value
+
+		if not changes:
+			return None
+
+		return {
+			'id' : key,
+			'symbol' : coin.get('symbol'),
+			'last_updated' : coin.get('last_updated'),
+			'quote' : changes,
+		}
+
+	def __iter__(self):
+
+		done = 0
+		while not self._stop.is_set():
+			for delta in self.poll():
+				yield delta
+
+			done += 1
+			if self.polls is not None and done >= self.polls:
+				return
+
+			self._stop.wait(max(0, self._next(time.time()) - time.time()))
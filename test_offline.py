@@ -0,0 +1,1526 @@
+#%% Offline tests, run with `python -m pytest test_offline.py`. Every call goes to a local
+# `pyCMC.mock.MockServer` (or to a closed port), never to the real API.
+from concurrent.futures import ThreadPoolExecutor
+import os
+import socket
+import time
+
+import pytest
+
+from pyCMC import CMC, Coalescer, CreditScheduler, Refresher, SharedCache, records
+from pyCMC.decoders import get_decoder
+from pyCMC.mock import MockServer, Universe
+from pyCMC.paging import PageIterator
+from pyCMC.stream import StreamedResponse
+from pyCMC.tail import AdaptiveTimeout, CircuitBreaker, Hedger
+
+@pytest.fixture(scope='module')
+def server():
+	with MockServer(Universe(coins=300, inactive=20, pairs=5)) as server:
+		yield server
+
+def client(root_url, *args, **kwargs):
+	cmc = CMC('key', *args, **kwargs)
+	cmc.root_url = root_url
+	return cmc
+
+# Root URL of a port nothing listens on.
+def dead_url():
+	s = socket.socket()
+	s.bind(('127.0.0.1', 0))
+	port = s.getsockname()[1]
+	s.close()
+	return 'http://127.0.0.1:{}/v1/'.format(port)
+
+#%% Shared cache leases
+
+def test_shared_cache_serves_other_clients(server, tmp_path):
+	path = str(tmp_path / 'cache.db')
+	a = client(server.root_url, cache=path)
+	b = client(server.root_url, cache=path)
+	before = server.requests.get('cryptocurrency/quotes/latest', 0)
+
+	assert a.quotes(coinId='1,2')['status']['error_code'] == 0
+	assert b.quotes(coinId='2, 1')['status']['error_code'] == 0
+	assert server.requests['cryptocurrency/quotes/latest'] == before + 1
+
+def test_lease_released_on_connection_error(tmp_path):
+	path = str(tmp_path / 'cache.db')
+	a = client(dead_url(), retries=0, cache=SharedCache(path, wait=2))
+	b = client(dead_url(), retries=0, cache=SharedCache(path, wait=2))
+
+	assert a.quotes(coinId='1')['status']['error_code'] == 100
+	started = time.monotonic()
+	assert b.quotes(coinId='1')['status']['error_code'] == 100
+	assert time.monotonic() - started < 1
+	assert a.cache._held == {} and b.cache._held == {}
+
+def test_lease_released_when_refused_locally(tmp_path):
+	path = str(tmp_path / 'cache.db')
+	scheduler = CreditScheduler('basic', daily_credits=1, used_today=1)
+	a = client(dead_url(), cache=SharedCache(path, wait=2), scheduler=scheduler)
+	b = client(dead_url(), retries=0, cache=SharedCache(path, wait=2))
+
+	assert a.quotes(coinId='1')['status']['error_code'] == 105
+	started = time.monotonic()
+	b.quotes(coinId='1')
+	assert time.monotonic() - started < 1
+
+def test_lease_shared_within_process(tmp_path):
+	cache = SharedCache(str(tmp_path / 'cache.db'), wait=2)
+	assert cache.get('cryptocurrency/quotes/latest', {'id' : '1'}) is None
+
+	# A second caller in the same process shares the lease instead of waiting on it.
+	started = time.monotonic()
+	assert cache.get('cryptocurrency/quotes/latest', {'id' : '1'}) is None
+	assert time.monotonic() - started < 0.5
+
+	cache.release('cryptocurrency/quotes/latest', {'id' : '1'})
+	assert cache._held
+	cache.release('cryptocurrency/quotes/latest', {'id' : '1'})
+	assert not cache._held
+
+def test_async_lease_released_on_connection_error(tmp_path):
+	pytest.importorskip('aiohttp')
+	import asyncio
+	from pyCMC.aio import AsyncCMC
+
+	path = str(tmp_path / 'cache.db')
+
+	async def run():
+		async with AsyncCMC('key', retries=0, cache=SharedCache(path, wait=2)) as cmc:
+			cmc.root_url = dead_url()
+			return await cmc.quotes(coinId='1')
+
+	assert asyncio.run(run())['status']['error_code'] == 100
+	started = time.monotonic()
+	assert SharedCache(path, wait=2).get('cryptocurrency/quotes/latest', {'id' : '1'}) is None
+	assert time.monotonic() - started < 0.5
+
+#%% Series store
+
+def test_store_replaces_open_bar(server, tmp_path):
+	from pyCMC import SeriesStore
+
+	cmc = client(server.root_url, store=str(tmp_path / 'store'))
+	end = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+	first = cmc.history('1', '2020-01-01', end)
+	assert first['status']['error_code'] == 0
+	key = cmc.store.key('1', 'USD', 'daily', 'ohlcv')
+	last = list(first['data'][-1])
+
+	# Stand in for a partial bar stored while its day was still open.
+	cmc.store.write(key, [[last[0]] + [1.0] * 6], 0, 0)
+	assert cmc.store.read(key)[-1][4] == 1.0
+
+	# Only the open day is fetched again, and its bar replaced.
+	before = server.requests['cryptocurrency/ohlcv/historical']
+	again = cmc.history('1', '2020-01-01', end)
+	assert server.requests['cryptocurrency/ohlcv/historical'] == before + 1
+	assert list(again['data'][-1]) == last
+	assert len(again['data']) == len(first['data'])
+
+	# A settled range is served without any call.
+	cmc.history('1', '2020-01-01', '2020-06-01')
+	assert server.requests['cryptocurrency/ohlcv/historical'] == before + 1
+
+	reopened = SeriesStore(str(tmp_path / 'store'))
+	assert list(reopened.read(key)[-1]) == last
+
+def test_store_skips_open_interval_until_it_closes(server, tmp_path):
+	from pyCMC.backfill import parse_time
+
+	cmc = client(server.root_url, store=str(tmp_path / 'store'))
+	now = time.time()
+	today = now - now % 86400
+
+	# No bar yet for the open day.
+	fetch = cmc.ohlcv_historical
+	def closed_only(*args, **kwargs):
+		response = fetch(*args, **kwargs)
+		response['data']['quotes'] = [
+			q for q in response['data']['quotes']
+			if parse_time(q['time_open']).timestamp() < today
+		]
+		return response
+	cmc.ohlcv_historical = closed_only
+
+	end = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+	first = cmc.history('1', '2020-01-01', end)
+	assert first['status']['error_code'] == 0
+	key = cmc.store.key('1', 'USD', 'daily', 'ohlcv')
+	assert cmc.store.gaps(key, parse_time('2020-01-01').timestamp(), parse_time(end).timestamp()) == []
+
+	# Nothing to fetch again before the day closes.
+	before = server.requests['cryptocurrency/ohlcv/historical']
+	again = cmc.history('1', '2020-01-01', end)
+	assert server.requests['cryptocurrency/ohlcv/historical'] == before
+	assert len(again['data']) == len(first['data'])
+
+	# Once it has closed, the day is fetched.
+	for r in cmc.store.index[key]:
+		if len(r) == 3:
+			r[2] = now - 1
+	assert cmc.store.gaps(key, today, parse_time(end).timestamp()) == [(today, parse_time(end).timestamp())]
+	cmc.history('1', '2020-01-01', end)
+	assert server.requests['cryptocurrency/ohlcv/historical'] == before + 1
+
+def test_store_covered_ranges_expire(tmp_path):
+	from pyCMC import SeriesStore
+
+	store = SeriesStore(str(tmp_path / 'store'))
+	now = time.time()
+	store.write('k', [], 0, 100)
+	store.write('k', [], 100, 200, now + 60)
+	store.write('k', [], 200, 300, now - 60)
+	assert store.covered('k') == [(0, 100), (100, 200)]
+	assert store.gaps('k', 0, 400) == [(200, 400)]
+
+	store.write('k', [], 50, 150)
+	assert store.covered('k') == [(0, 150), (100, 200)]
+	assert SeriesStore(str(tmp_path / 'store')).covered('k') == [(0, 150), (100, 200)]
+
+def test_history_rejects_bad_timestamps(tmp_path):
+	cmc = client(dead_url(), store=str(tmp_path / 'store'))
+	assert cmc.history('1', None, '2020-01-01')['status']['error_code'] == 102
+	assert cmc.history('1', 'yesterday', '2020-01-01')['status']['error_code'] == 102
+	assert cmc.history('1', 10 ** 20, '2020-01-01')['status']['error_code'] == 102
+
+#%% Metrics
+
+def test_local_errors_recorded_under_endpoint(tmp_path):
+	cmc = client(dead_url(), store=str(tmp_path / 'store'))
+
+	def my_job():
+		return list(cmc.backfill('1', '2020-01-01', '2020-02-01', interval='fortnightly'))
+
+	my_job()
+	assert cmc.history('1', 'yesterday', '2020-01-01', endpoint='quotes')['status']['error_code'] == 102
+	assert cmc.quotes()['status']['error_code'] == 101
+	assert cmc.listings(start='1')['status']['error_code'] == 102
+
+	errors = {endpoint : dict(stats['error_codes']) for endpoint, stats in cmc.metrics.snapshot().items()}
+	assert errors == {
+		'cryptocurrency/quotes/historical' : {102 : 2},
+		'cryptocurrency/quotes/latest' : {101 : 1},
+		'cryptocurrency/listings/latest' : {102 : 1},
+	}
+
+def test_raising_hooks_are_counted(server, caplog):
+	cmc = client(server.root_url)
+	seen = []
+
+	def broken(*args):
+		raise RuntimeError('boom')
+
+	cmc.metrics.add_hook(before=broken, after=broken)
+	cmc.metrics.add_hook(after=lambda endpoint, parameters, data, sample: seen.append(sample['error_code']))
+	assert cmc.global_metrics()['status']['error_code'] == 0
+	assert seen == [0]
+
+	stats = cmc.metrics.snapshot()['global-metrics/quotes/latest']
+	assert stats['hook_errors'] == 2 and stats['requests'] == 1
+	assert 'pycmc_hook_errors_total{endpoint="global-metrics/quotes/latest"} 2' in cmc.metrics.prometheus()
+	assert [r.name for r in caplog.records] == ['pyCMC.metrics'] * 2
+
+	cmc.metrics.remove_hook(broken)
+	cmc.global_metrics(convert='EUR')
+	assert cmc.metrics.snapshot()['global-metrics/quotes/latest']['hook_errors'] == 2
+
+#%% Coalescing
+
+def test_coalesced_slices_are_cached(server):
+	cmc = client(server.root_url, coalesce=True, cache=True)
+	ids = [str(i) for i in range(1, 41)]
+
+	def fetch():
+		with ThreadPoolExecutor(40) as pool:
+			return list(pool.map(lambda i: cmc.quotes(coinId=i), ids))
+
+	first = fetch()
+	assert all(list(r['data']) == [i] for r, i in zip(first, ids))
+	before = server.requests['cryptocurrency/quotes/latest']
+	second = fetch()
+	assert server.requests['cryptocurrency/quotes/latest'] == before
+	assert cmc.cache.hits == 40
+	assert [r['data'] for r in second] == [r['data'] for r in first]
+
+def test_coalesced_slices_count_towards_max_bytes(server):
+	from pyCMC.cache import ResponseCache
+
+	cmc = client(server.root_url, coalesce=True, cache=ResponseCache(max_bytes=10 ** 6))
+	with ThreadPoolExecutor(10) as pool:
+		list(pool.map(lambda i: cmc.quotes(coinId=str(i)), range(1, 11)))
+
+	# The merged responses and each slice.
+	entries = cmc.cache.stats()
+	assert entries['entries'] > 10
+	slices = [cmc.cache._entries[cmc.cache.key('cryptocurrency/quotes/latest', {'id' : str(i)})][1] for i in range(1, 11)]
+	assert all(size > 100 for size in slices)
+	assert entries['bytes'] > sum(slices)
+
+	# A cap smaller than the slices evicts them.
+	cmc = client(server.root_url, coalesce=True, cache=ResponseCache(max_bytes=sum(slices) // 2))
+	with ThreadPoolExecutor(10) as pool:
+		list(pool.map(lambda i: cmc.quotes(coinId=str(i)), range(1, 11)))
+	assert cmc.cache.stats()['bytes'] <= sum(slices) // 2 and cmc.cache.evictions > 0
+
+def test_coalesced_exception_reaches_every_caller():
+	coalescer = Coalescer(window=0.2)
+
+	def call(url, parameters):
+		raise ValueError('boom')
+
+	def submit(i):
+		try:
+			coalescer.submit(call, 'quotes', {'id' : str(i)})
+		except ValueError as e:
+			return str(e)
+
+	with ThreadPoolExecutor(5) as pool:
+		assert list(pool.map(submit, range(5))) == ['boom'] * 5
+
+#%% Streamed responses
+
+@pytest.mark.parametrize('body', [
+	[b'<html>oops</html>'],
+	[b'{"status":{"error_code":0},"data":[{"id":1},', b'{"id":2'],
+	[],
+])
+def test_stream_incomplete_body(body):
+	seen = []
+	streamed = StreamedResponse(iter(body), get_decoder(), done=seen.append)
+	list(streamed)
+	assert streamed.status['error_code'] == 107
+	assert seen == [streamed.status]
+
+def test_stream_complete_body(server):
+	cmc = client(server.root_url)
+	streamed = cmc.map(limit=50, stream=True)
+	assert len(list(streamed)) == 50
+	assert streamed.status['error_code'] == 0
+
+#%% Refresher
+
+def test_refresher_survives_exceptions(server):
+	from requests.exceptions import ChunkedEncodingError
+
+	cmc = client(server.root_url)
+	request = cmc._request
+	failures = [ChunkedEncodingError('cut off'), RuntimeError('boom')]
+
+	def flaky(url, parameters):
+		if failures:
+			raise failures.pop(0)
+		return request(url, parameters)
+
+	cmc._request = flaky
+	with Refresher(cmc, backoff=0.01) as hot:
+		hot.add_quotes('1,2')
+		deadline = time.monotonic() + 5
+		while hot.quotes('1,2')['status']['error_code'] != 0 and time.monotonic() < deadline:
+			time.sleep(0.01)
+
+		assert hot.quotes('1,2')['status']['error_code'] == 0
+		assert hot._thread.is_alive()
+		assert hot.errors == 2
+		assert str(hot.status['error_message']) == 'boom'
+
+#%% Dump
+
+def test_dump_resume_requires_same_options(server, tmp_path):
+	from pyCMC.dump import Dump
+
+	cmc = client(server.root_url)
+	out = str(tmp_path / 'dump')
+	ohlcv = ('2020-01-01', '2020-01-10')
+	assert Dump(cmc, out, 'csv', ohlcv=ohlcv, log=None).run()
+
+	before = dict(server.requests)
+	assert Dump(cmc, out, 'csv', ohlcv=list(ohlcv), log=None).run()
+	assert server.requests == before
+
+	for changed in (
+		{'ohlcv' : ('2020-01-01', '2020-02-01')},
+		{'ohlcv' : ohlcv, 'interval' : 'hourly'},
+		{'ohlcv' : ohlcv, 'market_pairs' : True},
+		{'ohlcv' : None},
+	):
+		with pytest.raises(ValueError):
+			Dump(cmc, out, 'csv', log=None, **changed)
+
+#%% Typed records
+
+def test_records_keep_unknown_fields(server):
+	cmc = client(server.root_url)
+	raw = cmc.market_pairs(coinId='1')['data']['market_pairs'][0]
+	raw.update({'market_id' : 7, 'category' : 'spot', 'fee_type' : 'percentage', 'market_url' : 'https://x'})
+	raw['quote']['USD']['volume_percentage'] = 0.5
+
+	pair = records.MarketPair(raw)
+	assert (pair.market_id, pair.category, pair.fee_type, pair.market_url) == (7, 'spot', 'percentage', 'https://x')
+	assert pair.quote['USD'].volume_percentage == 0.5
+	assert pair.to_dict()['market_id'] == 7
+	assert pair.to_dict()['quote']['USD']['volume_percentage'] == 0.5
+	assert pair.exchange_id == raw['exchange']['id']
+	assert 'exchange' not in pair.to_dict()
+	with pytest.raises(AttributeError):
+		pair.not_a_field
+
+	listing = cmc.listings(limit=1)['data'][0]
+	listing['self_reported_circulating_supply'] = 1.0
+	assert records.Listing(listing).to_dict()['self_reported_circulating_supply'] == 1.0
+	assert records.Listing(listing) == records.Listing(dict(listing))
+
+#%% Key pools
+
+def test_key_pool_budgets_each_key(server):
+	keys = ['11111111-aaaa', '22222222-bbbb']
+	cmc = CMC(keys, scheduler='basic')
+	cmc.root_url = server.root_url
+	cmc.keys.blocking = False
+	assert cmc.scheduler is None
+
+	# Stop the clock, so no calls come back during the test.
+	for k in cmc.keys._keys:
+		k.scheduler._clock = lambda now=k.scheduler.refilled: now
+
+	# Two basic keys allow 30 calls a minute each.
+	codes = [cmc.quotes(coinId=str(i))['status']['error_code'] for i in range(1, 62)]
+	assert codes == [0] * 60 + [108]
+
+	stats = cmc.keys.stats()
+	assert sorted(stats) == ['0:...aaaa', '1:...bbbb']
+	assert not any(key in repr(stats) for key in keys)
+	assert [s['requests'] for s in stats.values()] == [30, 30]
+	assert all(s['remaining']['calls_this_minute'] == 0 for s in stats.values())
+
+def test_key_pool_keeps_given_plans():
+	from pyCMC import KeyPool
+
+	pool = KeyPool({'11111111-aaaa' : 'standard', '22222222-bbbb' : None})
+	pool.budget('basic', blocking=False)
+	for k in pool._keys:
+		k.scheduler._clock = lambda now=k.scheduler.refilled: now
+	assert [pool.acquire() is not None for _ in range(91)] == [True] * 90 + [False]
+
+#%% Resolver
+
+def test_resolver_bypasses_cache(server, tmp_path):
+	from pyCMC import Resolver
+
+	cmc = client(server.root_url, cache=True)
+	for status in ('active', 'inactive'):
+		list(cmc.iter_map(status, 1, 5000, 0, 'id'))
+
+	before = server.requests['cryptocurrency/map']
+	resolver = Resolver(cmc, str(tmp_path / 'coins.json'))
+	assert resolver.build()['error_code'] == 0
+	assert resolver.refresh()['error_code'] == 0
+	assert server.requests['cryptocurrency/map'] == before + 4
+	assert len(resolver) == 320
+
+def test_resolver_refreshes_stale_index(server, tmp_path):
+	import json
+	from pyCMC import Resolver
+
+	path = str(tmp_path / 'coins.json')
+	cmc = client(server.root_url)
+	Resolver(cmc, path).build()
+
+	before = server.requests['cryptocurrency/map']
+	fresh = Resolver(cmc, path)
+	assert fresh.status is None and len(fresh) == 320
+	assert server.requests['cryptocurrency/map'] == before
+
+	with open(path) as f:
+		contents = json.load(f)
+	contents['updated'] -= 2 * 86400
+	with open(path, 'w') as f:
+		json.dump(contents, f)
+
+	stale = Resolver(cmc, path)
+	assert stale.status['error_code'] == 0
+	assert server.requests['cryptocurrency/map'] == before + 2
+	assert not stale.stale()
+	assert not Resolver(cmc, path).stale()
+
+def test_resolver_keeps_index_when_build_fails(server, tmp_path):
+	from pyCMC import Resolver
+
+	cmc = client(server.root_url)
+	resolver = Resolver(cmc, str(tmp_path / 'coins.json'))
+	resolver.build()
+	before = (dict(resolver.by_id), resolver.watermark, dict(resolver.counts), resolver.updated)
+	symbol = server.universe.symbol(7)
+
+	# The active coins come back, then the sweep of inactive ones fails.
+	send = cmc._request
+	cmc._request = lambda url, parameters: (
+		cmc._error(100, 'Down.', url) if parameters['listing_status'] == 'inactive' else send(url, parameters)
+	)
+	assert resolver.build()['error_code'] == 100
+	assert (resolver.by_id, resolver.watermark, resolver.counts, resolver.updated) == before
+	assert 7 in resolver.ids(symbol=symbol)
+	assert len(Resolver(cmc, str(tmp_path / 'coins.json'))) == 320
+
+def test_refresher_waits_for_missing_ids(server):
+	cmc = client(server.root_url)
+	request = cmc._request
+	calls = []
+
+	# The API leaves out coins it no longer lists.
+	def dropping(url, parameters):
+		calls.append(parameters['id'])
+		response = request(url, parameters)
+		response['data'].pop('2', None)
+		return response
+
+	cmc._request = dropping
+	with Refresher(cmc) as hot:
+		hot.add_quotes('1,2')
+		time.sleep(0.3)
+		assert len(calls) == 1
+		assert hot.quotes('1')['status']['error_code'] == 0
+		assert hot.quotes('2')['status']['error_code'] == 109
+
+#%% Paging
+
+# `fetch` over `total` records, clamping `limit` like the API. `fail_at` makes the page
+# starting there an error.
+def pages(total, fail_at=None, calls=None):
+	def fetch(start, limit):
+		if calls is not None:
+			calls.append(start)
+		if start == fail_at:
+			return {'status' : {'error_code' : 500, 'error_message' : 'boom'}}
+		limit = min(limit, 5000)
+		return {'status' : {'error_code' : 0}, 'data' : list(range(start, min(total + 1, start + limit)))}
+	return fetch
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_pages_exact_multiple(prefetch):
+	calls = []
+	it = PageIterator(pages(20, calls=calls), lambda data: data, 1, 5, prefetch)
+	assert list(it) == list(range(1, 21))
+	assert it.status['error_code'] == 0
+	# The fifth page comes back empty and ends iteration.
+	assert sorted(calls)[:5] == [1, 6, 11, 16, 21]
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_pages_clamped_to_api_limit(prefetch):
+	it = PageIterator(pages(12000), lambda data: data, 1, 10000, prefetch)
+	assert it.page_size == 5000
+	assert list(it) == list(range(1, 12001))
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_pages_stop_at_error(prefetch):
+	it = PageIterator(pages(100, fail_at=11), lambda data: data, 1, 5, prefetch)
+	assert list(it) == list(range(1, 11))
+	assert it.status['error_code'] == 500
+
+def test_pages_closed_early():
+	calls = []
+	it = iter(PageIterator(pages(10 ** 6, calls=calls), lambda data: data, 1, 5, 2))
+	assert next(it) == 1
+	it.close()
+	assert len(calls) <= 4
+
+def test_iter_map_over_mock(server):
+	cmc = client(server.root_url)
+	coins = list(cmc.iter_map('active', page_size=100, prefetch=1))
+	assert [c['id'] for c in coins] == list(range(1, 301))
+
+def test_iter_listings_and_pairs_over_mock(server):
+	cmc = client(server.root_url)
+	listings = list(cmc.iter_listings(start=251, page_size=20, prefetch=2))
+	assert len(listings) == 50 and len({c['id'] for c in listings}) == 50
+
+	pairs = cmc.iter_market_pairs(coinId='1', page_size=2)
+	assert len(list(pairs)) == 5
+	assert pairs.status['error_code'] == 0
+
+	# Starting past the end is an empty, successful iteration.
+	coins = cmc.iter_map(start=1000, page_size=100)
+	assert list(coins) == []
+	assert coins.status['error_code'] == 0
+
+def test_async_pages_stop_at_error():
+	import asyncio
+	from pyCMC.paging import AsyncPageIterator
+
+	fetch = pages(100, fail_at=11)
+
+	async def body(prefetch):
+		async def page(start, limit):
+			return fetch(start, limit)
+		it = AsyncPageIterator(page, lambda data: data, 1, 5, prefetch)
+		return [r async for r in it], it.status['error_code']
+
+	for prefetch in (0, 2):
+		assert asyncio.run(body(prefetch)) == (list(range(1, 11)), 500)
+
+def test_dump_rejects_oversized_pages(tmp_path):
+	from pyCMC.__main__ import main
+	from pyCMC.dump import Dump
+
+	with pytest.raises(ValueError):
+		Dump(client(dead_url()), str(tmp_path / 'dump'), 'csv', page_size=10000, log=None)
+	with pytest.raises(SystemExit):
+		main(['dump', '--key', 'key', '--out', str(tmp_path / 'dump'), '--page-size', '10000'])
+
+def test_dump_with_small_pages(server, tmp_path):
+	from pyCMC.dump import Dump
+
+	out = str(tmp_path / 'dump')
+	assert Dump(client(server.root_url), out, 'csv', page_size=100, market_pairs=True, log=None).run()
+	rows = lambda dataset: sum(
+		len(open(os.path.join(out, dataset, name)).readlines()) - 1 for name in os.listdir(os.path.join(out, dataset))
+	)
+	assert rows('map') == 320
+	assert rows('listings') == 300
+	assert rows('metadata') == 320
+	assert rows('market_pairs') == 300 * 5
+
+#%% Async client
+
+def run_async(root_url, body, **kwargs):
+	pytest.importorskip('aiohttp')
+	import asyncio
+	from pyCMC.aio import AsyncCMC
+
+	async def run():
+		async with AsyncCMC('key', **kwargs) as cmc:
+			cmc.root_url = root_url
+			return await body(cmc)
+
+	return asyncio.run(run())
+
+def test_async_concurrency_limit(server):
+	import asyncio
+
+	async def body(cmc):
+		get = cmc.transport.get
+		state = {'now' : 0, 'most' : 0}
+
+		async def counting(*args, **kwargs):
+			state['now'] += 1
+			state['most'] = max(state['most'], state['now'])
+			try:
+				await asyncio.sleep(0.01)
+				return await get(*args, **kwargs)
+			finally:
+				state['now'] -= 1
+
+		cmc.transport.get = counting
+		results = await asyncio.gather(*[cmc.quotes(coinId=str(i)) for i in range(1, 41)])
+		return results, state['most']
+
+	results, most = run_async(server.root_url, body, concurrency=5)
+	assert [list(r['data']) for r in results] == [[str(i)] for i in range(1, 41)]
+	assert most == 5
+
+def test_async_shares_inflight_requests(server):
+	import asyncio
+
+	async def body(cmc):
+		before = server.requests.get('cryptocurrency/info', 0)
+		results = await asyncio.gather(*[cmc.metadata(coinId='5,6') for _ in range(10)])
+		return results, server.requests['cryptocurrency/info'] - before, cmc.singleflight.shared
+
+	results, sent, shared = run_async(server.root_url, body)
+	assert all(r['status']['error_code'] == 0 for r in results)
+	assert (sent, shared) == (1, 9)
+	assert len({id(r) for r in results}) == 10 and all(r == results[0] for r in results)
+
+def test_async_error_dicts(server):
+
+	async def body(cmc):
+		return (
+			await cmc.quotes(),
+			await cmc.listings(start='1'),
+			await cmc.map(stream=True),
+		)
+
+	missing, wrong_type, streamed = run_async(server.root_url, body)
+	assert missing['status']['error_code'] == 101
+	assert wrong_type['status']['error_code'] == 102
+	assert streamed['status']['error_code'] == 101
+
+	offline = run_async(dead_url(), lambda cmc: cmc.quotes(coinId='1'), retries=0)
+	assert offline['status']['error_code'] == 100
+
+def test_async_pages_and_snapshot(server):
+	pytest.importorskip('numpy')
+
+	async def body(cmc):
+		coins = [c['id'] async for c in cmc.iter_map(page_size=100, prefetch=1)]
+		listings = [c['id'] async for c in cmc.iter_listings(page_size=128)]
+		snapshot = await cmc.snapshot_rates(limit=10)
+		return coins, listings, snapshot
+
+	coins, listings, snapshot = run_async(server.root_url, body)
+	assert coins == list(range(1, 301))
+	assert len(listings) == 300
+	assert snapshot['status']['error_code'] == 0 and len(snapshot['data']) == 11
+
+def test_async_unsupported_methods(server):
+
+	async def body(cmc):
+		for call in (lambda: cmc.backfill('1', '2020-01-01', '2020-02-01'), lambda: cmc.watch('1'), lambda: list(cmc.iter_map())):
+			with pytest.raises(TypeError):
+				call()
+		return True
+
+	assert run_async(server.root_url, body)
+
+def test_async_shared_cache_wait_off_loop(server, tmp_path):
+	import asyncio
+
+	path = str(tmp_path / 'cache.db')
+	other = SharedCache(path, wait=0.5)
+	assert other.get('cryptocurrency/quotes/latest', {'id' : '1'}) is None
+
+	async def body(cmc):
+		ticks = 0
+
+		async def tick():
+			nonlocal ticks
+			for _ in range(100):
+				await asyncio.sleep(0.01)
+				ticks += 1
+
+		async def quotes():
+			result = await cmc.quotes(coinId='1')
+			return result, ticks
+
+		return (await asyncio.gather(quotes(), tick()))[0]
+
+	# The loop kept ticking while the request waited out the other lease.
+	result, ticks = run_async(server.root_url, body, cache=SharedCache(path, wait=0.5))
+	assert result['status']['error_code'] == 0
+	assert ticks >= 10
+
+#%% Tail latency
+
+# Stands in for `Metrics`: `count` responses, all taking `latency` seconds.
+class Latency(object):
+
+	def __init__(self, count, latency):
+		self.n = count
+		self.latency = latency
+
+	def count(self, endpoint):
+		return self.n
+
+	def percentile(self, endpoint, p):
+		return self.latency
+
+def test_adaptive_timeout():
+	timeouts = AdaptiveTimeout(multiplier=3.0, floor=1.0, ceiling=30.0, connect=2, min_samples=20)
+	assert timeouts.timeout('quotes', None) is None
+	assert timeouts.timeout('quotes', Latency(19, 2.0)) is None
+	assert timeouts.timeout('quotes', Latency(20, 2.0)) == (2, 6.0)
+	assert timeouts.timeout('quotes', Latency(20, 0.01)) == (2, 1.0)
+	assert timeouts.timeout('quotes', Latency(20, 60.0)) == (2, 30.0)
+
+def test_hedge_answers_first():
+	hedger = Hedger(budget=1, burst=1, workers=2)
+	calls, discarded = [], []
+
+	def call():
+		n = len(calls)
+		calls.append(n)
+		if n == 0:
+			time.sleep(0.3)
+		return n
+
+	assert hedger.delay('quotes', Latency(5, 0.01)) is None
+	assert hedger.run(call, hedger.delay('quotes', Latency(20, 0.01)), discard=discarded.append) == 1
+	time.sleep(0.5)
+	assert discarded == [0]
+	assert (hedger.sent, hedger.won) == (1, 1)
+	hedger.close()
+
+def test_hedge_cancelled_when_first_answers():
+	hedger = Hedger(budget=1, burst=1, workers=1)
+	calls = []
+
+	# Another request queued ahead of the hedge keeps it waiting for the one worker.
+	def call():
+		calls.append(None)
+		if len(calls) == 1:
+			hedger._pool.submit(time.sleep, 0.3)
+		time.sleep(0.2)
+		return len(calls)
+
+	assert hedger.run(call, 0.01) == 1
+	time.sleep(0.5)
+	assert len(calls) == 1
+	assert (hedger.sent, hedger.won) == (1, 0)
+
+	# Refused by `allow`, or out of budget: no hedge.
+	assert hedger.run(call, 0.01, allow=lambda: False) == 2
+	hedger.budget = 0
+	hedger.tokens = 0
+	assert hedger.run(call, 0.01) == 3
+	assert hedger.sent == 1
+	hedger.close()
+
+def tripped(**kwargs):
+	breaker = CircuitBreaker(window=4, threshold=0.5, min_calls=4, **kwargs)
+	for ok in (True, False, True, False):
+		ticket, limited = breaker.allow()
+		assert limited is None
+		breaker.record(ticket, ok)
+	return breaker
+
+def test_breaker_trips_and_cools_down():
+	breaker = tripped(cooldown=30)
+	assert (breaker.state, breaker.trips) == ('open', 1)
+	ticket, limited = breaker.allow()
+	assert ticket is None and limited[0] == 110
+
+	breaker.opened -= 30
+	ticket, limited = breaker.allow()
+	assert limited is None and breaker.state == 'half-open'
+
+	# One trial at a time.
+	assert breaker.allow()[1][0] == 110
+
+	breaker.record(ticket, True)
+	assert breaker.state == 'closed'
+	assert breaker.allow()[1] is None
+
+def test_breaker_failed_trial_reopens():
+	breaker = tripped()
+	breaker.opened -= breaker.cooldown
+	ticket, _ = breaker.allow()
+	breaker.record(ticket, False)
+	assert breaker.state == 'open'
+	assert breaker.allow()[1][0] == 110
+	assert breaker.trips == 1
+
+def test_breaker_ignores_stragglers():
+	breaker = CircuitBreaker(window=4, threshold=0.5, min_calls=4)
+	straggler, _ = breaker.allow()
+	for ok in (True, False, True, False):
+		breaker.record(breaker.allow()[0], ok)
+	assert breaker.state == 'open'
+
+	# A request sent before the circuit opened cannot close it, whether open or half-open.
+	breaker.record(straggler, True)
+	assert breaker.state == 'open'
+	breaker.opened -= breaker.cooldown
+	trial, _ = breaker.allow()
+	breaker.record(straggler, True)
+	assert breaker.state == 'half-open'
+
+	# Nor can a trial that was given up on and replaced.
+	breaker.opened -= breaker.cooldown
+	retrial, _ = breaker.allow()
+	breaker.record(trial, True)
+	assert breaker.state == 'half-open'
+	breaker.record(retrial, True)
+	assert breaker.state == 'closed'
+
+	# Once closed, a late failure from before does not count towards the next trip.
+	breaker.record(straggler, False)
+	breaker.record(trial, False)
+	assert list(breaker._outcomes) == []
+
+def test_breaker_fails_fast():
+	cmc = client(dead_url(), retries=0, breaker=CircuitBreaker(window=2, min_calls=2))
+	assert [cmc.quotes(coinId='1')['status']['error_code'] for _ in range(3)] == [100, 100, 110]
+
+#%% Transport
+
+# A `MockServer` that first answers with the scripted `(http_status, headers)` replies,
+# and records the client port of each request to tell connections apart.
+class ScriptedServer(MockServer):
+
+	def __init__(self, *script):
+		MockServer.__init__(self, Universe(coins=10, inactive=0, pairs=1))
+		self.script = list(script)
+		self.ports = []
+
+	def _handle(self, handler):
+		self.ports.append(handler.client_address[1])
+		if not self.script:
+			return MockServer._handle(self, handler)
+
+		http_status, headers = self.script.pop(0)
+		handler.send_response(http_status)
+		for name, value in headers.items():
+			handler.send_header(name, value)
+		handler.send_header('Content-Length', '2')
+		handler.end_headers()
+		handler.wfile.write(b'{}')
+
+def test_transport_retries_then_succeeds():
+	from pyCMC.transport import Transport
+
+	with ScriptedServer((500, {}), (503, {})) as server:
+		transport = Transport({}, retries=3, backoff=0)
+		response = transport.get(server.root_url + 'cryptocurrency/map')
+		assert (response.status_code, response.retries) == (200, 2)
+
+		# One pooled connection, kept alive for every attempt and the calls after them.
+		transport.get(server.root_url + 'cryptocurrency/map')
+		assert len(server.ports) == 4 and len(set(server.ports)) == 1
+		transport.close()
+
+def test_transport_gives_up():
+	from pyCMC.transport import Transport
+
+	with ScriptedServer((500, {}), (500, {}), (500, {})) as server:
+		transport = Transport({}, retries=2, backoff=0)
+		response = transport.get(server.root_url + 'cryptocurrency/map')
+		assert (response.status_code, response.retries) == (500, 2)
+		transport.close()
+
+	from requests.exceptions import ConnectionError
+
+	transport = Transport({}, retries=1, backoff=0)
+	with pytest.raises(ConnectionError):
+		transport.get(dead_url() + 'cryptocurrency/map')
+
+def test_transport_honours_retry_after():
+	from pyCMC.transport import Transport
+
+	with ScriptedServer((429, {'Retry-After' : '0.3'}), (429, {'Retry-After' : '60'})) as server:
+		transport = Transport({}, retries=2, backoff=0, max_backoff=0.5)
+		started = time.monotonic()
+		response = transport.get(server.root_url + 'cryptocurrency/map')
+		elapsed = time.monotonic() - started
+		assert (response.status_code, response.retries) == (200, 2)
+
+		# 0.3s as asked, then 60s capped to `max_backoff`.
+		assert 0.8 <= elapsed < 2
+		transport.close()
+
+	# Only the status codes given are retried.
+	with ScriptedServer((503, {})) as server:
+		transport = Transport({}, retries=2, backoff=0)
+		assert transport.get(server.root_url + 'cryptocurrency/map', retry_status=(500,)).status_code == 503
+		transport.close()
+
+def test_client_retries():
+	with ScriptedServer((502, {})) as scripted:
+		cmc = client(scripted.root_url, backoff=0)
+		assert cmc.map(limit=5)['status']['error_code'] == 0
+		assert cmc.metrics.snapshot()['cryptocurrency/map']['retries'] == 1
+
+#%% Response cache
+
+def test_cache_ttl_and_keys():
+	from pyCMC.cache import ResponseCache
+
+	cache = ResponseCache(ttls={'cryptocurrency/quotes/latest' : 0.1, 'tools/price-conversion' : 0})
+	cache.set('cryptocurrency/quotes/latest', {'id' : '1,1027', 'convert' : 'USD'}, {'data' : 1})
+	cache.set('tools/price-conversion', {'amount' : 1}, {'data' : 2})
+
+	# Comma lists match in any order.
+	assert cache.get('cryptocurrency/quotes/latest', {'convert' : 'USD', 'id' : '1027, 1'}) == {'data' : 1}
+	assert cache.get('cryptocurrency/quotes/latest', {'id' : '1027,1', 'convert' : 'EUR'}) is None
+	assert cache.get('tools/price-conversion', {'amount' : 1}) is None
+	time.sleep(0.15)
+	assert cache.get('cryptocurrency/quotes/latest', {'id' : '1,1027', 'convert' : 'USD'}) is None
+	assert (cache.hits, cache.misses, len(cache)) == (1, 3, 0)
+
+def test_cache_evicts_least_recently_used():
+	from pyCMC.cache import ResponseCache
+
+	cache = ResponseCache(max_entries=2)
+	for coinId in '123':
+		cache.set('cryptocurrency/info', {'id' : coinId}, coinId)
+		cache.get('cryptocurrency/info', {'id' : '1'})
+	assert cache.get('cryptocurrency/info', {'id' : '2'}) is None
+	assert cache.get('cryptocurrency/info', {'id' : '1'}) == '1'
+	assert cache.evictions == 1
+
+	cache = ResponseCache(max_bytes=100)
+	cache.set('cryptocurrency/info', {'id' : '1'}, '1', 60)
+	cache.set('cryptocurrency/info', {'id' : '2'}, '2', 30)
+	assert cache.stats()['bytes'] == 90
+	cache.set('cryptocurrency/info', {'id' : '3'}, '3', 20)
+	assert cache.get('cryptocurrency/info', {'id' : '1'}) is None
+	assert cache.stats()['bytes'] == 50
+
+	# Replacing an entry does not count its old size twice, and one too big is not kept.
+	cache.set('cryptocurrency/info', {'id' : '3'}, '3', 40)
+	assert cache.stats()['bytes'] == 70
+	cache.set('cryptocurrency/info', {'id' : '4'}, '4', 200)
+	assert (len(cache), cache.stats()['bytes']) == (0, 0)
+
+def test_cached_responses_are_copies(server):
+	cmc = client(server.root_url, cache=True)
+	before = server.requests.get('cryptocurrency/quotes/latest', 0)
+
+	first = cmc.quotes(coinId='1')
+	first['data']['1']['quote'].clear()
+	second = cmc.quotes(coinId='1')
+	assert second['data']['1']['quote']
+	second['status']['error_code'] = 1
+	assert cmc.quotes(coinId='1', typed=True)['data']['1'].quote['USD'].price > 0
+
+	assert server.requests['cryptocurrency/quotes/latest'] == before + 1
+	assert cmc.cache.stats()['hits'] == 2
+
+#%% Scheduler
+
+def scheduler(**kwargs):
+	clock = [0.0]
+	s = CreditScheduler(blocking=False, **kwargs)
+	s._clock = lambda: clock[0]
+	s.refilled = 0.0
+	return s, clock
+
+def test_scheduler_plans():
+	s = CreditScheduler('professional')
+	assert (s.calls_per_minute, s.monthly_credits, s.daily_credits) == (90, 2_000_000, 66_666)
+	s = CreditScheduler('no-such-plan', calls_per_minute=5, monthly_credits=300, daily_credits=20)
+	assert (s.plan, s.calls_per_minute, s.monthly_credits, s.daily_credits) == ('basic', 5, 300, 20)
+
+def test_scheduler_refills_per_minute():
+	s, clock = scheduler(calls_per_minute=60)
+	assert [s.acquire() for _ in range(60)] == [None] * 60
+	assert s.acquire()[0] == 104
+	assert s.delay() == pytest.approx(1.0)
+
+	clock[0] = 2.5
+	assert [s.acquire() for _ in range(3)][:2] == [None, None]
+	assert s.remaining()['calls_this_minute'] == 0
+
+	# Never more than a minute's worth saved up.
+	clock[0] = 1000
+	assert s.remaining()['calls_this_minute'] == 60
+
+	# A per-minute limit error from CMC empties the bucket.
+	s.record({'error_code' : 1008, 'credit_count' : 0})
+	assert s.acquire()[0] == 104
+
+def test_scheduler_blocks_for_a_token():
+	s = CreditScheduler(calls_per_minute=600)
+	s.tokens = 0
+	started = time.monotonic()
+	assert s.acquire() is None
+	assert 0.05 <= time.monotonic() - started < 1
+
+def test_scheduler_credit_budgets():
+	s, _ = scheduler(monthly_credits=100, daily_credits=10, used_this_month=95)
+	s.record({'error_code' : 0, 'credit_count' : 4})
+	assert s.remaining() == {'calls_this_minute' : 30, 'daily_credits' : 6, 'monthly_credits' : 1}
+	assert s.acquire() is None
+	s.record({'error_code' : 0, 'credit_count' : 1})
+	assert s.acquire() == (105, 'Monthly credit budget of 100 used up.')
+
+	s, _ = scheduler(daily_credits=10)
+	s.record({'error_code' : 1009, 'credit_count' : 0})
+	assert s.acquire() == (105, 'Daily credit budget of 10 used up.')
+	s.record(None)
+
+	# Budgets start over on a new UTC day.
+	s.day = s.day.replace(year=2000)
+	assert s.acquire() is None
+
+def test_scheduler_refuses_calls_locally(server):
+	cmc = client(server.root_url, scheduler=CreditScheduler(calls_per_minute=2, blocking=False))
+	before = server.requests.get('global-metrics/quotes/latest', 0)
+	codes = [cmc.global_metrics()['status']['error_code'] for _ in range(3)]
+	assert codes == [0, 0, 104]
+	assert server.requests['global-metrics/quotes/latest'] == before + 2
+	assert cmc.scheduler.used_today == 2
+
+#%% Columnar
+
+def test_columnar_currencies_union():
+	np = pytest.importorskip('numpy')
+	from pyCMC import columnar
+
+	data = columnar.coins([
+		{'id' : 1, 'cmc_rank' : 1, 'quote' : {'USD' : {'price' : 2.0}}},
+		{'id' : 2, 'quote' : {'EUR' : {'price' : 3.0}, 'USD' : {'price' : None}}},
+		{'id' : 3},
+	])
+	assert list(data['id']) == [1, 2, 3]
+	assert list(data['quote']) == ['USD', 'EUR']
+	assert np.isnan(data['cmc_rank'][1:]).all()
+	assert data['quote']['USD']['price'][0] == 2.0 and np.isnan(data['quote']['USD']['price'][1:]).all()
+	assert data['quote']['EUR']['price'][1] == 3.0 and np.isnan(data['quote']['EUR']['price'][[0, 2]]).all()
+	assert columnar.coins([])['quote'] == {}
+
+	series = columnar.ohlcv_historical({'status' : {}, 'data' : {'id' : 1, 'quotes' : [
+		{'time_open' : '2020-01-01T00:00:00.000Z', 'quote' : {'USD' : {'close' : 1.0}}},
+		{'time_open' : '2020-01-02T00:00:00.000Z'},
+		{'time_open' : '2020-01-03T00:00:00.000Z', 'quote' : {'BTC' : {'close' : 0.5}}},
+	]}})['data']
+	assert list(series['timestamp']) == list(np.array(['2020-01-01', '2020-01-02', '2020-01-03'], dtype='datetime64[ms]'))
+	assert series['quote']['USD']['close'][0] == 1.0 and np.isnan(series['quote']['USD']['close'][1:]).all()
+	assert series['quote']['BTC']['close'][2] == 0.5
+
+def test_columnar_over_mock(server):
+	pytest.importorskip('numpy')
+	cmc = client(server.root_url)
+
+	listings = cmc.listings(limit=50, convert='USD,EUR', columnar=True)['data']
+	assert len(listings['id']) == 50 and set(listings['quote']) == {'USD', 'EUR'}
+	assert (listings['quote']['USD']['price'] > 0).all()
+
+	quotes = cmc.quotes(coinId='1,2', columnar=True)['data']
+	assert sorted(quotes['id']) == [1, 2]
+
+	history = cmc.historical_quotes(coinId='1,2', time_start='2020-01-01', time_end='2020-01-02', interval='hourly', columnar=True)['data']
+	assert set(history) == {'1', '2'}
+	assert len(history['1']['timestamp']) == len(history['1']['quote']['USD']['price']) > 0
+
+#%% Backfill
+
+def test_backfill_windows():
+	import datetime
+	from pyCMC.backfill import parse_time, windows
+
+	start = parse_time('2020-01-01')
+	assert parse_time(1577836800) == parse_time('1577836800') == parse_time('2020-01-01T00:00:00Z') == start
+	assert parse_time('2020-01-01T01:00:00+01:00') == start
+	with pytest.raises(ValueError):
+		parse_time('yesterday')
+
+	spans = list(windows(start, start + datetime.timedelta(hours=25), 3600, 10))
+	assert [(a.hour, b.hour) for a, b in spans] == [(0, 10), (10, 20), (20, 1)]
+	assert list(windows(start, start, 3600, 10)) == []
+
+@pytest.mark.parametrize('endpoint', ['quotes', 'ohlcv'])
+def test_backfill_over_mock(server, monkeypatch, endpoint):
+	monkeypatch.setattr('pyCMC.backfill.MAX_POINTS', 50)
+	cmc = client(server.root_url)
+	path = 'cryptocurrency/{}/historical'.format(endpoint)
+	before = server.requests.get(path, 0)
+
+	points = list(cmc.backfill('1,2', '2020-01-01', '2020-01-11', 'hourly', endpoint, workers=3))
+
+	# 240 hours, 25 per window for two coins, and window edges only yielded once.
+	assert server.requests[path] == before + 10
+	key = 'time_open' if endpoint == 'ohlcv' else 'timestamp'
+	for coinId in ('1', '2'):
+		moments = [p[key] for c, p in points if c == coinId]
+		assert len(moments) == 241 and moments == sorted(set(moments))
+	assert [p[key] for _, p in points] == sorted(p[key] for _, p in points)
+
+def test_backfill_errors(server):
+	cmc = client(server.root_url)
+
+	failed = cmc.backfill('1,999999', '2020-01-01', '2020-01-02', 'hourly')
+	assert list(failed) == []
+	assert failed.status['error_code'] == 400
+
+	invalid = cmc.backfill('1', '2020-01-01', '2020-01-02', 'fortnightly')
+	assert list(invalid) == []
+	assert invalid.status['error_code'] == 102
+
+#%% Decoders
+
+@pytest.mark.parametrize('name', ['orjson', 'ujson', 'json'])
+def test_decoders_agree(name):
+	from pyCMC.decoders import backends
+
+	try:
+		loads = backends[name]()
+	except ImportError:
+		pytest.skip('{} is not installed'.format(name))
+
+	body = '{"status":{"error_code":0},"data":{"name":"Bitcoin ₿","price":1.5e4,"tags":[null,true]}}'.encode('utf-8')
+	assert loads(body) == {'status' : {'error_code' : 0}, 'data' : {'name' : 'Bitcoin ₿', 'price' : 15000.0, 'tags' : [None, True]}}
+
+def test_get_decoder_falls_back():
+	import json
+
+	assert get_decoder('json') is json.loads
+	assert get_decoder(len) is len
+	assert get_decoder('no-such-backend') is get_decoder('auto')
+	assert callable(get_decoder('auto'))
+
+def test_client_decodes_bytes(server):
+	bodies = []
+
+	def loads(body):
+		bodies.append(type(body))
+		return get_decoder('json')(body)
+
+	cmc = client(server.root_url, decoder=loads)
+	assert cmc.map(limit=5)['status']['error_code'] == 0
+	assert bodies == [bytes]
+
+	# Bodies that are not a JSON object become error 107.
+	assert cmc._decode(b'<html>Bad gateway</html>', 502)['status'] == {
+		'error_code' : 107,
+		'error_message' : 'Could not decode response (HTTP 502).',
+	}
+	assert cmc._decode(b'[1, 2]', 200)['status']['error_code'] == 107
+
+#%% Offline conversion
+
+def test_rate_matrix_pivot_and_ids():
+	pytest.importorskip('numpy')
+	from pyCMC.convert import RateMatrix
+
+	# As from `listings(convert_id='2781,1')`: USD, then BTC.
+	records = [
+		{'id' : 1, 'symbol' : 'BTC', 'quote' : {'2781' : {'price' : 20000.0}, '1' : {'price' : 1.0}}},
+		{'id' : 1027, 'symbol' : 'ETH', 'quote' : {'2781' : {'price' : 1000.0}, '1' : {'price' : 0.05}}},
+		{'id' : 5, 'symbol' : 'NOQ'},
+	]
+	rates = RateMatrix(records)
+	assert rates.pivot == '2781'
+	assert sorted(rates.keys) == ['1', '1027', '2781']
+	assert (rates.key('btc'), rates.key('USD'), rates.unnamed) == ('1', None, ['2781'])
+	converted, _ = rates.convert([1, 2], ['ETH', '1'], '2781')
+	assert list(converted) == [1000.0, 40000.0]
+	assert rates.matrix()[rates.index['1'], rates.index['1027']] == 20.0
+
+	rates = RateMatrix(records, {'2781' : 'USD'})
+	assert (rates.key('usd'), rates.unnamed) == ('2781', [])
+	assert rates.convert(1, 'BTC', 'USD')[0][0] == 20000.0
+
+def test_snapshot_rates_by_id(server, tmp_path):
+	pytest.importorskip('numpy')
+	cmc = client(server.root_url)
+	price = cmc.quotes('1', convert_id='5')['data']['1']['quote']['5']['price']
+	symbol = server.universe.symbol(5)
+
+	assert cmc.snapshot_rates('1,2,3', convert_id='5,1')['status']['error_code'] == 0
+	assert cmc.rates.unnamed == ['5']
+	assert cmc.convert_price(1, coinId='1', convert_id='5', offline=True)['data']['quote']['5']['price'] == pytest.approx(price)
+	error = cmc.convert_price(1, coinId='1', convert=symbol, offline=True)['status']
+	assert error['error_code'] == 103 and 'only knows quote currencies 5 by ID' in error['error_message']
+
+	cmc.snapshot_rates('1,2,3', convert_id='5,1', symbols={'5' : 'FIVE'})
+	assert cmc.convert_price(1, coinId='1', convert='five', offline=True)['data']['quote']['five']['price'] == pytest.approx(price)
+
+	# Coins the resolver knows are named from it.
+	from pyCMC import Resolver
+
+	cmc = client(server.root_url)
+	cmc.resolver = Resolver(cmc, str(tmp_path / 'coins.json'))
+	cmc.resolver.build()
+	cmc.snapshot_rates('1,2,3', convert_id='5,1')
+	assert cmc.rates.unnamed == []
+	assert cmc.convert_price(1, coinId='1', convert=symbol, offline=True)['data']['quote'][symbol]['price'] == pytest.approx(price)
+
+#%% Mock server and benchmark
+
+def test_mock_serves_every_endpoint(server):
+	from bench import ENDPOINTS
+
+	cmc = client(server.root_url)
+	for name, call in ENDPOINTS.items():
+		assert call(cmc)['status']['error_code'] == 0, name
+
+	assert cmc.map(limit=5)['data'][0]['id'] == 1
+	assert len(cmc.map(status='inactive', limit=5000)['data']) == 20
+	assert cmc.quotes(coinId='999999')['status']['error_code'] == 400
+	assert cmc._request(server.root_url + 'no/such/endpoint', {})['status']['error_code'] == 404
+
+def test_mock_faults():
+	with MockServer(Universe(coins=10, inactive=0, pairs=1), limit_rate=1) as limited:
+		cmc = client(limited.root_url, retries=0)
+		assert cmc.global_metrics()['status']['error_code'] == 1008
+	with MockServer(Universe(coins=10, inactive=0, pairs=1), error_rate=1, latency=0.1) as failing:
+		cmc = client(failing.root_url, retries=1, backoff=0)
+		started = time.monotonic()
+		assert cmc.global_metrics()['status']['error_code'] == 500
+		assert time.monotonic() - started >= 0.2
+		assert failing.requests == {'global-metrics/quotes/latest' : 2}
+
+@pytest.mark.parametrize('mode', ['plain', 'stdlib-json', 'cache', 'stream', 'async'])
+def test_bench_measures(server, mode):
+	import argparse
+	from bench import measure
+
+	if mode == 'async':
+		pytest.importorskip('aiohttp')
+
+	args = argparse.Namespace(requests=4, concurrency=2)
+	row = measure(mode, 'quotes', server.root_url, args)
+	assert (row['mode'], row['endpoint'], row['errors']) == (mode, 'quotes', 0)
+	assert row['req/s'] > 0 and row['MB/s'] > 0 and row['p99 ms'] >= row['p50 ms']
+
+#%% Watch
+
+# Stands in for `CMC`: answers `quotes()` from a list of responses, one per call.
+class Quotes(object):
+
+	def __init__(self, *responses):
+		self.responses = list(responses)
+		self.calls = []
+
+	def quotes(self, coinId, convert=None, convert_id=None):
+		self.calls.append(coinId)
+		return self.responses.pop(0)
+
+def quoted(*coins):
+	return {'status' : {'error_code' : 0}, 'data' : {
+		str(i) : {'id' : i, 'symbol' : 'C{}'.format(i), 'quote' : {'USD' : {'price' : price, 'volume_24h' : volume}}}
+		for i, price, volume in coins
+	}}
+
+def test_watch_groups():
+	from pyCMC.watch import groups
+
+	assert groups(['1', '22', '333'], max_length=7) == ['1,22', '333']
+	assert groups(['1', '22', '333']) == ['1,22,333']
+	assert groups([]) == []
+
+def test_watch_yields_changed_fields():
+	from pyCMC.watch import QuoteWatcher
+
+	cmc = Quotes(
+		quoted((1, 10.0, 5.0), (2, 20.0, 6.0)),
+		quoted((1, 10.0, 5.0), (2, 21.0, 6.0)),
+		{'status' : {'error_code' : 500, 'error_message' : 'boom'}},
+		quoted((1, 11.0, 7.0), (2, 21.0, 6.0)),
+	)
+	watcher = QuoteWatcher(cmc, '1, 2,1', period=0, polls=4, fields=('price', 'volume_24h'))
+	assert watcher.poll() == [
+		{'id' : '1', 'symbol' : 'C1', 'last_updated' : None, 'quote' : {'USD' : {'price' : 10.0, 'volume_24h' : 5.0}}},
+		{'id' : '2', 'symbol' : 'C2', 'last_updated' : None, 'quote' : {'USD' : {'price' : 20.0, 'volume_24h' : 6.0}}},
+	]
+	assert watcher.poll() == [{'id' : '2', 'symbol' : 'C2', 'last_updated' : None, 'quote' : {'USD' : {'price' : 21.0}}}]
+
+	# A failed poll yields nothing and keeps the last values to compare with.
+	assert watcher.poll() == [] and watcher.status['error_code'] == 500
+	assert [d['quote'] for d in watcher.poll()] == [{'USD' : {'price' : 11.0, 'volume_24h' : 7.0}}]
+	assert cmc.calls == ['1,2'] * 4
+
+	watcher = QuoteWatcher(Quotes(quoted((1, 10.0, 5.0)), quoted((1, 12.0, 5.0))), '1', period=0, initial=False, polls=2)
+	assert [d['quote'] for d in watcher] == [{'USD' : {'price' : 12.0}}]
+
+def test_watch_schedule():
+	from pyCMC.watch import QuoteWatcher
+
+	watcher = QuoteWatcher(None, '1', period=60, lag=2)
+	assert watcher._next(1000.0) == 1060.0
+	watcher.updated = 900.0
+	assert watcher._next(901.0) == 902.0
+	assert watcher._next(1000.0) == 1022.0
+
+def test_watch_over_mock(server):
+	cmc = client(server.root_url)
+	before = server.requests.get('cryptocurrency/quotes/latest', 0)
+	deltas = list(cmc.watch(['1', '2'], period=0.1, polls=2))
+	assert sorted(d['id'] for d in deltas) == ['1', '2']
+	assert set(deltas[0]['quote']['USD']) == {'price', 'volume_24h', 'market_cap'}
+	assert server.requests['cryptocurrency/quotes/latest'] == before + 2
+
+#%% Metadata cache
+
+def test_metadata_cache_store(tmp_path):
+	from pyCMC.metacache import MetadataCache
+
+	root = str(tmp_path / 'meta')
+	cache = MetadataCache(root)
+	cache.put({'1' : {'id' : 1, 'name' : 'A'}, '2' : {'id' : 2, 'name' : 'B'}, '3' : {'name' : 'A', 'id' : 1}})
+	assert len(cache.objects) == 2
+	size = os.path.getsize(cache.pack_path)
+
+	# Unchanged records cost no write.
+	cache.put({'1' : {'id' : 1, 'name' : 'A'}})
+	assert os.path.getsize(cache.pack_path) == size
+
+	found, missing = cache.get(['3', '2', 4])
+	assert found == {'3' : {'id' : 1, 'name' : 'A'}, '2' : {'id' : 2, 'name' : 'B'}}
+	assert missing == ['4']
+
+	# A second instance on the same root sees the first one's records and adds its own.
+	other = MetadataCache(root)
+	other.put({'5' : {'id' : 5}})
+	cache.put({'6' : {'id' : 6}})
+	assert sorted(MetadataCache(root).ids) == ['1', '2', '3', '5', '6']
+
+	stale = MetadataCache(root, max_age=0)
+	assert stale.get(['1']) == ({}, ['1'])
+	for c in (cache, other, stale):
+		c.close()
+
+	# An unreadable pack means a refetch, not an exception.
+	with open(os.path.join(root, 'objects.pack'), 'r+b') as f:
+		f.write(b'garbage')
+	broken = MetadataCache(root)
+	assert broken.get(['1'])[1] == ['1']
+	broken.close()
+
+def test_metadata_served_from_disk(server, tmp_path):
+	cmc = client(server.root_url, metadata_cache=str(tmp_path / 'meta'))
+	before = server.requests.get('cryptocurrency/info', 0)
+
+	first = cmc.metadata(coinId='1,2,3')
+	assert first['status']['cached'] == 0 and sorted(first['data']) == ['1', '2', '3']
+	second = cmc.metadata(coinId='3,2,4')
+	assert second['status']['cached'] == 2 and list(second['data']) == ['3', '2', '4']
+	assert second['data']['2'] == first['data']['2']
+	assert server.requests['cryptocurrency/info'] == before + 2
+
+	again = client(server.root_url, metadata_cache=str(tmp_path / 'meta'))
+	assert again.metadata(coinId='1,4')['status'] == {'error_code' : 0, 'error_message' : None, 'credit_count' : 0, 'cached' : 2}
+	assert again.metadata(coinId='999999')['status']['error_code'] == 400
+	assert server.requests['cryptocurrency/info'] == before + 3
+
+#%% Singleflight
+
+def test_singleflight_shares_one_call():
+	from pyCMC.flight import Singleflight
+
+	flight = Singleflight()
+	calls = []
+
+	def call(url, parameters):
+		calls.append(parameters)
+		time.sleep(0.2)
+		return {'data' : {'ids' : parameters['id']}}
+
+	ids = ['1,2', '2, 1'] * 5 + ['3']
+	with ThreadPoolExecutor(len(ids)) as pool:
+		results = list(pool.map(lambda i: flight.do('quotes', call, 'url', {'id' : i}), ids))
+
+	assert len(calls) == 2 and flight.shared == 9 and len(flight) == 0
+	assert all(r == results[0] for r in results[:10]) and results[10] == {'data' : {'ids' : '3'}}
+	assert len({id(r) for r in results}) == len(ids)
+	assert len({id(r['data']) for r in results}) == len(ids)
+
+	# Nothing is kept once the call returns.
+	flight.do('quotes', call, 'url', {'id' : '1,2'})
+	assert len(calls) == 3
+
+def test_singleflight_shares_errors():
+	from pyCMC.flight import Singleflight
+
+	flight = Singleflight()
+
+	def call(url, parameters):
+		time.sleep(0.2)
+		raise ValueError('boom')
+
+	def do(_):
+		try:
+			flight.do('quotes', call, 'url', {'id' : '1'})
+		except ValueError as e:
+			return str(e)
+
+	with ThreadPoolExecutor(5) as pool:
+		assert list(pool.map(do, range(5))) == ['boom'] * 5
+	assert flight.shared == 4 and len(flight) == 0
+
+def test_client_shares_inflight_requests():
+	with MockServer(Universe(coins=10, inactive=0, pairs=1), latency=0.2) as slow:
+		cmc = client(slow.root_url)
+		with ThreadPoolExecutor(8) as pool:
+			results = list(pool.map(lambda _: cmc.quotes(coinId='1,2'), range(8)))
+		assert slow.requests == {'cryptocurrency/quotes/latest' : 1}
+		assert cmc.singleflight.shared == 7
+
+		results[0]['data']['1']['quote'].clear()
+		assert all(r['data']['1']['quote'] for r in results[1:])
+
+		cmc = client(slow.root_url, singleflight=False)
+		with ThreadPoolExecutor(4) as pool:
+			list(pool.map(lambda _: cmc.quotes(coinId='1,2'), range(4)))
+		assert slow.requests == {'cryptocurrency/quotes/latest' : 5}
+
+#%% Indicators
+
+# OHLCV response for `{coin_id : [(day, close, volume), ...]}`, days in January 2020.
+def ohlcv(coins):
+	return {'status' : {'error_code' : 0}, 'data' : {str(i) : {'id' : i, 'symbol' : 'C{}'.format(i), 'quotes' : [
+		{'time_open' : '2020-01-{:02d}T00:00:00.000Z'.format(day), 'quote' : {'USD' : {
+			'open' : close, 'high' : close * 1.1, 'low' : close * 0.9, 'close' : close, 'volume' : volume, 'market_cap' : close * 100,
+		}}}
+		for day, close, volume in bars
+	]} for i, bars in coins.items()}}
+
+CLOSES = {
+	1 : [10, 11, 12, 11, 13, 14, 12, 15, 16, 14],
+	2 : [5, 4, 6, None, None, 7, 8, 6, 5, 9],
+}
+
+def bars(coinId, days=range(1, 11), shift=0):
+	return [(day, CLOSES[coinId][day - 1] + shift, 100.0 * day) for day in days if CLOSES[coinId][day - 1] is not None]
+
+def test_panel_aligns_and_fills():
+	np = pytest.importorskip('numpy')
+	from pyCMC.indicators import Panel
+
+	panel = Panel(ohlcv({1 : bars(1), 2 : bars(2)}))
+	assert list(panel.ids) == [1, 2] and panel['close'].shape == (2, 10)
+	assert (panel.price, panel.volume, panel.convert) == ('close', 'volume', 'USD')
+	assert list(panel.present[1]) == [True] * 3 + [False] * 2 + [True] * 5
+	assert list(panel['close'][1, 2:6]) == [6, 6, 6, 7]
+	assert np.isnan(panel['volume'][1, 3:5]).all()
+
+	unfilled = Panel(ohlcv({2 : bars(2)}), fill=None)
+	assert unfilled.size == 8
+
+	# Earlier bars move the columns, and bars already present are replaced.
+	panel = Panel(ohlcv({1 : bars(1, range(5, 11))}))
+	assert panel.append(ohlcv({1 : bars(1, range(1, 6), shift=1)})) == 0
+	assert list(panel['close'][0]) == [11, 12, 13, 12, 14, 14, 12, 15, 16, 14]
+	with pytest.raises(ValueError):
+		panel.append({'status' : {'error_code' : 400, 'error_message' : 'boom'}})
+
+def test_indicators_match_reference():
+	np = pytest.importorskip('numpy')
+	from pyCMC.indicators import EMA, SMA, VWAP, Drawdown, Engine, MaxDrawdown, Panel, Returns, Volatility
+
+	panel = Panel(ohlcv({1 : bars(1), 2 : bars(2)}))
+	engine = Engine(panel, [Returns(), SMA(3), EMA(4), Volatility(3), VWAP(), Drawdown(), MaxDrawdown()])
+	assert engine.names() == ['returns_1', 'sma_3', 'ema_4', 'volatility_3', 'vwap', 'drawdown', 'max_drawdown']
+
+	x = panel['close']
+	returns = np.full_like(x, np.nan)
+	returns[:, 1:] = x[:, 1:] / x[:, :-1] - 1
+	sma = np.full_like(x, np.nan)
+	vol = np.full_like(x, np.nan)
+	logs = np.log(x[:, 1:] / x[:, :-1])
+	for t in range(2, 10):
+		sma[:, t] = x[:, t - 2:t + 1].mean(axis=1)
+	for t in range(3, 10):
+		vol[:, t] = logs[:, t - 3:t].std(axis=1, ddof=1)
+	ema = x.copy()
+	for t in range(1, 10):
+		ema[:, t] = ema[:, t - 1] + 0.4 * (x[:, t] - ema[:, t - 1])
+	typical = (panel['high'] + panel['low'] + panel['close']) / 3
+	volume = np.nan_to_num(panel['volume'])
+	vwap = np.cumsum(volume, axis=1) / np.cumsum(volume / typical, axis=1)
+	drawdown = x / np.maximum.accumulate(x, axis=1) - 1
+
+	for name, expected in [
+		('returns_1', returns), ('sma_3', sma), ('ema_4', ema), ('volatility_3', vol),
+		('vwap', vwap), ('drawdown', drawdown), ('max_drawdown', np.minimum.accumulate(drawdown, axis=1)),
+	]:
+		np.testing.assert_allclose(engine[name], expected, err_msg=name)
+
+def test_indicators_update_incrementally():
+	np = pytest.importorskip('numpy')
+	from pyCMC.indicators import EMA, SMA, VWAP, Drawdown, Engine, MaxDrawdown, Panel, Returns, Volatility
+
+	indicators = lambda: [Returns(), SMA(3), EMA(4), Volatility(3), VWAP(), VWAP(3), Drawdown(), MaxDrawdown()]
+
+	engine = Engine(Panel(ohlcv({1 : bars(1, range(1, 7))})), indicators())
+	assert engine.append(ohlcv({1 : bars(1, range(6, 11)), 2 : bars(2)})) == 0
+	assert engine.append(ohlcv({1 : bars(1, [9, 10], shift=3)})) == 8
+	assert engine.append(ohlcv({2 : bars(2, [3], shift=-1)})) == 2
+
+	final = {1 : bars(1, range(1, 9)) + bars(1, [9, 10], shift=3), 2 : bars(2)}
+	final[2][2] = (3, 5, 300.0)
+	full = Engine(Panel(ohlcv(final)), indicators())
+	for name in full.names():
+		np.testing.assert_allclose(engine[name], full[name], err_msg=name)
+
+def test_indicators_over_mock(server):
+	pytest.importorskip('numpy')
+	from pyCMC.indicators import Engine, Panel, SMA
+
+	cmc = client(server.root_url)
+	response = cmc.ohlcv_historical(coinId='1,2,3', time_start='2020-01-01', time_end='2020-03-01')
+	engine = Engine(Panel(response), [SMA(7)])
+	assert engine['sma_7'].shape == (3, 61)
+	assert (engine['sma_7'][:, 6:] > 0).all()